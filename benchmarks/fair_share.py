@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import random
+import sys
+from heapq import heappush, heappop
+
+from pydra.cluster.master.fair_share import FairShare
+from pydra.cluster.master.ready_queue import ReadyQueue
+
+
+class SimTask(object):
+    """
+    Stand-in for TaskInstance with the state used for scoring.
+    """
+    def __init__(self, task_key, user, queued, workunits, duration):
+        self.task_key = task_key
+        self.user = user
+        self.priority = 5
+        self.queued = queued
+        self.remaining = workunits
+        self.running = 0
+        self.duration = duration
+        self.completed = None
+
+    def compute_score(self):
+        return (self.priority, self.queued)
+
+
+def build_jobs(large_jobs, large_workunits, small_jobs, small_workunits,
+               small_interval):
+    """
+    Builds a flood of large jobs queued at time 0 followed by small jobs
+    arriving every `small_interval` seconds.
+    """
+    jobs = []
+    for i in xrange(large_jobs):
+        jobs.append(SimTask('large%d' % i, 'bulk', 0, large_workunits, 1.0))
+    for i in xrange(small_jobs):
+        jobs.append(SimTask('small%d' % i, 'user%d' % (i % 3), \
+                    10 + i * small_interval, small_workunits, 1.0))
+    return jobs
+
+
+def simulate(jobs, workers, fair_share=None, update_interval=5, seed=0):
+    """
+    Runs a discrete event simulation of dispatching workunits to workers,
+    recording the time each job completed.  Workunit durations vary randomly
+    around the job's duration.
+    """
+    rand = random.Random(seed)
+    if fair_share:
+        score = lambda task: fair_share.score(task, now)
+    else:
+        score = lambda task: task.compute_score()
+
+    arrivals = sorted(jobs, key=lambda task: task.queued)
+    arrivals.reverse()
+    ready = ReadyQueue()
+    idle = ['worker%d' % i for i in xrange(workers)]
+    events = []  # (completion time, worker, task)
+    now = 0
+    next_update = update_interval
+
+    while arrivals or events:
+        # advance to the next arrival or completion
+        if events and (not arrivals or events[0][0] <= arrivals[-1].queued):
+            now, worker, task = heappop(events)
+            task.running -= 1
+            if fair_share:
+                fair_share.stop(worker, now)
+            if not task.remaining and not task.running:
+                task.completed = now
+            idle.append(worker)
+        else:
+            task = arrivals.pop()
+            now = task.queued
+            ready.add(task, score(task))
+
+        if now >= next_update:
+            ready.rescore(score)
+            next_update = now + update_interval
+
+        # dispatch to all idle workers
+        while idle:
+            task = ready.pop()
+            if task is None:
+                break
+            worker = idle.pop()
+            task.remaining -= 1
+            task.running += 1
+            if fair_share:
+                fair_share.start(worker, task, now)
+            duration = task.duration * rand.uniform(0.5, 1.5)
+            heappush(events, (now + duration, worker, task))
+            if task.remaining:
+                ready.add(task, score(task))
+
+
+def report(name, jobs):
+    small = [task.completed - task.queued for task in jobs \
+                if task.task_key.startswith('small')]
+    large = [task.completed - task.queued for task in jobs \
+                if task.task_key.startswith('large')]
+    small.sort()
+    print '%-10s small jobs: mean %8.1fs  median %8.1fs  max %8.1fs' % \
+            (name, sum(small) / len(small), small[len(small)/2], small[-1])
+    print '%-10s large jobs: mean %8.1fs  max %8.1fs' % \
+            ('', sum(large) / len(large), max(large))
+
+
+def main(workers=20, large_jobs=5, large_workunits=5000, small_jobs=30,
+         small_workunits=20, small_interval=20):
+    """
+    Simulates a cluster flooded by large jobs from one user while other users
+    submit small jobs.  Compares the latency of the small jobs when ordering
+    tasks by priority and queue time with fair-share ordering.
+
+    usage: fair_share.py [workers] [large_jobs] [large_workunits]
+                         [small_jobs] [small_workunits] [small_interval]
+    """
+    print 'workers: %d  large jobs: %d x %d workunits  ' \
+          'small jobs: %d x %d workunits every %ds' % (workers, large_jobs, \
+          large_workunits, small_jobs, small_workunits, small_interval)
+
+    for name, fair_share in (('queued', None), ('fair share', FairShare())):
+        jobs = build_jobs(large_jobs, large_workunits, small_jobs, \
+                          small_workunits, small_interval)
+        simulate(jobs, workers, fair_share)
+        report(name, jobs)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
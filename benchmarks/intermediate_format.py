@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from pydra.cluster.tasks.slicer import FileBlockOutput, FileBlockSubslicer, \
+    FilePickleOutput, FileUnpicleSubslicer
+
+
+class Directory(object):
+    """
+    Directory datasource with the interface the file subslicers use.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, key):
+        return self._load(key)
+
+    def _load(self, key, mode='r'):
+        return open(os.path.join(self.path, key[0]), mode + 'b')
+
+
+def build_outputs(maps, keys, values):
+    """
+    Builds map outputs resembling a word count: sorted word keys with a list
+    of small integer counts.
+    """
+    random.seed(0)
+    words = sorted(['word%d' % random.randint(0, keys * 10) \
+                    for k in xrange(keys)])
+    outputs = []
+    for m in xrange(maps):
+        outputs.append([(word, [random.randint(1, 5) for v in xrange(values)]) \
+                        for word in words])
+    return outputs
+
+
+def run(output, input, outputs, path):
+    start = time.time()
+    for m, tuples in enumerate(outputs):
+        output.dump('map%d' % m, tuples)
+    dumped = time.time()
+
+    input.input = ['map%d' % m for m in xrange(len(outputs))]
+    for k, vs in input:
+        pass
+    read = time.time()
+
+    size = sum([os.path.getsize(os.path.join(path, name)) \
+                for name in os.listdir(path)])
+    return size, dumped - start, read - dumped
+
+
+def main(maps=8, keys=20000, values=3):
+    """
+    Compares the intermediate results file formats: a stream of pickles and
+    compressed blocks of records.  Reports the bytes written and the time to
+    write and read the outputs of the maps.
+
+    usage: intermediate_format.py [maps] [keys] [values]
+    """
+    outputs = build_outputs(maps, keys, values)
+    print 'maps: %d  keys per map: %d  values per key: %d' % \
+            (maps, keys, values)
+
+    for name, output_class, input_class in (
+            ('pickle', FilePickleOutput, FileUnpicleSubslicer),
+            ('blocks', FileBlockOutput, FileBlockSubslicer)):
+        path = tempfile.mkdtemp()
+        try:
+            dir = Directory(path)
+            size, write, read = run(output_class(dir), input_class(dir=dir), \
+                                    outputs, path)
+        finally:
+            shutil.rmtree(path)
+        print '%-8s bytes: %10d  write: %7.3fs  read: %7.3fs' % \
+                (name, size, write, read)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
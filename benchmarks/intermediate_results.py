@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import MySQLdb
+import MySQLdb.cursors
+
+from pydra.cluster.tasks.slicer import FilePickleOutput, \
+    FileUnpicleSubslicer, SQLTableKeyInput, SQLTableOutput
+import pydra_settings
+
+
+TABLE = 'pydra_benchmark_i9e'
+
+
+class Directory(object):
+    """
+    Directory datasource with the interface the file subslicers use.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, key):
+        return self._load(key)
+
+    def _load(self, key, mode='r'):
+        return open(os.path.join(self.path, key[0]), mode + 'b')
+
+
+class Database(object):
+    """
+    Database datasource with the interface the SQL subslicers use.  Cursors
+    are server side so reads are streamed.
+    """
+    def __init__(self):
+        self.connection = MySQLdb.connect(
+            host=pydra_settings.DATABASE_HOST or 'localhost',
+            user=pydra_settings.DATABASE_USER,
+            passwd=pydra_settings.DATABASE_PASSWORD,
+            db=pydra_settings.DATABASE_NAME,
+            cursorclass=MySQLdb.cursors.SSCursor)
+
+    def load(self, key):
+        return self.connection.cursor()
+
+
+class SQLRowOutput(SQLTableOutput):
+    """
+    SQLTableOutput as it was: one INSERT statement per value.
+    """
+    def dump(self, key, tuples):
+        c = self.db.load(None)
+        for k, vals in tuples:
+            for v in vals:
+                c.execute("INSERT INTO %s (`partition`, k, v) " \
+                          "VALUES ('%s', '%s', '%s')" % \
+                          (self.table, key, k, str(v)))
+
+
+class SQLRowInput(SQLTableKeyInput):
+    """
+    SQLTableKeyInput as it was: rows read with fetchone().
+    """
+    def __iter__(self):
+        c = self.kwargs['db'].load(None)
+        for partition in self.input:
+            c.execute("SELECT k, v FROM %s WHERE `partition` = '%s'" % \
+                      (self.kwargs['table'], partition))
+            row = c.fetchone()
+            while row:
+                yield row
+                row = c.fetchone()
+
+
+def build_outputs(maps, keys, values):
+    outputs = []
+    for m in xrange(maps):
+        outputs.append([('key%06d' % k, range(values)) for k in xrange(keys)])
+    return outputs
+
+
+def run(output, input, outputs):
+    start = time.time()
+    for m, tuples in enumerate(outputs):
+        output.dump('map%d' % m, tuples)
+    dumped = time.time()
+
+    input.input = ['map%d' % m for m in xrange(len(outputs))]
+    records = 0
+    for k, v in input:
+        records += 1
+    return dumped - start, time.time() - dumped, records
+
+
+def main(maps=4, keys=2500, values=4):
+    """
+    Measures the time to write and read intermediate results through the
+    SQL backend, before and after batching inserts and reads, and through the
+    file backend.  The SQL backend uses the database of pydra_settings.  A
+    scratch table is created and dropped.
+
+    usage: intermediate_results.py [maps] [keys] [values]
+    """
+    outputs = build_outputs(maps, keys, values)
+    print 'maps: %d  keys per map: %d  values per key: %d' % \
+            (maps, keys, values)
+
+    db = Database()
+    tempdir = tempfile.mkdtemp()
+    dir = Directory(tempdir)
+    backends = (
+        ('sql per row', SQLRowOutput(db, TABLE), \
+                        SQLRowInput(db=db, table=TABLE)),
+        ('sql batched', SQLTableOutput(db, TABLE), \
+                        SQLTableKeyInput(db=db, table=TABLE)),
+        ('files', FilePickleOutput(dir), FileUnpicleSubslicer(dir=dir)),
+    )
+
+    try:
+        for name, output, input in backends:
+            c = db.load(None)
+            c.execute('DROP TABLE IF EXISTS %s' % TABLE)
+            SQLTableOutput(db, TABLE).create_table()
+            write, read, records = run(output, input, outputs)
+            print '%-12s write: %8.3fs  read: %8.3fs  records: %d' % \
+                    (name, write, read, records)
+    finally:
+        db.load(None).execute('DROP TABLE IF EXISTS %s' % TABLE)
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import reactor
+
+from pydra.cluster.tasks.mapreduce import IntermediateResultsFiles, \
+    MapReduceTask
+from pydra.cluster.tasks.tasks import Task
+
+
+class Directory(object):
+    """
+    Directory datasource with the interface the file subslicers use.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, key):
+        return self._load(key)
+
+    def _load(self, key, mode='r'):
+        return open(os.path.join(self.path, key[0]), mode + 'b')
+
+
+class Input(object):
+    """
+    Input datasource: a few short lists of words.
+    """
+    data = {'k1': ['one', 'two'], 'k2': ['two', 'three']}
+
+    def __iter__(self):
+        return iter(sorted(self.data))
+
+    def load(self, key):
+        return self.data[key]
+
+
+class MapWords(Task):
+    def work(self, input, output, **kwargs):
+        for word in input:
+            output[word] = 1
+
+
+class ReduceWords(Task):
+    def work(self, input, output, **kwargs):
+        for word, counts in input:
+            output[word] = output.get(word, 0) + sum(counts)
+
+
+class LocalWorker(object):
+    """
+    Stands in for the worker and master.  Requested work units are run in
+    this process on the next reactor iteration, as soon as they are
+    requested, so only the overhead of the MapReduceTask is measured.
+    """
+    worker_key = 'localhost:0:0'
+
+    def __init__(self, task):
+        self.task = task
+
+    def get_worker(self):
+        return self
+
+    def get_key(self):
+        return None
+
+    def request_worker(self, subtask_key, args, workunit):
+        reactor.callLater(0, self.run, subtask_key, args, workunit)
+
+    def run(self, subtask_key, args, workunit):
+        if subtask_key == self.task.maptask.get_key():
+            wrapper = self.task.maptask
+        else:
+            wrapper = self.task.reducetask
+        result = wrapper._start(dict(args))
+        self.task._work_unit_complete(result, workunit)
+
+
+def main(jobs=100, reducers=2):
+    """
+    Measures the start to completion latency of trivial MapReduce jobs run
+    one after another.  Work units run in process as soon as they are
+    requested, so the latency is the overhead of the MapReduceTask itself.
+
+    usage: mapreduce_latency.py [jobs] [reducers]
+    """
+    path = tempfile.mkdtemp()
+
+    class CountWords(MapReduceTask):
+        input = Input()
+        map = MapWords
+        reduce = ReduceWords
+        intermediate = IntermediateResultsFiles(Directory(path))
+
+    CountWords.reducers = reducers
+    latencies = []
+
+    def run_job(results=None, started=None):
+        if started is not None:
+            latencies.append(time.time() - started)
+        if len(latencies) == jobs:
+            reactor.stop()
+            return
+        task = CountWords('countwords%d' % len(latencies))
+        task.output = {}
+        task.parent = LocalWorker(task)
+        task._start({}, run_job, {'started': time.time()})
+
+    reactor.callWhenRunning(run_job)
+    try:
+        reactor.run()
+    finally:
+        shutil.rmtree(path)
+
+    latencies.sort()
+    print 'jobs: %d  reducers: %d' % (jobs, reducers)
+    print 'latency mean: %.2fms  median: %.2fms  max: %.2fms' % \
+            (sum(latencies) / len(latencies) * 1000, \
+            latencies[len(latencies) / 2] * 1000, latencies[-1] * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import gc
+import os
+import sys
+import time
+
+from pydra.config import configure_django_settings
+configure_django_settings()
+
+import simplejson
+
+from pydra.models import TaskInstance, WorkUnit, WorkRequest
+
+
+def rss():
+    """
+    Returns the resident memory of this process in bytes.  Linux only.
+    """
+    pages = int(open('/proc/self/statm').read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def workunit_list(task_instance, requests):
+    """
+    Queue used before: a list of unsaved WorkUnit models, popped from the
+    front.
+    """
+    queue = []
+    for i in xrange(requests):
+        job = WorkUnit()
+        job.task_instance = task_instance
+        job.subtask_key = 'Task.SubTask'
+        job.args = simplejson.dumps({'data':i})
+        job.workunit = i
+        queue.append(job)
+    return queue, lambda: queue.pop(0)
+
+
+def request_deque(task_instance, requests):
+    """
+    Queue used by TaskInstance: a deque of WorkRequest records.
+    """
+    task_instance._worker_requests.clear()
+    for i in xrange(requests):
+        task_instance.queue_worker_request(WorkRequest('Task.SubTask', i, \
+                                        simplejson.dumps({'data':i})))
+    return task_instance._worker_requests, task_instance.pop_worker_request
+
+
+def main(requests=100000):
+    """
+    Measures the memory used by pending worker requests and the time to
+    drain them.  Compares a list of WorkUnit models with the deque of
+    WorkRequest records TaskInstance now uses.
+
+    Django must be configured with the pydra settings; nothing is written
+    to the database.
+
+    usage: request_queue.py [requests]
+    """
+    task_instance = TaskInstance()
+    task_instance.task_key = 'Task'
+    print 'pending requests: %d' % requests
+
+    # the deque is measured first so memory it frees can only make the list
+    # appear smaller
+    for name, build in (('request deque', request_deque),
+                        ('workunit list', workunit_list)):
+        gc.collect()
+        before = rss()
+        start = time.time()
+        queue, pop = build(task_instance, requests)
+        built = time.time() - start
+        used = rss() - before
+
+        start = time.time()
+        while queue:
+            pop()
+        drained = time.time() - start
+        del queue
+        print '%-14s memory: %8.1f MB (%5d bytes/request)  queue: %7.3fs' \
+              '  drain: %7.3fs' % (name, used / 1048576.0, used / requests, \
+                                    built, drained)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
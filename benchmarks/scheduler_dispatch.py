@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import sys
+import time
+from datetime import datetime, timedelta
+from heapq import heappush
+from threading import Lock
+
+from pydra.cluster.master.ready_queue import ReadyQueue
+
+
+class FakeTaskInstance(object):
+    """
+    Stand-in for TaskInstance that keeps only the scheduling related state.
+    Polling requests takes a lock just as TaskInstance.poll_worker_request
+    does.
+    """
+    def __init__(self, id, queued):
+        self.id = id
+        self.priority = 5
+        self.queued = queued
+        self._worker_requests = []
+        self._request_lock = Lock()
+
+    def compute_score(self):
+        return (self.priority, self.queued)
+
+    def poll_worker_request(self):
+        with self._request_lock:
+            try:
+                return self._worker_requests[0]
+            except IndexError:
+                return None
+
+
+def build_tasks(queued_tasks, ready_tasks):
+    start = datetime.now()
+    tasks = [FakeTaskInstance(i, start + timedelta(0, i)) \
+                for i in xrange(queued_tasks)]
+    # the tasks with requests are the most recently queued ones, the worst
+    # case for the linear scan.
+    for task in tasks[-ready_tasks:]:
+        task._worker_requests.append('workunit')
+    return tasks
+
+
+def linear_scan(tasks, dispatches):
+    queue = []
+    for task in tasks:
+        heappush(queue, [task.compute_score(), task])
+
+    start = time.time()
+    for i in xrange(dispatches):
+        for item in queue:
+            job = item[1].poll_worker_request()
+            if job:
+                break
+    return time.time() - start
+
+
+def ready_queue(tasks, dispatches):
+    ready = ReadyQueue()
+    for task in tasks:
+        if task._worker_requests:
+            ready.add(task, task.compute_score())
+
+    start = time.time()
+    for i in xrange(dispatches):
+        task = ready.peek()
+        while task is not None:
+            job = task.poll_worker_request()
+            if job:
+                break
+            ready.discard(task)
+            task = ready.peek()
+        # simulate the scheduler discarding and re-adding the task
+        ready.discard(task)
+        ready.add(task, task.compute_score())
+    return time.time() - start
+
+
+def main(queued_tasks=10000, ready_tasks=10, dispatches=200):
+    """
+    Measures the latency of finding the next task to dispatch with many tasks
+    queued.  Compares the linear scan TaskScheduler used to perform over its
+    queue with the ReadyQueue index.
+
+    Only a few of the queued tasks have pending worker requests.  This is the
+    common case on a busy cluster: most queued tasks are running and waiting
+    on results rather than waiting on workers.
+
+    usage: scheduler_dispatch.py [queued_tasks] [ready_tasks] [dispatches]
+    """
+    tasks = build_tasks(queued_tasks, ready_tasks)
+
+    print 'queued tasks: %d  ready tasks: %d  dispatches: %d' % \
+            (queued_tasks, ready_tasks, dispatches)
+    for name, func in (('linear scan', linear_scan),
+                       ('ready queue', ready_queue)):
+        elapsed = func(tasks, dispatches)
+        print '%-12s total: %8.4fs  per dispatch: %8.2fus' % \
+                (name, elapsed, elapsed / dispatches * 1000000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
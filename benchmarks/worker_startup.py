@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+from subprocess import Popen, PIPE
+
+# stand-in for a worker process: imports what a worker imports, reports that
+# it is ready, then runs one workunit per line read from stdin.
+WORKER = """
+import sys, time
+start = time.time()
+for module in sys.argv[1:]:
+    __import__(module)
+sys.stdout.write('ready %f\\n' % (time.time() - start))
+sys.stdout.flush()
+for line in iter(sys.stdin.readline, ''):
+    sum(xrange(1000))
+    sys.stdout.write('done\\n')
+    sys.stdout.flush()
+"""
+
+MODULES = ['twisted.spread.pb', 'twisted.internet.reactor', 'simplejson',
+           'pydra.cluster.worker.worker_task_controls']
+
+
+def start_worker(modules):
+    return Popen([sys.executable, '-c', WORKER] + modules, stdin=PIPE,
+                 stdout=PIPE)
+
+
+def run_workunit(worker):
+    worker.stdin.write('workunit\n')
+    worker.stdin.flush()
+    worker.stdout.readline()
+
+
+def stop_worker(worker):
+    worker.stdin.close()
+    worker.wait()
+
+
+def cold(modules):
+    """
+    time to first workunit when the worker is started for the work
+    """
+    start = time.time()
+    worker = start_worker(modules)
+    line = worker.stdout.readline()
+    if not line.startswith('ready'):
+        raise RuntimeError('worker failed to start')
+    run_workunit(worker)
+    elapsed = time.time() - start
+    stop_worker(worker)
+    return elapsed
+
+
+def warm(modules):
+    """
+    time to first workunit when a pooled worker was started ahead of the work
+    """
+    worker = start_worker(modules)
+    line = worker.stdout.readline()
+    if not line.startswith('ready'):
+        raise RuntimeError('worker failed to start')
+    start = time.time()
+    run_workunit(worker)
+    elapsed = time.time() - start
+    stop_worker(worker)
+    return elapsed
+
+
+def main(runs=5, *modules):
+    """
+    Measures the time from work arriving at a node to the first workunit
+    completing, with and without a pool of pre-started workers.  Workers are
+    simulated by processes importing the modules a worker imports; the RSA
+    authentication a real worker also performs is not included so the cold
+    start times are a lower bound.
+
+    Modules that cannot be imported are skipped.
+
+    usage: worker_startup.py [runs] [module ...]
+    """
+    runs = int(runs)
+    modules = list(modules) or MODULES
+    available = []
+    for module in modules:
+        try:
+            __import__(module)
+            available.append(module)
+        except ImportError:
+            print 'skipping %s: not importable' % module
+
+    print 'runs: %d  modules: %s' % (runs, ', '.join(available))
+    for name, func in (('cold', cold), ('warm', warm)):
+        times = [func(available) for i in xrange(runs)]
+        print '%-5s mean: %8.2fms  min: %8.2fms' % \
+                (name, sum(times) / runs * 1000, min(times) * 1000)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -94,6 +94,79 @@ TASKS_SYNC_CACHE  = '%s/task_sync_cache' % RUNTIME_FILES_DIR
 # Automatically add nodes found with autodiscovery 
 MULTICAST_ALL = False 
 
+# Workunit batching.  The scheduler groups workunits into batches sized so that
+# each batch takes roughly BATCH_TARGET_DURATION seconds to run.  The size is
+# based on a moving average of how long workunits of the same subtask took.
+# Batches will never contain more than BATCH_SIZE_MAX workunits.
+BATCH_TARGET_DURATION = 5
+BATCH_SIZE_MAX = 1000
+
+# Partial batch results.  Workers running a batch send the results of finished
+# workunits to the master once BATCH_FLUSH_SIZE results are waiting, or
+# BATCH_FLUSH_INTERVAL seconds after they last sent results, rather than only
+# when the whole batch is complete.  0 disables either trigger.
+BATCH_FLUSH_SIZE = 0
+BATCH_FLUSH_INTERVAL = 0
+
+# Number of batches the scheduler may queue on a busy worker.  Queued batches
+# are started by the worker as soon as its current batch completes, hiding the
+# round trip to the master between batches.  0 disables prefetching.
+WORKER_PREFETCH_DEPTH = 0
+
+# Workunits are preferred on workers close to their data: the node running the
+# task's main worker or nodes reported by the task.  When no local worker is
+# idle, a task may wait up to LOCALITY_DELAY seconds for one before running on
+# any idle worker.  0 places work immediately.
+LOCALITY_DELAY = 0
+
+# Fair-share scheduling.  Workers are shared between the users queueing tasks
+# (or task keys, when the user is unknown) so a large job cannot starve small
+# ones.  Worker time consumed counts half as much after FAIR_SHARE_HALF_LIFE
+# seconds.  FAIR_SHARE_WEIGHTS maps users or task keys to a relative share,
+# eg. {'alice':2} gives alice twice the share of other users.
+FAIR_SHARE = False
+FAIR_SHARE_HALF_LIFE = 300
+FAIR_SHARE_WEIGHTS = {}
+
+# WorkUnits are written to the database in bulk rather than one query per
+# change.  Pending changes are written every WORKUNIT_FLUSH_INTERVAL seconds,
+# as soon as WORKUNIT_FLUSH_SIZE WorkUnits are pending, before a task is
+# reported finished and when the master shuts down.  Changes made since the
+# last write are lost if the master crashes.
+WORKUNIT_FLUSH_INTERVAL = 2
+WORKUNIT_FLUSH_SIZE = 1000
+
+# Speculative execution.  Every SPECULATIVE_INTERVAL seconds, workunits that
+# have run longer than SPECULATIVE_MULTIPLE times the median time of their
+# subtask are duplicated on idle workers.  The first copy to finish is used and
+# the other is stopped.  The median is used once SPECULATIVE_MIN_SAMPLES
+# workunits of the subtask have completed.
+SPECULATIVE_EXECUTION = False
+SPECULATIVE_INTERVAL = 5
+SPECULATIVE_MULTIPLE = 2
+SPECULATIVE_MIN_SAMPLES = 5
+
+# MapReduce shuffle.  IntermediateResultsShuffle writes map outputs to
+# SHUFFLE_DIR on the node running the map.  Reduces on the same node read them
+# directly, reduces on other nodes stream them through the nodes' shuffle
+# service in chunks of at most SHUFFLE_CHUNK_SIZE bytes.
+SHUFFLE_DIR = '%s/shuffle' % RUNTIME_FILES_DIR
+SHUFFLE_CHUNK_SIZE = 1048576
+
+# Large results.  Workunit results of at least LARGE_RESULT_SIZE bytes
+# (pickled) are stored in SHUFFLE_DIR on the node that produced them.  Only a
+# handle is sent to the main worker, which reads the result from the file when
+# on the same node or streams it through the shuffle service otherwise.  0
+# sends all results directly.
+LARGE_RESULT_SIZE = 0
+
+# Worker pool.  With WORKER_POOL set a node starts a worker process for each
+# core once the master initializes it, instead of when work arrives, and
+# replaces workers as they exit.  Idle workers preload the packages of the
+# WORKER_POOL_PRELOAD tasks most recently run on the node.
+WORKER_POOL = False
+WORKER_POOL_PRELOAD = 3
+
 
 #
 # Cloud Provisioning 
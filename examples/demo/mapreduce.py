@@ -71,6 +71,8 @@ class CountWords(MapReduceTask):
 
     map = MapWords
     reduce = ReduceWords
+    # sums the occurances of each word in a map's output before it is written
+    combine = ReduceWords
 
     intermediate = IntermediateResultsFiles(dir=datasources['dir_i9e'])
     #intermediate = IntermediateResultsSQL(table='count_words_i9e', db=datasources['sql'])
@@ -0,0 +1,139 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import with_statement
+from threading import Lock
+import time
+
+
+class FairShare(object):
+    """
+    Weighted fair-share accounting for the scheduler.
+
+    Workers are shared between share keys: the user that queued a task, or
+    the task key when no user is known.  For each share key FairShare tracks
+    the number of workers currently assigned to it and the worker-seconds it
+    consumed, decayed exponentially with a half life of `half_life` seconds.
+
+    Tasks are ordered by priority first and then by their share key's deficit:
+    running workers and decayed usage divided by the key's weight.  Share keys
+    that used the fewest workers relative to their weight are served first, so
+    a small job is not starved by a flood of workunits from a large one.
+    """
+
+    def __init__(self, half_life=300, weights=None, default_weight=1):
+        """
+        @param half_life - seconds after which consumed worker time counts
+                           half as much
+        @param weights - dictionary of share key -> weight
+        @param default_weight - weight of share keys not in weights
+        """
+        self.half_life = half_life
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._usage = {}    # share key -> [decayed worker-seconds, timestamp]
+        self._running = {}  # share key -> number of assigned workers
+        self._workers = {}  # worker key -> (share key, time assigned)
+        self._lock = Lock()
+
+
+    def share_key(self, task_instance):
+        """
+        Returns the key a task's worker usage is accounted under.
+        """
+        return getattr(task_instance, 'user', None) or task_instance.task_key
+
+
+    def weight(self, key):
+        return float(self.weights.get(key, self.default_weight))
+
+
+    def _decayed(self, key, now):
+        try:
+            usage, timestamp = self._usage[key]
+        except KeyError:
+            return 0
+        if not self.half_life:
+            return usage
+        return usage * 0.5 ** ((now - timestamp) / float(self.half_life))
+
+
+    def usage(self, key, now=None):
+        """
+        Returns the decayed worker-seconds consumed by a share key.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._decayed(key, now)
+
+
+    def charge(self, key, seconds, now=None):
+        """
+        Adds worker-seconds consumed by a share key.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._usage[key] = [self._decayed(key, now) + seconds, now]
+
+
+    def start(self, worker_key, task_instance, now=None):
+        """
+        Records that a worker was assigned to a task.  A worker is accounted
+        to a single share key until stop() is called for it.
+        """
+        now = time.time() if now is None else now
+        key = self.share_key(task_instance)
+        with self._lock:
+            if worker_key in self._workers:
+                return
+            self._workers[worker_key] = (key, now)
+            self._running[key] = self._running.get(key, 0) + 1
+
+
+    def stop(self, worker_key, now=None):
+        """
+        Records that a worker was released, charging its share key for the
+        time it was assigned.  Stopping an untracked worker does nothing.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            try:
+                key, started = self._workers.pop(worker_key)
+            except KeyError:
+                return
+            running = self._running[key] - 1
+            if running:
+                self._running[key] = running
+            else:
+                del self._running[key]
+        self.charge(key, now - started, now)
+
+
+    def score(self, task_instance, now=None):
+        """
+        Computes the scheduling score of a task.  Lower scores are served
+        first.
+        """
+        now = time.time() if now is None else now
+        key = self.share_key(task_instance)
+        weight = self.weight(key)
+        with self._lock:
+            running = self._running.get(key, 0)
+            usage = self._decayed(key, now)
+        return (task_instance.priority, running / weight, usage / weight,
+                task_instance.queued)
@@ -24,6 +24,7 @@ from pydra.cluster.master import *
 from pydra.cluster.master.task_sync import TaskSyncServer
 from pydra.cluster.tasks.task_manager import TaskManager
 from pydra.cluster.master.statistics import StatisticsModule
+from pydra.cluster.tasks.shuffle import MasterShuffleRelay
 
 
 import pydra_settings
@@ -56,7 +57,8 @@ class Master(ModuleManager):
 	    StatisticsModule,
             TwistedWebInterface,
             NodeManager,
-            MasterLogAggregator
+            MasterLogAggregator,
+            MasterShuffleRelay
         ]
 
         if hasattr(pydra_settings, 'cloud_provisioning_support') and pydra_settings.cloud_provisioning_support:
@@ -0,0 +1,130 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+
+
+def worker_node(worker_key):
+    """
+    Returns the key of the node a worker runs on.  Worker keys are composed of
+    the node key and the index of the worker: host:port:index
+    """
+    return worker_key.rsplit(':', 1)[0]
+
+
+def worker_host(worker_key):
+    """
+    Returns the host a worker or node runs on.
+    """
+    return worker_key.split(':', 1)[0]
+
+
+class LocalityPlacement(object):
+    """
+    Placement policy that prefers workers close to the data a workunit needs.
+
+    A workunit's locations are the node of its task's main worker, where
+    intermediate results are written, plus any locations reported for the
+    workunit's data.  Locations may be node keys (host:port) or hosts.  Workers
+    on a location's node score highest, followed by workers on the same host.
+
+    When no local worker is idle the workunit may wait up to `delay` seconds
+    for one before being placed on any idle worker (delay scheduling).  The
+    time a task started waiting is tracked on the task instance.
+    """
+
+    NODE = 2
+    HOST = 1
+    REMOTE = 0
+
+    def __init__(self, delay=0):
+        """
+        @param delay - seconds a task may wait for a local worker
+        """
+        self.delay = delay
+
+    def locations(self, task_instance, job):
+        """
+        Returns the set of locations preferred for a job.
+
+        @param task_instance - task instance the job belongs to
+        @param job - WorkUnit being placed
+        """
+        locations = set()
+        if task_instance.worker and job.subtask_key:
+            locations.add(worker_node(task_instance.worker))
+            locations.add(worker_host(task_instance.worker))
+        if getattr(job, 'locality', None):
+            locations.update(job.locality)
+        return locations
+
+    def score(self, worker_key, locations):
+        """
+        Scores a worker's affinity to a set of locations.
+        """
+        if worker_node(worker_key) in locations:
+            return self.NODE
+        if worker_host(worker_key) in locations:
+            return self.HOST
+        return self.REMOTE
+
+    def select(self, workers, locations):
+        """
+        Selects the worker with the highest affinity to the locations.  Ties
+        go to the worker added to the list last, matching the order workers
+        were taken from the idle pool before placement was added.
+
+        @param workers - list of worker keys
+        @param locations - set of preferred locations
+        @returns (index, score) of the best worker or (None, None)
+        """
+        best, best_score = None, None
+        for i in xrange(len(workers)-1, -1, -1):
+            score = self.score(workers[i], locations)
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+                if score == self.NODE:
+                    break
+        return best, best_score
+
+    def place(self, task_instance, job, workers, now=None):
+        """
+        Chooses an idle worker for a job, applying delay scheduling.
+
+        @param task_instance - task instance the job belongs to
+        @param job - WorkUnit being placed
+        @param workers - list of idle worker keys
+        @param now - current time, defaults to time.time()
+        @returns index of the worker to use, or None if the task should wait
+                 for a local worker.
+        """
+        if not workers:
+            return None
+        locations = self.locations(task_instance, job)
+        index, score = self.select(workers, locations)
+        if not locations or score != self.REMOTE or not self.delay:
+            task_instance.locality_wait = None
+            return index
+
+        now = time.time() if now is None else now
+        if task_instance.locality_wait is None:
+            task_instance.locality_wait = now
+        if now - task_instance.locality_wait >= self.delay:
+            task_instance.locality_wait = None
+            return index
+        return None
@@ -0,0 +1,138 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from heapq import heappush, heappop, heapify
+from itertools import count
+
+
+class ReadyQueue(object):
+    """
+    Priority index of the task instances that have pending worker requests.
+
+    The scheduler's main queue holds every queued and running task whether or
+    not it has work waiting.  Finding the next task to dispatch by scanning
+    that queue is O(n) and requires polling every task's request list.  The
+    ReadyQueue only contains tasks known to have pending requests, ordered by
+    score, so the next task can be found in O(log n).
+
+    Entries are removed lazily: discard() marks the heap entry as dead and it
+    is dropped the next time it reaches the top of the heap.
+
+    ReadyQueue is not thread safe.  The scheduler must hold its queue lock
+    while calling any of these methods.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}      # task -> heap entry
+        self._counter = count() # tie breaker, preserves FIFO for equal scores
+        self._deferred = []     # entries hidden until restore() is called
+
+    def __contains__(self, task):
+        return task in self._entries
+
+    def __iter__(self):
+        return iter(self._entries.keys())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, task, score):
+        """
+        Marks a task as having pending worker requests.  Adding a task that is
+        already in the queue does nothing; use rescore() to reorder tasks.
+
+        @param task - task instance with pending requests
+        @param score - score of the task.  Lowest scores are dispatched first.
+        """
+        if task in self._entries:
+            return
+        entry = [score, self._counter.next(), task]
+        self._entries[task] = entry
+        heappush(self._heap, entry)
+
+    def discard(self, task):
+        """
+        Removes a task from the queue, if it is present.
+
+        @param task - task instance to remove
+        """
+        entry = self._entries.pop(task, None)
+        if entry:
+            entry[-1] = None
+
+    def peek(self):
+        """
+        Returns the task with the lowest score without removing it, or None
+        if there are no tasks with pending requests.
+        """
+        heap = self._heap
+        while heap and heap[0][-1] is None:
+            heappop(heap)
+        return heap[0][-1] if heap else None
+
+    def pop(self):
+        """
+        Removes and returns the task with the lowest score, or None if there
+        are no tasks with pending requests.
+        """
+        task = self.peek()
+        if task is not None:
+            del self._entries[task]
+            heappop(self._heap)
+        return task
+
+    def defer(self, task):
+        """
+        Hides a task until restore() is called.  This allows the scheduler to
+        look past a task it cannot place right now without losing its position
+        in the queue.
+
+        @param task - task instance to defer
+        """
+        entry = self._entries.pop(task, None)
+        if entry:
+            self._deferred.append(list(entry))
+            entry[-1] = None
+
+    def restore(self):
+        """
+        Returns all deferred tasks to the queue with their original score and
+        position.  Tasks that were added again while deferred keep their new
+        entry.
+        """
+        for entry in self._deferred:
+            task = entry[-1]
+            if task not in self._entries:
+                self._entries[task] = entry
+                heappush(self._heap, entry)
+        self._deferred = []
+
+    def rescore(self, score):
+        """
+        Recomputes the score of every ready task and rebuilds the heap.  This
+        also purges any entries that were discarded.
+
+        @param score - function taking a task and returning its new score
+        """
+        heap = []
+        for entry in self._entries.values():
+            entry[0] = score(entry[-1])
+            heap.append(entry)
+        heapify(heap)
+        self._heap = heap
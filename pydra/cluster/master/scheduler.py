@@ -28,10 +28,18 @@ from twisted.internet import reactor, threads
 from twisted.internet.defer import Deferred, DeferredList
 
 from pydra.cluster.module import Module
+from pydra.cluster.master.fair_share import FairShare
+from pydra.cluster.master.placement import LocalityPlacement
+from pydra.cluster.master.ready_queue import ReadyQueue
+from pydra.cluster.master.speculation import Speculator
+from pydra.cluster.master.statistics import StatisticsModule
+from pydra.cluster.master.workunit_writer import WorkUnitWriter
 from pydra.cluster.tasks import *
+from pydra.cluster.tasks.datasource.slicer import mma
 from pydra.cluster.tasks.task_manager import TaskManager
 from pydra.cluster.constants import *
-from pydra.models import TaskInstance, WorkUnit
+from pydra.models import TaskInstance, WorkUnit, WorkRequest, Batch
+import pydra_settings
 
 # init logging
 import logging
@@ -99,13 +107,17 @@ class TaskScheduler(Module):
         self._remotes = [
             ('NODE', self.request_worker),
             ('NODE', self.send_results),
+            ('NODE', self.send_partial_results),
             ('NODE', self.worker_stopped),
-            ('NODE', self.request_worker_release)
+            ('NODE', self.request_worker_release),
+            ('NODE', self.worker_count)
         ]
 
         self._friends = {
             'task_manager' : TaskManager,
+            'statistics' : StatisticsModule,
         }
+        self.statistics = None
 
         self._interfaces = [
             (self.fetch_task_status, {'name':'task_statuses'}),
@@ -119,6 +131,12 @@ class TaskScheduler(Module):
         self._worker_lock = Lock()  # lock for worker only transactions
         self._queue_lock = Lock()   # lock for queue only transactions
         self._fetch_status_lock = Lock() # lock for retrieving statuses
+        self._schedule_lock = Lock() # lock for scheduling pass flags
+
+        # scheduling pass tracking.  Concurrent requests to advance the
+        # scheduler are coalesced into a single pending pass.
+        self._scheduling = False          # a pass is running
+        self._schedule_requested = False  # a pass is pending
 
         # task statuses
         self._task_statuses = {}
@@ -127,48 +145,106 @@ class TaskScheduler(Module):
         # a set containing all main workers
         self._main_workers = set()
 
+        # main workers of parallel tasks that are not running a workunit of
+        # their own task
+        self._free_main_workers = set()
+
         self.update_interval = 5 # seconds
 
+        # batch sizing.  Batches are sized so that they take roughly the target
+        # duration to run, based on a moving average of workunit times.
+        self.batch_target_duration = getattr(pydra_settings, \
+                                            'BATCH_TARGET_DURATION', 5)
+        self.batch_size_max = getattr(pydra_settings, 'BATCH_SIZE_MAX', 1000)
+        self.batch_size_default = 5 # used until workunit times are known
+        self.workunit_time_weight = 10 # weight of moving average
+
+        # number of batches that may be queued on a busy worker so it can start
+        # them as soon as its current batch completes.  0 disables prefetching
+        self.prefetch_depth = getattr(pydra_settings, 'WORKER_PREFETCH_DEPTH', 0)
+
+        # placement policy used to choose among idle workers
+        self.placement = LocalityPlacement( \
+                                getattr(pydra_settings, 'LOCALITY_DELAY', 0))
+
+        # fair-share ordering of tasks between users.  When disabled tasks
+        # are ordered by TaskInstance.compute_score()
+        if getattr(pydra_settings, 'FAIR_SHARE', False):
+            self.fair_share = FairShare(
+                getattr(pydra_settings, 'FAIR_SHARE_HALF_LIFE', 300),
+                getattr(pydra_settings, 'FAIR_SHARE_WEIGHTS', None))
+        else:
+            self.fair_share = None
+
+        # workunits are written to the database in bulk
+        self.workunit_writer = WorkUnitWriter( \
+                            getattr(pydra_settings, 'WORKUNIT_FLUSH_SIZE', 1000))
+        self.workunit_flush_interval = \
+                            getattr(pydra_settings, 'WORKUNIT_FLUSH_INTERVAL', 2)
+
+        # speculative execution of straggling workunits on idle workers
+        if getattr(pydra_settings, 'SPECULATIVE_EXECUTION', False):
+            self.speculator = Speculator( \
+                getattr(pydra_settings, 'SPECULATIVE_MULTIPLE', 2),
+                getattr(pydra_settings, 'SPECULATIVE_MIN_SAMPLES', 5))
+        else:
+            self.speculator = None
+        self.speculative_interval = \
+                            getattr(pydra_settings, 'SPECULATIVE_INTERVAL', 5)
+
 
     def _register(self, manager):
         Module._register(self, manager)
         
         self._queue = []
+        self._ready = ReadyQueue()  # tasks with pending worker requests
         self._active_tasks = {}     # caching uncompleted task instances
         self._idle_workers = []     # all workers are seen equal
         self._active_workers = {}   # worker-job mappings
-        self._waiting_workers = {}  # task-worker mappings
+        self._prefetched = {}       # worker-queued jobs mappings
+        self._waiting_workers = {}  # worker-task mappings of held workers
+        self._speculative = {}      # worker-worker mappings of duplicate jobs
+        self._stopping = set()      # workers stopping a duplicate job
         
         self._init_queue()
         reactor.callLater(self.update_interval, self._update_queue)
+        reactor.callLater(self.workunit_flush_interval, self._flush_workunits)
+        if self.speculator:
+            reactor.callLater(self.speculative_interval, self._speculate)
+        reactor.addSystemEventTrigger('before', 'shutdown', \
+                                      self.workunit_writer.flush)
 
-    def _queue_task(self, task_key, args={}, priority=5):
+    def _queue_task(self, task_key, args={}, priority=5, user=None):
         """
         Adds a (root) task that is to be run.
 
         Under the hood, the scheduler creates a task instance for the task, puts
         it into the queue, and then tries to advance the queue.
+
+        @param user - name of the user queueing the task, used for fair-share
+                      scheduling
         """
         logger.info('Queued Task: %s - Args:  %s' % (task_key, args))
 
         task_instance = TaskInstance()
         task_instance.task_key = task_key
         task_instance.priority = priority
+        task_instance.user = user
         task_instance.args = simplejson.dumps(args)
         task_instance.queued = datetime.now()
         task_instance.status = STATUS_STOPPED
         task_instance.save()
         
-        # queue the root task as the first work request.  This lets the queue
-        # advancement logic to function the same for a root task or a subtask
-        task_instance.queue_worker_request(task_instance)
-        
         with self._queue_lock:
             heappush(self._queue, [task_instance.compute_score(),task_instance])
             # cache this task
             self._active_tasks[task_instance.id] = task_instance
 
-        threads.deferToThread(self._schedule)        
+        # queue the root task as the first work request.  This lets the queue
+        # advancement logic to function the same for a root task or a subtask
+        self._queue_worker_request(task_instance, task_instance)
+
+        self._request_schedule()
         return task_instance
 
 
@@ -181,7 +257,7 @@ class TaskScheduler(Module):
         task_id = int(task_id)
         with self._queue_lock:
             task = self._active_tasks.get(task_id)
-            self._queue.remove([task.compute_score(), task])
+            self._remove_from_queue(task)
             # cancel any workers assigned to the task.  task is not
             # marked cancelled until all workers have reported they
             # stopped
@@ -232,26 +308,32 @@ class TaskScheduler(Module):
                     status = STATUS_COMPLETE if task_status is None else task_status
                     task_instance.status = status
                     task_instance.completed = datetime.now()
+                    # listeners read the task's workunits from the database
+                    self.workunit_writer.flush()
                     self.emit('TASK_FINISHED', task_instance)
                     task_instance.save()
                     
                     with self._worker_lock:
                         self._main_workers.remove(worker_key)
+                        self._free_main_workers.discard(worker_key)
                         self._idle_workers.append(worker_key)
                         del self._active_workers[worker_key]
+                        self._release_share(worker_key)
                         
+                    if self.speculator:
+                        self.speculator.forget(job.task_id)
+
                     with self._queue_lock:
                         del self._active_tasks[job.task_id]
                         if status in (STATUS_CANCELLED, STATUS_COMPLETE, STATUS_FAILED):
                             # safe to remove the task
                             # release any unreleased workers
                             for key in task_instance.waiting_workers:
+                                self._waiting_workers.pop(key, None)
                                 avatar = self.workers[key]
                                 avatar.remote.callRemote('release_worker')
 
-                            t = [job.compute_score(), job]
-                            if t in self._queue:
-                                self._queue.remove(t)
+                            if self._remove_from_queue(task_instance):
                                 logger.info(
                                     'Task %d: %s is removed from the queue' % \
                                     (job.task_id, job.task_key))
@@ -265,13 +347,21 @@ class TaskScheduler(Module):
                         del self._active_workers[worker_key]
                         task_instance.running_workers.remove(worker_key)
                         self._idle_workers.append(worker_key)
+                        prefetched = self._prefetched.pop(worker_key, [])
+                        self._release_share(worker_key)
+
+                    # work queued on the worker was discarded by it.  Requeue
+                    # it unless the task was cancelled.
+                    if task_status != STATUS_CANCELLED:
+                        for queued_job in prefetched:
+                            self._requeue_job(task_instance, queued_job)
         else:
             # a new worker
             logger.info('A new worker:%s is added' % worker_key)
             with self._worker_lock:
                 self._idle_workers.append(worker_key)
 
-        self._schedule()
+        self._request_schedule()
  
 
     def remove_worker(self, worker_key):
@@ -282,6 +372,12 @@ class TaskScheduler(Module):
         """
         with self._worker_lock:
             job = self.get_worker_job(worker_key) 
+            prefetched = self._prefetched.pop(worker_key, [])
+            self._release_share(worker_key)
+            self._stopping.discard(worker_key)
+            self._free_main_workers.discard(worker_key)
+            # a job that is also running on another worker is left to it
+            duplicated = self._end_speculation(worker_key)
             if job is None:
                 try:
                     self._idle_workers.remove(worker_key)
@@ -290,18 +386,24 @@ class TaskScheduler(Module):
                     return True
                 except ValueError:
                     pass 
+                return False
 
-            elif job.subtask_key:
-                logger.warning('%s failed during task, returning work unit' % worker_key)
+        if job.subtask_key:
+            logger.warning('%s failed during task, returning work unit' % worker_key)
 
-                task_instance = job.task_instance
-                main_worker = self.workers.get(task_instance.worker, None)
+            task_instance = job.task_instance
+            main_worker = self.workers.get(task_instance.worker, None)
 
-                if main_worker:
-                    # requeue failed work.
-                    task_instance.queue_worker_request(job)
-                
-            return False
+            if main_worker:
+                # requeue failed work and any work queued on the worker.  This
+                # must happen outside of the worker lock because it acquires
+                # the queue lock.
+                if not duplicated:
+                    prefetched.insert(0, job)
+                for queued_job in prefetched:
+                    self._requeue_job(task_instance, queued_job)
+
+        return False
 
 
     def hold_worker(self, worker_key):
@@ -320,11 +422,13 @@ class TaskScheduler(Module):
                     task_instance = job.task_instance
                     task_instance.running_workers.remove(worker_key)
                     task_instance.waiting_workers.append(worker_key)
+                    self._waiting_workers[worker_key] = task_instance
                     del self._active_workers[worker_key]
 
 
 
-    def request_worker(self, requester_key, subtask, args, workunit):
+    def request_worker(self, requester_key, subtask, args, workunit, \
+                       locality=None):
         """
         Requests a worker for a workunit on behalf of a (main) worker.
         
@@ -335,6 +439,9 @@ class TaskScheduler(Module):
         @param args - arguments to pass to the task
         @param workunit - key that will retrieve additional data for this
                             workunit.
+        @param locality - optional list of nodes (host:port) or hosts where
+                            the workunit's data is located.  The scheduler
+                            will prefer workers in these locations.
         """
         task_instance = self.get_worker_job(requester_key)
         if task_instance:
@@ -342,19 +449,21 @@ class TaskScheduler(Module):
             # it will be considered by the scheduler as a special worker
             # resource to complete the task.
             self._main_workers.add(requester_key)
+            if not task_instance.local_workunit:
+                self._free_main_workers.add(requester_key)
 
-            job = WorkUnit()
-            job.task_instance = task_instance
-            job.subtask_key = subtask
-            job.args = simplejson.dumps(args)
-            job.workunit = workunit
-            job.save()
+            if task_instance.ephemeral is None:
+                task_instance.ephemeral = \
+                        self._ephemeral_workunits(task_instance.task_key)
 
-            task_instance.queue_worker_request(job)
+            # the WorkUnit is only created once the request is dispatched
+            job = WorkRequest(subtask, workunit, simplejson.dumps(args), \
+                              locality=locality)
+            self._queue_worker_request(task_instance, job)
             logger.debug('Work Request %s:  sub=%s  args=%s  w=%s ' % \
                          (requester_key, subtask, '--', workunit))
 
-            self._schedule()
+            self._request_schedule()
         else:
             # a worker request from an unknown task
             pass
@@ -402,6 +511,155 @@ class TaskScheduler(Module):
             return [task[1].json_safe() for task in self._queue]
         return [task[1] for task in self._queue]
 
+    def _queue_worker_request(self, task_instance, request):
+        """
+        Queues a worker request with a task instance and marks the task as
+        ready in the scheduler's ready index.  The request is queued before the
+        task is marked ready so that _schedule() can never drop a task from the
+        index while it still has a request pending.
+
+        @param task_instance - task instance the request belongs to
+        @param request - WorkRequest, requeued WorkUnit, or the TaskInstance
+                         itself for a root task
+        """
+        task_instance.queue_worker_request(request)
+        with self._queue_lock:
+            if task_instance.id in self._active_tasks:
+                self._ready.add(task_instance, self._score(task_instance))
+
+
+    def _requeue_job(self, task_instance, job):
+        """
+        Returns the workunits of a job that did not complete to the task's
+        request queue.  Batches are split back into their workunits.
+
+        @param task_instance - task instance the job belongs to
+        @param job - WorkUnit or Batch to requeue
+        """
+        if isinstance(job, (Batch,)):
+            # workunits whose results were already received are not rerun
+            delivered = getattr(job, 'delivered', ())
+            for workunit in job.workunits.values():
+                if workunit.workunit not in delivered:
+                    self._queue_worker_request(task_instance, workunit)
+        else:
+            self._queue_worker_request(task_instance, job)
+
+
+    def _next_ready_task(self):
+        """
+        Returns the highest scoring task that has a pending worker request and
+        that request, as a tuple.  Tasks in the ready index that no longer have
+        pending requests are dropped from it.  Must be called while holding
+        the queue lock.
+
+        @returns (task_instance, job) or (None, None)
+        """
+        task_instance = self._ready.peek()
+        while task_instance is not None:
+            job = task_instance.poll_worker_request()
+            if job:
+                return task_instance, job
+            self._ready.discard(task_instance)
+            task_instance = self._ready.peek()
+        return None, None
+
+
+    def _remove_from_queue(self, task_instance):
+        """
+        Removes a task from the queue and the ready index.  Must be called
+        while holding the queue lock.
+
+        @returns True if the task was in the queue, False otherwise.
+        """
+        self._ready.discard(task_instance)
+        for item in self._queue:
+            if item[1] is task_instance:
+                self._queue.remove(item)
+                heapify(self._queue)
+                return True
+        return False
+
+
+    def _score(self, task_instance):
+        """
+        Computes the score used to order tasks in the ready index.  Lower
+        scores are dispatched first.
+        """
+        if self.fair_share:
+            return self.fair_share.score(task_instance)
+        return task_instance.compute_score()
+
+
+    def _save_job(self, job):
+        """
+        Saves a job.  WorkUnits and Batches are written through the workunit
+        writer, TaskInstances are saved immediately.  Workunits of tasks with
+        ephemeral workunits are only added to the task's workunit summary once
+        they finish.
+        """
+        if isinstance(job, (TaskInstance,)):
+            job.save()
+        elif not job.task_instance.ephemeral:
+            self.workunit_writer.save(job)
+        elif job.completed:
+            if isinstance(job, (Batch,)):
+                workunits = job.workunits.values()
+            else:
+                workunits = (job,)
+            for workunit in workunits:
+                status = workunit.status or job.status
+                if status == STATUS_CANCELLED:
+                    outcome = 'cancelled'
+                elif status == STATUS_FAILED:
+                    outcome = 'failed'
+                else:
+                    outcome = 'completed'
+                seconds = (workunit.completed - workunit.started).seconds \
+                            if workunit.started else 0
+                job.task_instance.record_workunit(workunit.subtask_key, \
+                                                  outcome, seconds)
+
+
+    def _ephemeral_workunits(self, task_key):
+        """
+        Returns whether a task's workunits should be kept in memory only.
+        """
+        pkg = self.task_manager.get_task_package(task_key)
+        if not pkg:
+            return False
+        task = pkg.tasks.get(task_key, None)
+        return getattr(task, 'ephemeral_workunits', False)
+
+
+    def _release_share(self, worker_key):
+        """
+        Stops accounting a worker to the share of the task it was assigned.
+        """
+        if self.fair_share:
+            self.fair_share.stop(worker_key)
+
+
+    def _end_speculation(self, worker_key):
+        """
+        Stops tracking a worker as running one of the copies of a duplicated
+        job.  The worker is removed from the job, leaving the other copy to
+        finish it.  Must be called while holding the worker lock.
+
+        @param worker_key - worker to remove from the job
+        @returns key of the worker running the other copy, or None if the job
+                 was not duplicated.
+        """
+        other = self._speculative.pop(worker_key, None)
+        if other is None:
+            return None
+        self._speculative.pop(other, None)
+        job = self._active_workers.pop(worker_key, None)
+        if job and worker_key in job.task_instance.running_workers:
+            job.task_instance.running_workers.remove(worker_key)
+        return other
+
+
     def get_worker_status(self, worker_key):
         """
         0: idle; 1: working; 2: waiting; -1: unknown
@@ -416,7 +674,54 @@ class TaskScheduler(Module):
         return -1
 
 
+    def _request_schedule(self):
+        """
+        Requests a scheduling pass.  The pass runs in a separate thread.  If a
+        pass is already pending the request is coalesced into it, and if a
+        pass is running it will run again once it finishes.  Any number of
+        requests made while a pass is running result in one more pass.
+        """
+        with self._schedule_lock:
+            if self._schedule_requested:
+                return
+            self._schedule_requested = True
+            if self._scheduling:
+                return
+        threads.deferToThread(self._schedule)
+
+
     def _schedule(self):
+        """
+        Runs a scheduling pass, assigning as many idle workers to pending worker
+        requests as possible.  The pass repeats until no request for it is
+        pending.  If a pass is already running in another thread this call
+        is coalesced into that pass.
+        """
+        with self._schedule_lock:
+            if self._scheduling:
+                self._schedule_requested = True
+                return
+            self._scheduling = True
+
+        try:
+            while True:
+                with self._schedule_lock:
+                    self._schedule_requested = False
+
+                while self._schedule_next():
+                    pass
+
+                with self._schedule_lock:
+                    if not self._schedule_requested:
+                        self._scheduling = False
+                        return
+        except:
+            with self._schedule_lock:
+                self._scheduling = False
+            raise
+
+
+    def _schedule_next(self):
         """
         Allocates a worker to a task/subtask.
 
@@ -427,31 +732,44 @@ class TaskScheduler(Module):
         
         If no tasks are in the queue or no job is in the queue CLUSTER_IDLE is
         emited
+
+        @returns (worker_key, task_id) if a worker was assigned, None otherwise
         """
 
         task, subtask, workunit = None, None, None
         
-        finished_main_workers = []
         with self._queue_lock:
             logger.debug('Attempting to advance scheduler: q=%s' % (len(self._queue)))
             
-            if self._queue:
-                # find taskinstance or a worker_request
-                task_instance, job = None, None
-                for item in self._queue:
-                    job = item[1].poll_worker_request()
-                    if job:
-                        task_instance = item[1]
-                        break
-                
-                if job:
+            if not self._queue:
+                self.emit('CLUSTER_IDLE', self._idle_workers)
+                return None
+
+            deferred = False
+            candidates = None
+            try:
+                while True:
+                    # find taskinstance or a worker_request
+                    task_instance, job = self._next_ready_task()
+                    if not job:
+                        if not deferred:
+                            self.emit('CLUSTER_IDLE', self._idle_workers)
+                        return None
+
                     with self._worker_lock:
                         worker_key = None
+                        prefetch = False
+                        wait = False
                         task = task_instance.task_key
                         subtask = job.subtask_key
                         if subtask and task_instance.waiting_workers:
-                            # consume waiting worker first
-                            worker_key = task_instance.waiting_workers.pop()
+                            # consume waiting worker first, preferring one
+                            # close to the workunit's data
+                            index, score = self.placement.select( \
+                                    task_instance.waiting_workers, \
+                                    self.placement.locations(task_instance, job))
+                            worker_key = task_instance.waiting_workers.pop(index)
+                            self._waiting_workers.pop(worker_key, None)
                             logger.info('Re-dispatching waiting worker:%s to task:%s' % 
                                     (worker_key, task_instance.id))
                             task_instance.running_workers.append(worker_key)
@@ -463,45 +781,236 @@ class TaskScheduler(Module):
                                     (worker_key, task_instance.id))
 
                         elif self._idle_workers:
-                            # dispatching to idle worker last
-                            worker_key = self._idle_workers.pop()
-                            task_instance.running_workers.append(worker_key)
-                            logger.info('Worker:%s assigned to task:%s  key=%s' %
-                                    (worker_key, task_instance.id, task))
+                            # dispatching to idle worker, preferring one close
+                            # to the workunit's data
+                            waiting_since = task_instance.locality_wait
+                            index = self.placement.place(task_instance, job, \
+                                                         self._idle_workers)
+                            if index is None:
+                                wait = True
+                                if waiting_since is None:
+                                    # make sure the task is placed once the
+                                    # delay expires
+                                    reactor.callFromThread(reactor.callLater, \
+                                            self.placement.delay, \
+                                            self._request_schedule)
+                            else:
+                                worker_key = self._idle_workers.pop(index)
+                                task_instance.running_workers.append(worker_key)
+                                if self.fair_share:
+                                    self.fair_share.start(worker_key, \
+                                                          task_instance)
+                                logger.info('Worker:%s assigned to task:%s  key=%s' %
+                                        (worker_key, task_instance.id, task))
+
+                        elif subtask and self.prefetch_depth:
+                            # queue work on a busy worker last
+                            worker_key = self._select_prefetch_worker( \
+                                                                task_instance)
+                            prefetch = worker_key is not None
+                            if prefetch:
+                                logger.info('Worker:%s prefetching for task:%s' \
+                                        % (worker_key, task_instance.id))
+
+                    if wait:
+                        # waiting for a local worker, try the next task
+                        logger.debug('Task:%s waiting for a local worker' % \
+                                     task_instance.id)
+                        self._ready.defer(task_instance)
+                        deferred = True
+                        continue
+
+                    # was a worker found for the job.  If not, a task further
+                    # down may still be able to use a waiting or main worker.
+                    # Stop once no such task is left rather than scanning
+                    # every ready task.
+                    if not worker_key:
+                        if candidates is None:
+                            candidates = self._local_candidates()
+                        candidates.discard(task_instance)
+                        if not candidates:
+                            return None
+                        self._ready.defer(task_instance)
+                        deferred = True
+                        continue
+
+                    job = task_instance.get_batch(
+                                self._batch_size(task_instance, subtask))
+                    job.worker = worker_key
+                    if not task_instance.poll_worker_request():
+                        self._ready.discard(task_instance)
+                    elif self.fair_share:
+                        # the task's share changed, reposition it
+                        self._ready.discard(task_instance)
+                        self._ready.add(task_instance, \
+                                        self._score(task_instance))
+                    
+                    if prefetch:
+                        self._prefetched.setdefault(worker_key, []).append(job)
+                    elif not (subtask and job.on_main_worker):
+                        self._active_workers[worker_key] = job
+                    else:
+                        task_instance.local_workunit = job
+                        self._free_main_workers.discard(worker_key)
 
-                    # was a worker found for the job
-                    if worker_key:
-                        job = task_instance.get_batch()
-                        job.worker = worker_key
-                        
-                        if not (subtask and job.on_main_worker):
-                            self._active_workers[worker_key] = job
-                        else:
-                            task_instance.local_workunit = job
-
-                        # notify remote worker to start     
-                        worker = self.workers[worker_key]
-                        pkg = self.task_manager.get_task_package(task)
-                        # save task version
-                        task_instance.version = pkg.version
-                        task_instance.save()
-                        main_worker = task_instance.worker if task_instance.worker else worker_key
-                        d = worker.remote.callRemote('run_task', task, pkg.version,
-                                job.args, job.transmitable(), main_worker,
-                                task_instance.id)
-                        d.addCallback(self.run_task_successful, worker_key, subtask)
-                        d.addErrback(self.run_task_failed, worker_key)            
-            
-                        return worker_key, job.task_id
+                    # notify remote worker to start     
+                    worker = self.workers[worker_key]
+                    pkg = self.task_manager.get_task_package(task)
+                    # save task version
+                    task_instance.version = pkg.version
+                    task_instance.save()
+                    main_worker = task_instance.worker if task_instance.worker else worker_key
+                    d = worker.remote.callRemote('run_task', task, pkg.version,
+                            job.args, job.transmitable(), main_worker,
+                            task_instance.id, prefetch)
+                    if prefetch:
+                        d.addErrback(self.prefetch_failed, worker_key, job)
+                    else:
+                        d.addCallback(self.run_task_successful, worker_key,
+                                      subtask)
+                        d.addErrback(self.run_task_failed, worker_key)
+        
+                    return worker_key, job.task_id
 
-                else:
-                    self.emit('CLUSTER_IDLE', self._idle_workers)
-            else:
-                self.emit('CLUSTER_IDLE', self._idle_workers)
-                    
+            finally:
+                # return tasks that waited for a local worker to the index
+                self._ready.restore()
+
+
+    def _local_candidates(self):
+        """
+        Returns the set of ready tasks that may be given a worker without an
+        idle worker: tasks holding a waiting worker, tasks whose main worker is
+        free to run one of their workunits and, when prefetching, tasks with a
+        busy worker that has room to queue a batch.  Must be called while
+        holding the queue lock.
+        """
+        with self._worker_lock:
+            tasks = set(self._waiting_workers.values())
+            for worker_key in self._free_main_workers:
+                tasks.add(self._active_workers.get(worker_key, None))
+            if self.prefetch_depth:
+                for worker_key, job in self._active_workers.items():
+                    if not isinstance(job, (TaskInstance,)) and \
+                        len(self._prefetched.get(worker_key, [])) < self.prefetch_depth:
+                            tasks.add(job.task_instance)
+        return set([task for task in tasks if task in self._ready])
+
+
+    def _batch_size(self, task_instance, subtask_key):
+        """
+        Computes the number of workunits to put in the next batch for a
+        subtask.  The size is chosen so the batch takes roughly
+        batch_target_duration seconds using the moving average of workunit
+        times for the subtask.  The average is seeded from the statistics of
+        previous runs of the task when available.
+
+        @param task_instance - task instance the batch is for
+        @param subtask_key - subtask the batch is for
+        """
+        if subtask_key is None:
+            return 1
+
+        average = task_instance.workunit_times.get(subtask_key, None)
+        if average is None and self.statistics:
+            average = self.statistics.subtask_average(task_instance.task_key,
+                                                      subtask_key)
+            if average is not None:
+                task_instance.workunit_times[subtask_key] = average
+
+        if not average:
+            return self.batch_size_default
+
+        size = int(self.batch_target_duration / average)
+        return max(1, min(size, self.batch_size_max))
+
+
+    def _record_workunit_time(self, job, completed):
+        """
+        Updates the moving average of workunit time for the subtask of a
+        completed WorkUnit or Batch.  The time of a batch is divided evenly
+        between the workunits it contained.
+
+        @param job - completed WorkUnit or Batch
+        @param completed - datetime the job completed
+        """
+        if not job.started or not job.subtask_key:
+            return
+
+        delta = completed - job.started
+        seconds = delta.days * 86400 + delta.seconds \
+                    + delta.microseconds / 1000000.0
+        seconds /= max(job.size, 1)
+
+        times = job.task_instance.workunit_times
+        average = times.get(job.subtask_key, None)
+        if average is None:
+            times[job.subtask_key] = seconds
+        else:
+            times[job.subtask_key] = mma(average, seconds, \
+                                         self.workunit_time_weight)
+
+        if self.speculator:
+            self.speculator.record(job.task_id, job.subtask_key, seconds)
+
+
+    def _select_prefetch_worker(self, task_instance):
+        """
+        Selects a busy worker of a task that has room to queue another batch.
+        Must be called while holding the worker lock.
+
+        @param task_instance - task instance to select a worker for
+        @returns worker_key or None
+        """
+        for worker_key in task_instance.running_workers:
+            if worker_key in self._active_workers and \
+                len(self._prefetched.get(worker_key, [])) < self.prefetch_depth:
+                    return worker_key
         return None
 
 
+    def _promote_prefetched(self, worker_key):
+        """
+        Makes the next job queued on a worker its active job.  Called when the
+        worker completes its current job, at which point it has already
+        started on the queued job.
+
+        @param worker_key - worker that completed a job
+        @returns True if a queued job was promoted, False otherwise.
+        """
+        with self._worker_lock:
+            queued = self._prefetched.get(worker_key, None)
+            if not queued:
+                return False
+            job = queued.pop(0)
+            if not queued:
+                del self._prefetched[worker_key]
+            self._active_workers[worker_key] = job
+
+        self.run_task_successful(None, worker_key, job.subtask_key)
+        return True
+
+
+    def prefetch_failed(self, results, worker_key, job):
+        """
+        Errback for when queueing a job on a busy worker fails.  The job is
+        returned to the task's request queue.
+        """
+        with self._worker_lock:
+            queued = self._prefetched.get(worker_key, [])
+            for i, queued_job in enumerate(queued):
+                if queued_job is job:
+                    del queued[i]
+                    break
+            else:
+                # worker was removed, remove_worker already requeued the job
+                return
+        logger.warning('Worker:%s - failed to queue work, requeueing' % \
+                       worker_key)
+        self._requeue_job(job.task_instance, job)
+        self._request_schedule()
+
+
     def _init_queue(self):
         """
         Initialize the queue by reading the persistent store.
@@ -519,16 +1028,130 @@ class TaskScheduler(Module):
 
     def _update_queue(self):
         """
-        Periodically updates the scores of entries in both the long-term and the
-        short-term queue and subsequently re-orders them.
+        Periodically updates the scores of tasks with pending worker requests
+        and subsequently re-orders them.  Only the ready index is rescored, the
+        main queue is ordered by the score tasks were queued with.
         """
         with self._queue_lock:
-            for task in self._queue:
-                task[0] = task[1].compute_score()
-            heapify(self._queue)
+            self._ready.rescore(self._score)
             reactor.callLater(self.update_interval, self._update_queue)
 
 
+    def _flush_workunits(self):
+        """
+        Periodically writes buffered workunits to the database.
+        """
+        try:
+            self.workunit_writer.flush()
+        finally:
+            reactor.callLater(self.workunit_flush_interval, \
+                              self._flush_workunits)
+
+
+    def _speculate(self):
+        """
+        Periodically launches a duplicate of each straggling job on an idle
+        worker.  A job straggles when it has run longer per workunit than a
+        multiple of the median for its subtask.  Whichever copy returns
+        results first is used and the other copy is stopped.  Duplicates are
+        only launched when no task is waiting for a worker.
+        """
+        try:
+            launched = []
+            now = datetime.now()
+            with self._queue_lock:
+                with self._worker_lock:
+                    if self._next_ready_task()[0] is None:
+                        launched = self._select_stragglers(now)
+
+            for worker_key, job in launched:
+                task_instance = job.task_instance
+                logger.info('Worker:%s - speculatively running %s:%s of %s' \
+                    % (worker_key, job.task_key, job.subtask_key, \
+                    self._speculative.get(worker_key)))
+                worker = self.workers[worker_key]
+                d = worker.remote.callRemote('run_task', task_instance.task_key,
+                        task_instance.version, job.args, job.transmitable(),
+                        task_instance.worker, task_instance.id, False)
+                d.addErrback(self.speculation_failed, worker_key)
+        finally:
+            reactor.callLater(self.speculative_interval, self._speculate)
+
+
+    def _select_stragglers(self, now):
+        """
+        Assigns idle workers to run duplicates of straggling jobs.  Must be
+        called while holding the queue and worker locks.
+
+        @param now - current time
+        @returns list of (worker_key, job) duplicates to start
+        """
+        launched = []
+        for worker_key, job in self._active_workers.items():
+            if not self._idle_workers:
+                break
+            if isinstance(job, (TaskInstance,)) or not job.subtask_key \
+                    or job.status != STATUS_RUNNING or not job.started \
+                    or worker_key in self._speculative:
+                continue
+
+            delta = now - job.started
+            seconds = delta.days * 86400 + delta.seconds \
+                        + delta.microseconds / 1000000.0
+            seconds /= max(job.size, 1)
+            if not self.speculator.is_straggler(job.task_id, \
+                                                job.subtask_key, seconds):
+                continue
+
+            task_instance = job.task_instance
+            index, score = self.placement.select(self._idle_workers, \
+                        self.placement.locations(task_instance, job))
+            duplicate = self._idle_workers.pop(index)
+            task_instance.running_workers.append(duplicate)
+            self._active_workers[duplicate] = job
+            self._speculative[worker_key] = duplicate
+            self._speculative[duplicate] = worker_key
+            if self.fair_share:
+                self.fair_share.start(duplicate, task_instance)
+            launched.append((duplicate, job))
+        return launched
+
+
+    def speculation_failed(self, results, worker_key):
+        """
+        Errback for when starting a duplicate job fails.  The original copy
+        continues and the worker is returned to the pool.
+        """
+        logger.warning('Worker:%s - failed to start duplicate job' % worker_key)
+        with self._worker_lock:
+            self._end_speculation(worker_key)
+            self._release_share(worker_key)
+        self.add_worker(worker_key)
+
+
+    def _stop_duplicate(self, worker_key, job):
+        """
+        Stops the other copy of a duplicated job once one copy returned its
+        results.  The stopped worker returns to the pool when it reports that
+        it stopped.
+
+        @param worker_key - worker that returned results first
+        @param job - the duplicated job
+        """
+        with self._worker_lock:
+            loser = self._end_speculation(worker_key)
+            prefetched = self._prefetched.pop(loser, [])
+            self._release_share(loser)
+            self._stopping.add(loser)
+        job.worker = worker_key
+
+        logger.info('Worker:%s - finished duplicated job first, stopping %s' \
+                    % (worker_key, loser))
+        for queued_job in prefetched:
+            self._requeue_job(job.task_instance, queued_job)
+        self.workers[loser].remote.callRemote('stop_task')
+
+
     def return_work_success(self, results, worker_key):
         """
         Work was sucessful returned to the main worker
@@ -545,7 +1168,7 @@ class TaskScheduler(Module):
         pass
 
     
-    def queue_task(self, task_key, args={}):
+    def queue_task(self, task_key, args={}, user=None):
         """
         Queue a task to be run.  All task requests come through this method.
 
@@ -556,6 +1179,8 @@ class TaskScheduler(Module):
         @param args: should be a dictionary of values.  It is acceptable for
         this to be improperly typed data.  ie. Integer given as a String. This
         function will parse and clean the args using the form class for the Task
+        @param user: name of the user queueing the task.  Worker time is
+        shared fairly between users.
 
         """
         # args coming from the controller need to be parsed by the form. This
@@ -576,7 +1201,7 @@ class TaskScheduler(Module):
                     'errors':form_instance.errors
                 }
 
-        task_instance = self._queue_task(task_key, args)
+        task_instance = self._queue_task(task_key, args, user=user)
 
         return {
                 'task_key':task_key,
@@ -610,7 +1235,7 @@ class TaskScheduler(Module):
             job.worker = worker_key
             job.status = STATUS_RUNNING
             job.started = datetime.now()
-            job.save()
+            self._save_job(job)
 
 
     def send_results(self, worker_key, results):
@@ -629,13 +1254,34 @@ class TaskScheduler(Module):
             # this call was made at the same time a task was being canceled.  
             # Only worry about sending the results back to the Task Head 
             # if the task is still running
+            if job is None and worker_key in self._stopping:
+                # the stopped copy of a duplicated job finished before it
+                # received the stop.  Its results were already received from
+                # the other copy.
+                self._stopping.discard(worker_key)
+                self.workers[worker_key].remote.callRemote('release_worker')
+                return
+
+            if job and worker_key in self._speculative:
+                if all([failed for key, result, failed in results]):
+                    # the other copy may still succeed
+                    logger.info('Worker:%s - duplicated job failed' % \
+                                worker_key)
+                    with self._worker_lock:
+                        self._end_speculation(worker_key)
+                        self._release_share(worker_key)
+                    self.add_worker(worker_key)
+                    return
+                self._stop_duplicate(worker_key, job)
+
             if job:
                 task_instance = job.task_instance
                 if results[0][0]:
                     if isinstance(job, (TaskInstance)):
                         job = job.local_workunit
                         task_instance.local_workunit = None
-                    else:
+                        self._free_main_workers.add(worker_key)
+                    elif not self._promote_prefetched(worker_key):
                         # Hold this worker for the next workunit or mainworker
                         # releases it.
                         self.hold_worker(worker_key)
@@ -644,7 +1290,7 @@ class TaskScheduler(Module):
                     # for this task, otherwise there will be nothing to advance.
                     # this reassigns the waiting worker quickly.
                     if len(task_instance._worker_requests) != 0:
-                        threads.deferToThread(self._schedule)
+                        self._request_schedule()
     
                     # if this was a subtask the main task needs the results and to 
                     # be informed
@@ -652,12 +1298,18 @@ class TaskScheduler(Module):
                     logger.debug('Worker:%s - informed that subtask completed' %
                             main_worker.name)
                     
-                    main_worker.remote.callRemote('receive_results', worker_key,
-                            results, job.subtask_key)
+                    if isinstance(job, (Batch,)):
+                        undelivered = self._undelivered(job, results)
+                    else:
+                        undelivered = results
+                    if undelivered:
+                        main_worker.remote.callRemote('receive_results', \
+                                worker_key, undelivered, job.subtask_key)
     
                     # save information about the workunits to the database
                     now = datetime.now()
-                    if len(results) > 1:
+                    self._record_workunit_time(job, now)
+                    if isinstance(job, (Batch,)):
                         for workunit_key, results, failed in results:
                             status_msg = 'failed' if failed else 'completed'
                             workunit = job[workunit_key]
@@ -667,11 +1319,10 @@ class TaskScheduler(Module):
                                 workunit.subtask_key, workunit_key))
                             workunit.completed = now
                             workunit.status = status
-                            workunit.save()
-                        job.size = len(results)
+                        job.size = len(job.workunits)
                         job.status = STATUS_COMPLETE
                         job.completed = now
-                        job.save()
+                        self._save_job(job)
                     else:
                         status_msg = 'failed' if results[0][2] else 'completed'
                         logger.info('Worker:%s - %s: %s:%s (%s)' %  \
@@ -680,7 +1331,7 @@ class TaskScheduler(Module):
                         status = STATUS_FAILED if results[0][2] else STATUS_COMPLETE
                         job.status = status
                         job.completed = now
-                        job.save()
+                        self._save_job(job)
     
                 else:
                     # this is the root task, so we can return the worker to the
@@ -693,16 +1344,85 @@ class TaskScheduler(Module):
                     job.save()
 
 
+    def send_partial_results(self, worker_key, results):
+        """
+        Called by workers running a batch with the results of some of its
+        workunits while the rest of the batch is still running.  The results
+        are passed on to the main worker and their workunits are recorded as
+        complete.
+
+        @param worker_key - worker running the batch
+        @param results - list of (workunit, results, failed)
+        """
+        logger.debug('Worker:%s - sent partial results' % worker_key)
+        with self._lock:
+            job = self.get_worker_job(worker_key)
+            if isinstance(job, (TaskInstance,)):
+                # the main worker is running a batch of its own task
+                job = job.local_workunit
+            if not isinstance(job, (Batch,)):
+                return
+
+            results = self._undelivered(job, results)
+            if not results:
+                return
+
+            task_instance = job.task_instance
+            main_worker = self.workers[task_instance.worker]
+            main_worker.remote.callRemote('receive_results', worker_key,
+                    results, job.subtask_key)
+
+            now = datetime.now()
+            for workunit_key, result, failed in results:
+                workunit = job[workunit_key]
+                logger.info('Worker:%s - %s: %s:%s (%s)' % \
+                    (worker_key, 'failed' if failed else 'completed', \
+                    job.task_key, workunit.subtask_key, workunit_key))
+                workunit.completed = now
+                workunit.status = STATUS_FAILED if failed else STATUS_COMPLETE
+                # workunits of ephemeral tasks are recorded with their batch
+                if not task_instance.ephemeral:
+                    self.workunit_writer.save(workunit)
+
+
+    def _undelivered(self, job, results):
+        """
+        Filters out the results of workunits of a batch that were already
+        passed to the main worker, as partial results or by the other copy of
+        a duplicated batch.  The remaining results are recorded as delivered.
+
+        @param job - Batch the results belong to
+        @param results - list of (workunit, results, failed)
+        @returns list of results not yet delivered
+        """
+        delivered = getattr(job, 'delivered', None)
+        if delivered is None:
+            delivered = job.delivered = set()
+        results = [r for r in results if r[0] not in delivered]
+        delivered.update([r[0] for r in results])
+        return results
+
+
     def worker_stopped(self, worker_key):
         """
-        Called by workers when they have stopped due to a cancel task request.
+        Called by workers when they have stopped due to a cancel task request,
+        or after the other copy of a duplicated job finished first.
         """
+        if worker_key in self._stopping:
+            self._stopping.discard(worker_key)
+            logger.info(' Worker:%s - stopped duplicate job' % worker_key)
+            self.add_worker(worker_key)
+            return
+
+        with self._worker_lock:
+            # the task was cancelled, both copies are stopping
+            self._speculative.pop(worker_key, None)
         job = self.get_worker_job(worker_key)
         if job.subtask_key:
             # save information about this workunit to the database
             job.completed = datetime.now()
             job.status = STATUS_CANCELLED
-            job.save()
+            self._save_job(job)
         
         logger.info(' Worker:%s - stopped' % worker_key)
         self.add_worker(worker_key, STATUS_CANCELLED)
@@ -723,6 +1443,7 @@ class TaskScheduler(Module):
         job = self._active_workers.get(worker_key, None)
         if job:
             released_worker_key = job.task_instance.waiting_workers.pop()
+            self._waiting_workers.pop(released_worker_key, None)
 
         if released_worker_key:
             logger.debug('Task %s - releasing worker: %s' % \
@@ -732,6 +1453,16 @@ class TaskScheduler(Module):
             self.add_worker(released_worker_key)
 
 
+    def worker_count(self, worker_key):
+        """
+        Returns the number of workers connected to the master.  Used by tasks
+        to size how much work they request at once.
+
+        @param worker_key: worker making the request
+        """
+        return len(self.workers)
+
+
     def worker_connected(self, worker_avatar):
         """
         Callback when a worker has been successfully authenticated
@@ -0,0 +1,99 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import with_statement
+from bisect import bisect_left, insort
+from collections import deque
+from threading import Lock
+
+
+class Speculator(object):
+    """
+    Detects straggling workunits for speculative execution.
+
+    The per workunit run times of completed jobs are tracked for each subtask
+    of each task.  A running job is a straggler when its time per workunit is
+    more than `multiple` times the median for its subtask.  The median is only
+    trusted once `min_samples` jobs of the subtask have completed, and only the
+    most recent `window` samples are kept.
+    """
+
+    def __init__(self, multiple=2, min_samples=5, window=1000):
+        """
+        @param multiple - multiple of the median a job must exceed
+        @param min_samples - completed jobs required before speculating
+        @param window - number of recent samples the median is computed from
+        """
+        self.multiple = multiple
+        self.min_samples = min_samples
+        self.window = window
+        self._samples = {}  # (task_id, subtask_key) -> (deque, sorted list)
+        self._lock = Lock()
+
+
+    def record(self, task_id, subtask_key, seconds):
+        """
+        Records the time per workunit of a completed job.
+        """
+        with self._lock:
+            try:
+                recent, ordered = self._samples[(task_id, subtask_key)]
+            except KeyError:
+                recent, ordered = self._samples[(task_id, subtask_key)] = \
+                                                                (deque(), [])
+            if len(recent) == self.window:
+                del ordered[bisect_left(ordered, recent.popleft())]
+            recent.append(seconds)
+            insort(ordered, seconds)
+
+
+    def median(self, task_id, subtask_key):
+        """
+        Returns the median time per workunit of a subtask, or None if too few
+        jobs completed.
+        """
+        with self._lock:
+            try:
+                recent, ordered = self._samples[(task_id, subtask_key)]
+            except KeyError:
+                return None
+            count = len(ordered)
+            if count < self.min_samples:
+                return None
+            if count % 2:
+                return ordered[count / 2]
+            return (ordered[count/2 - 1] + ordered[count/2]) / 2.0
+
+
+    def is_straggler(self, task_id, subtask_key, seconds):
+        """
+        Returns whether a job running for `seconds` per workunit is a
+        straggler.
+        """
+        median = self.median(task_id, subtask_key)
+        return median is not None and seconds > median * self.multiple
+
+
+    def forget(self, task_id):
+        """
+        Discards the samples of a task.
+        """
+        with self._lock:
+            for key in self._samples.keys():
+                if key[0] == task_id:
+                    del self._samples[key]
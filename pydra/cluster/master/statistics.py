@@ -53,6 +53,22 @@ class StatisticsModule(Module):
             return {}
 
 
+    def subtask_average(self, task_key, subtask_key):
+        """
+        Returns the average time, in seconds, taken by workunits of a subtask
+        in previous runs of the task, or None if it has not been recorded.
+        Averages of zero are reported as None because times are only recorded
+        with a resolution of a second.
+        """
+        stats = self.task_statistics(task_key)
+        if not stats:
+            return None
+        subtask = stats['subtask'].get(subtask_key, None)
+        if not subtask or not subtask['sum_time']:
+            return None
+        return subtask['sum_time'] / float(subtask['num_completed'])
+
+
     def update_all(self):
         """
         Updates all unaccounted for completed TaskInstance's.
@@ -97,6 +113,12 @@ class StatisticsModule(Module):
         """
         Given a TaskInstance, calculate subtask stats. 
         """
+        # tasks with ephemeral workunits only record a summary
+        for key, summary in task_instance.workunit_summary.items():
+            if not key in stats:
+                stats[key] = self.init_stat_dict()
+            self.merge_stats(summary, stats[key])
+
         workunits = task_instance.workunits.values()
         if workunits:
             for work in workunits:
@@ -146,6 +168,31 @@ class StatisticsModule(Module):
         # standard deviation
         stats['std_dev'] = sqrt(stats['variance']) if stats['variance'] != -1 else -1
 
+    def merge_stats(self, summary, stats):
+        """
+        Adds a workunit summary, aggregating many inputs, to the dictionary
+        of stats given.
+        """
+        n = summary['completed']
+        if not n:
+            return
+        avg = summary['sum_time'] / float(n)
+        M2 = summary['sum_sq'] - n * avg * avg
+        total = stats['num_completed'] + n
+        # combine averages and variances of the two sets
+        delta = avg - stats['avg']
+        stats['M2'] = stats['M2'] + M2 + \
+                        delta * delta * stats['num_completed'] * n / total
+        stats['avg'] = stats['avg'] + delta * n / total
+        stats['num_completed'] = total
+        stats['sum_time'] += summary['sum_time']
+        stats['max'] = max(summary['max'], stats['max'])
+        stats['min'] = summary['min'] if stats['min'] == -1 \
+                                      else min(summary['min'], stats['min'])
+        if total - 1:
+            stats['variance'] = stats['M2'] / (total - 1)
+        stats['std_dev'] = sqrt(stats['variance']) if stats['variance'] != -1 else -1
+
     def init_stat_dict(self):
         """
         Base statistics measures
@@ -0,0 +1,80 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+
+from pydra.cluster.master.fair_share import FairShare
+
+
+class TaskInstance(object):
+    def __init__(self, task_key, user=None, priority=5, queued=0):
+        self.task_key = task_key
+        self.user = user
+        self.priority = priority
+        self.queued = queued
+
+
+class FairShare_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.share = FairShare(half_life=100)
+        self.big = TaskInstance('big', 'alice', queued=0)
+        self.small = TaskInstance('small', 'bob', queued=1)
+
+    def test_share_key(self):
+        self.assertEqual(self.share.share_key(self.big), 'alice')
+        self.assertEqual(self.share.share_key(TaskInstance('key')), 'key')
+
+    def test_running_workers(self):
+        """ a user with running workers is served after one without """
+        self.assert_(self.share.score(self.big, 0) < \
+                     self.share.score(self.small, 0))
+        self.share.start('w0', self.big, 0)
+        self.share.start('w1', self.big, 0)
+        self.assert_(self.share.score(self.small, 0) < \
+                     self.share.score(self.big, 0))
+
+    def test_stop_charges_usage(self):
+        self.share.start('w0', self.big, 0)
+        self.share.start('w0', self.big, 5)
+        self.share.stop('w0', 10)
+        self.share.stop('w0', 20)
+        self.assertEqual(self.share.usage('alice', 10), 10)
+        self.assertEqual(self.share.usage('alice', 110), 5)
+        self.assert_(self.share.score(self.small, 10) < \
+                     self.share.score(self.big, 10))
+
+    def test_weights(self):
+        self.share.weights = {'alice':4}
+        self.share.charge('alice', 20, 0)
+        self.share.charge('bob', 10, 0)
+        self.assert_(self.share.score(self.big, 0) < \
+                     self.share.score(self.small, 0))
+
+    def test_priority(self):
+        """ priority still takes precedence over shares """
+        self.share.start('w0', self.big, 0)
+        self.big.priority = 1
+        self.assert_(self.share.score(self.big, 0) < \
+                     self.share.score(self.small, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
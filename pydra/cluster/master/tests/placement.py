@@ -0,0 +1,70 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+
+from pydra.cluster.master.placement import LocalityPlacement
+
+
+class Job(object):
+    def __init__(self, subtask_key='subtask', locality=None):
+        self.subtask_key = subtask_key
+        self.locality = locality
+
+
+class TaskInstance(object):
+    def __init__(self, worker='main:11881:0'):
+        self.worker = worker
+        self.locality_wait = None
+
+
+class LocalityPlacement_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.placement = LocalityPlacement()
+        self.workers = ['other:11881:0', 'main:11881:1', 'other:11881:1']
+
+    def test_prefers_main_worker_node(self):
+        index = self.placement.place(TaskInstance(), Job(), self.workers)
+        self.assertEqual(index, 1)
+
+    def test_prefers_data_location(self):
+        job = Job(locality=['other:11881'])
+        index = self.placement.place(TaskInstance(), job, self.workers)
+        self.assertEqual(index, 2)
+
+    def test_root_task_takes_last_worker(self):
+        task = TaskInstance(worker=None)
+        index = self.placement.place(task, Job(subtask_key=None), self.workers)
+        self.assertEqual(index, 2)
+
+    def test_delay(self):
+        self.placement.delay = 5
+        task = TaskInstance()
+        workers = ['other:11881:0']
+        self.assertEqual(self.placement.place(task, Job(), workers, 100), None)
+        self.assertEqual(task.locality_wait, 100)
+        self.assertEqual(self.placement.place(task, Job(), workers, 103), None)
+        self.assertEqual(self.placement.place(task, Job(), workers, 105), 0)
+        self.assertEqual(task.locality_wait, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
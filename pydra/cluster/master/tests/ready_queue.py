@@ -0,0 +1,114 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from pydra.cluster.master.ready_queue import ReadyQueue
+
+
+class ReadyQueue_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = ReadyQueue()
+
+    def test_empty(self):
+        self.assertEqual(self.queue.peek(), None)
+        self.assertEqual(self.queue.pop(), None)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_order(self):
+        self.queue.add('c', (5, 3))
+        self.queue.add('a', (1, 1))
+        self.queue.add('b', (5, 2))
+
+        self.assertEqual(self.queue.peek(), 'a')
+        self.assertEqual(self.queue.pop(), 'a')
+        self.assertEqual(self.queue.pop(), 'b')
+        self.assertEqual(self.queue.pop(), 'c')
+        self.assertEqual(self.queue.pop(), None)
+
+    def test_fifo_for_equal_scores(self):
+        for task in ('a', 'b', 'c'):
+            self.queue.add(task, 5)
+        self.assertEqual([self.queue.pop() for i in range(3)], ['a','b','c'])
+
+    def test_add_twice(self):
+        self.queue.add('a', 1)
+        self.queue.add('a', 0)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.pop(), 'a')
+        self.assertEqual(self.queue.pop(), None)
+
+    def test_discard(self):
+        self.queue.add('a', 1)
+        self.queue.add('b', 2)
+        self.queue.discard('a')
+        self.queue.discard('does not exist')
+
+        self.assert_('a' not in self.queue)
+        self.assertEqual(self.queue.peek(), 'b')
+        self.assertEqual(len(self.queue), 1)
+
+        # discarded task may be added again
+        self.queue.add('a', 3)
+        self.assertEqual(self.queue.pop(), 'b')
+        self.assertEqual(self.queue.pop(), 'a')
+
+    def test_rescore(self):
+        scores = {'a':1, 'b':2, 'c':3}
+        for task, score in scores.items():
+            self.queue.add(task, score)
+        self.queue.discard('b')
+
+        scores['a'] = 10
+        self.queue.rescore(lambda task: scores[task])
+
+        self.assertEqual(len(self.queue._heap), 2)
+        self.assertEqual(self.queue.pop(), 'c')
+        self.assertEqual(self.queue.pop(), 'a')
+
+    def test_defer(self):
+        self.queue.add('a', 1)
+        self.queue.add('b', 2)
+        self.queue.add('c', 3)
+
+        self.queue.defer('a')
+        self.queue.defer('b')
+        self.assertEqual(self.queue.peek(), 'c')
+        self.assert_('a' not in self.queue)
+
+        self.queue.restore()
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual([self.queue.pop() for i in range(3)], ['a','b','c'])
+
+    def test_defer_readded(self):
+        self.queue.add('a', 1)
+        self.queue.add('b', 2)
+        self.queue.defer('a')
+        self.queue.add('a', 3)
+
+        self.queue.restore()
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual([self.queue.pop() for i in range(2)], ['b','a'])
+        self.assertEqual(self.queue.pop(), None)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from datetime import datetime
+
+from pydra.config import configure_django_settings
+configure_django_settings()
+
+from pydra.cluster.constants import *
+from pydra.cluster.master.ready_queue import ReadyQueue
+from pydra.cluster.master.scheduler import TaskScheduler
+from pydra.cluster.tasks import STATUS_COMPLETE
+from pydra.models import TaskInstance, WorkRequest, Batch
+
+
+class ManagerProxy():
+    """
+    Holds shared properties and records signals emitted by a module
+    """
+    def __init__(self):
+        self.shared = {}
+        self.signals = []
+
+    def get_shared(self, key):
+        return self.shared.get(key, None)
+
+    def set_shared(self, key, value):
+        self.shared[key] = value
+
+    def emit_signal(self, signal, *args, **kwargs):
+        self.signals.append(signal)
+
+
+class RemoteProxy():
+    """
+    Records remote calls made to a worker
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, *args):
+        self.calls.append(args)
+
+
+class WorkerProxy():
+    def __init__(self, name):
+        self.name = name
+        self.remote = RemoteProxy()
+
+
+class WorkUnitWriterProxy():
+    """
+    Records saved jobs instead of writing them to the database
+    """
+    def __init__(self):
+        self.saved = []
+
+    def save(self, job):
+        self.saved.append(job)
+
+
+def create_scheduler(workers):
+    """
+    Creates a TaskScheduler with the state normally set up by _register(),
+    without starting its timers or reading the queue from the database.
+
+    @param workers - keys of connected workers
+    """
+    scheduler = TaskScheduler()
+    scheduler.manager = ManagerProxy()
+    scheduler.workers = dict([(key, WorkerProxy(key)) for key in workers])
+    scheduler.workunit_writer = WorkUnitWriterProxy()
+    scheduler._queue = []
+    scheduler._ready = ReadyQueue()
+    scheduler._active_tasks = {}
+    scheduler._idle_workers = []
+    scheduler._active_workers = {}
+    scheduler._prefetched = {}
+    scheduler._waiting_workers = {}
+    scheduler._speculative = {}
+    scheduler._stopping = set()
+    return scheduler
+
+
+def create_task_instance(worker='main', workunits=()):
+    """
+    Creates an unsaved TaskInstance with a request queued for each workunit
+    """
+    task_instance = TaskInstance()
+    task_instance.task_key = 'task'
+    task_instance.worker = worker
+    task_instance.ephemeral = False
+    for workunit in workunits:
+        task_instance.queue_worker_request( \
+                            WorkRequest('task.subtask', workunit, {}))
+    return task_instance
+
+
+class PartialResults_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = create_scheduler(['main'])
+        self.main = self.scheduler.workers['main']
+
+    def test_main_worker_local_batch(self):
+        """
+        Verifies partial results of a batch run by the main worker itself are
+        passed on, and only the rest are passed on when the batch completes
+        """
+        task_instance = create_task_instance(workunits=['a', 'b', 'c'])
+        batch = task_instance.get_batch(3)
+        batch.worker = 'main'
+        batch.started = datetime.now()
+        task_instance.local_workunit = batch
+        self.scheduler._active_workers['main'] = task_instance
+
+        self.scheduler.send_partial_results('main', \
+                                [('a', 1, False), ('b', 2, False)])
+        self.assertEqual(self.main.remote.calls, [('receive_results', 'main', \
+                    [('a', 1, False), ('b', 2, False)], 'task.subtask')])
+        self.assertEqual(batch['a'].status, STATUS_COMPLETE)
+        self.assertEqual(batch['b'].status, STATUS_COMPLETE)
+        self.assertEqual(batch['c'].status, None)
+
+        self.scheduler.send_results('main', \
+                    [('a', 1, False), ('b', 2, False), ('c', 3, False)])
+        self.assertEqual(self.main.remote.calls[1], ('receive_results', \
+                    'main', [('c', 3, False)], 'task.subtask'))
+        self.assertEqual(task_instance.local_workunit, None)
+        self.assertEqual(batch['c'].status, STATUS_COMPLETE)
+
+
+class ScheduleNext_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = create_scheduler([])
+        self.deferred = []
+        defer = self.scheduler._ready.defer
+        def record_defer(task_instance):
+            self.deferred.append(task_instance)
+            defer(task_instance)
+        self.scheduler._ready.defer = record_defer
+
+    def queue_busy_tasks(self, count):
+        """
+        Queues parallel tasks with pending requests whose main workers are all
+        running a workunit of their own
+        """
+        for i in range(count):
+            main = 'main%d' % i
+            task_instance = create_task_instance(main, ['a'])
+            task_instance.id = i + 1
+            task_instance.local_workunit = Batch()
+            self.scheduler._main_workers.add(main)
+            self.scheduler._active_workers[main] = task_instance
+            self.scheduler._active_tasks[task_instance.id] = task_instance
+            self.scheduler._queue.append([i, task_instance])
+            self.scheduler._ready.add(task_instance, i)
+
+    def test_no_workers(self):
+        """
+        Verifies the scheduler stops at the first ready task when there are
+        no idle, waiting or free main workers
+        """
+        self.queue_busy_tasks(100)
+        self.assertEqual(self.scheduler._schedule_next(), None)
+        self.assertEqual(self.deferred, [])
+        self.assertEqual(len(self.scheduler._ready), 100)
+
+    def test_local_candidates(self):
+        """
+        Verifies ready tasks with a free main worker or a held worker are the
+        only tasks the scheduler may look past a task for
+        """
+        self.queue_busy_tasks(100)
+        free = self.scheduler._active_workers['main50']
+        free.local_workunit = None
+        self.scheduler._free_main_workers.add('main50')
+        holding = self.scheduler._active_workers['main70']
+        self.scheduler._waiting_workers['held'] = holding
+        finished = self.scheduler._active_workers['main90']
+        self.scheduler._ready.discard(finished)
+        self.scheduler._waiting_workers['released'] = finished
+
+        self.assertEqual(self.scheduler._local_candidates(), \
+                         set([free, holding]))
@@ -0,0 +1,62 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import unittest
+
+from pydra.cluster.master.speculation import Speculator
+
+
+class Speculator_Test(unittest.TestCase):
+
+    def test_median(self):
+        """
+        Verifies the median needs min_samples and is computed over the window
+        """
+        speculator = Speculator(min_samples=3, window=4)
+        speculator.record(1, 'sub', 1)
+        speculator.record(1, 'sub', 5)
+        self.assertEqual(speculator.median(1, 'sub'), None)
+
+        speculator.record(1, 'sub', 3)
+        self.assertEqual(speculator.median(1, 'sub'), 3)
+
+        speculator.record(1, 'sub', 4)
+        self.assertEqual(speculator.median(1, 'sub'), 3.5)
+
+        # the first sample falls out of the window
+        speculator.record(1, 'sub', 9)
+        self.assertEqual(speculator.median(1, 'sub'), 4.5)
+        self.assertEqual(speculator.median(2, 'sub'), None)
+
+
+    def test_is_straggler(self):
+        """
+        Verifies only jobs slower than the multiple of the median straggle
+        """
+        speculator = Speculator(multiple=2, min_samples=3)
+        self.assertFalse(speculator.is_straggler(1, 'sub', 100))
+        for seconds in (1, 2, 3):
+            speculator.record(1, 'sub', seconds)
+        self.assertFalse(speculator.is_straggler(1, 'sub', 4))
+        self.assert_(speculator.is_straggler(1, 'sub', 4.5))
+        self.assertFalse(speculator.is_straggler(1, 'other', 100))
+
+        speculator.forget(1)
+        self.assertFalse(speculator.is_straggler(1, 'sub', 100))
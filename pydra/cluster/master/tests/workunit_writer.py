@@ -0,0 +1,138 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from pydra.config import configure_django_settings
+configure_django_settings()
+
+from pydra.cluster.master.workunit_writer import WorkUnitWriter
+from pydra.cluster.tasks import STATUS_COMPLETE, STATUS_RUNNING
+from pydra.models import TaskInstance, WorkUnit
+
+
+class WorkUnitWriter_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.task_instance = TaskInstance()
+        self.task_instance.task_key = 'task'
+        self.task_instance.save()
+        self.writer = WorkUnitWriter()
+
+    def tearDown(self):
+        self.task_instance.delete()
+
+    def create_workunit(self, key):
+        workunit = WorkUnit()
+        workunit.task_instance = self.task_instance
+        workunit.task_key = 'task'
+        workunit.subtask_key = 'task.subtask'
+        workunit.workunit = key
+        return workunit
+
+    def stored(self):
+        """
+        Returns (workunit, worker, status) of the task's stored workunits
+        """
+        values = WorkUnit.objects.filter(task_instance=self.task_instance) \
+                    .order_by('workunit').values_list('workunit', 'worker', \
+                                                      'status')
+        return [tuple(value) for value in values]
+
+    def test_insert(self):
+        """
+        Verifies new workunits are written on flush and get ids assigned by
+        the database
+        """
+        workunits = [self.create_workunit(key) for key in 'abc']
+        for workunit in workunits:
+            self.writer.save(workunit)
+        self.assertEqual(len(self.writer), 3)
+        self.assertEqual(self.stored(), [])
+
+        self.assert_(self.writer.flush())
+        self.assertEqual(len(self.writer), 0)
+        self.assertEqual(self.stored(), [('a', None, None), ('b', None, None), \
+                                         ('c', None, None)])
+        for workunit in workunits:
+            self.assertEqual(WorkUnit.objects.get(id=workunit.id).workunit, \
+                             workunit.workunit)
+
+    def test_insert_changed(self):
+        """
+        Verifies a workunit changed before it is flushed is inserted once,
+        with its latest values
+        """
+        workunit = self.create_workunit('a')
+        self.writer.save(workunit)
+        workunit.worker = 'worker'
+        workunit.status = STATUS_RUNNING
+        self.writer.save(workunit)
+        self.assertEqual(len(self.writer), 1)
+
+        self.assert_(self.writer.flush())
+        self.assertEqual(self.stored(), [('a', 'worker', STATUS_RUNNING)])
+
+    def test_update(self):
+        """
+        Verifies changes to stored workunits are written on flush
+        """
+        workunits = [self.create_workunit(key) for key in 'ab']
+        for workunit in workunits:
+            self.writer.save(workunit)
+        self.writer.flush()
+
+        for workunit in workunits:
+            workunit.worker = 'worker'
+            workunit.status = STATUS_COMPLETE
+            self.writer.save(workunit)
+        self.assertEqual(len(self.writer), 2)
+        self.assertEqual(self.stored(), [('a', None, None), ('b', None, None)])
+
+        self.assert_(self.writer.flush())
+        self.assertEqual(self.stored(), [('a', 'worker', STATUS_COMPLETE), \
+                                         ('b', 'worker', STATUS_COMPLETE)])
+
+    def test_mixed(self):
+        """
+        Verifies a flush writes both new workunits and changes to stored ones
+        """
+        stored = self.create_workunit('a')
+        self.writer.save(stored)
+        self.writer.flush()
+
+        stored.status = STATUS_COMPLETE
+        self.writer.save(stored)
+        self.writer.save(self.create_workunit('b'))
+        self.assertEqual(len(self.writer), 2)
+
+        self.assert_(self.writer.flush())
+        self.assertEqual(self.stored(), [('a', None, STATUS_COMPLETE), \
+                                         ('b', None, None)])
+
+    def test_flush_size(self):
+        """
+        Verifies pending workunits are written once flush_size are pending
+        """
+        self.writer.flush_size = 2
+        self.writer.save(self.create_workunit('a'))
+        self.assertEqual(self.stored(), [])
+        self.writer.save(self.create_workunit('b'))
+        self.assertEqual(len(self.writer), 0)
+        self.assertEqual(self.stored(), [('a', None, None), ('b', None, None)])
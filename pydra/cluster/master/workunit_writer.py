@@ -0,0 +1,180 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import with_statement
+from threading import Lock
+
+from django.db import connection, transaction
+
+from pydra.models import WorkUnit
+
+import logging
+logger = logging.getLogger('root')
+
+
+class WorkUnitWriter(object):
+    """
+    Write-behind buffer for WorkUnit rows.
+
+    Saving every WorkUnit individually costs a database round trip and a
+    commit per workunit, several times over its life.  For tasks with many
+    workunits the master spends most of its time waiting on the database.
+    WorkUnitWriter instead buffers new and changed WorkUnits and writes them
+    in a single transaction when flush() is called or when `flush_size`
+    WorkUnits are pending.  A WorkUnit changed several times between flushes
+    is only written once.
+
+    New WorkUnits are inserted one row at a time so that the database assigns
+    their ids; a WorkUnit's id is None until it has been flushed.  Updates are
+    written in bulk.
+
+    The scheduler flushes on a timer (WORKUNIT_FLUSH_INTERVAL), before a task
+    is reported finished and when the reactor shuts down.  Changes made since
+    the last flush are lost if the master crashes.
+    """
+
+    # fields that change once a WorkUnit is created
+    UPDATE_FIELDS = ('worker', 'status', 'started', 'completed')
+
+    # maximum rows written per statement
+    CHUNK_SIZE = 250
+
+    def __init__(self, flush_size=1000):
+        """
+        @param flush_size - number of pending WorkUnits that triggers a flush
+        """
+        self.flush_size = flush_size
+        self._inserts = {}  # id(WorkUnit) -> WorkUnit not yet in the database
+        self._updates = {}  # id -> WorkUnit with unwritten changes
+        self._inserting = {}    # inserts taken by the running flush
+        self._changed = {}      # inserts changed while being written
+        self._lock = Lock()         # guards the buffers
+        self._flush_lock = Lock()   # serializes flushes, preserving order
+
+
+    def __len__(self):
+        return len(self._inserts) + len(self._updates)
+
+
+    def save(self, job):
+        """
+        Schedules a WorkUnit, or all WorkUnits in a Batch, to be written.
+
+        @param job - WorkUnit or Batch
+        """
+        if isinstance(job, (WorkUnit,)):
+            workunits = (job,)
+        else:
+            workunits = job.workunits.values()
+
+        with self._lock:
+            for workunit in workunits:
+                if workunit.id is not None:
+                    self._updates[workunit.id] = workunit
+                elif id(workunit) in self._inserting:
+                    # the row may be written before this change, update it
+                    # once its id is known
+                    self._changed[id(workunit)] = workunit
+                else:
+                    self._inserts[id(workunit)] = workunit
+            pending = len(self)
+
+        if pending >= self.flush_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Writes all pending WorkUnits to the database.  Updates are written as
+        UPDATE ... CASE statements.
+
+        If writing fails the WorkUnits are kept and retried on the next flush.
+
+        @returns True if all pending WorkUnits were written
+        """
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._inserts = self._inserts, {}
+                updates, self._updates = self._updates, {}
+                self._inserting = inserts
+            if not (inserts or updates):
+                return True
+
+            logger.debug('Writing %d new and %d updated workunits' % \
+                         (len(inserts), len(updates)))
+            try:
+                cursor = connection.cursor()
+                self._insert(cursor, inserts.values())
+                self._update(cursor, sorted(updates.items()))
+                transaction.commit_unless_managed()
+                with self._lock:
+                    for workunit in self._changed.values():
+                        self._updates[workunit.id] = workunit
+                    self._inserting, self._changed = {}, {}
+                return True
+            except Exception, e:
+                # put the workunits back so they are retried on the next flush
+                logger.error('Failed to write workunits: %s' % e)
+                transaction.rollback_unless_managed()
+                with self._lock:
+                    for key, workunit in inserts.items():
+                        # ids of rolled back rows are no longer valid
+                        if workunit.id is not None:
+                            self._updates.pop(workunit.id, None)
+                            workunit.id = None
+                        self._inserts.setdefault(key, workunit)
+                    for key, workunit in updates.items():
+                        self._updates.setdefault(key, workunit)
+                    self._inserting, self._changed = {}, {}
+                return False
+
+
+    def _insert(self, cursor, workunits):
+        qn = connection.ops.quote_name
+        table = WorkUnit._meta.db_table
+        pk = WorkUnit._meta.pk
+        fields = [f for f in WorkUnit._meta.fields if f is not pk]
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                qn(table),
+                ', '.join([qn(f.column) for f in fields]),
+                ', '.join(['%s'] * len(fields)))
+        for workunit in workunits:
+            cursor.execute(sql, [getattr(workunit, f.attname) for f in fields])
+            workunit.id = connection.ops.last_insert_id(cursor, table, \
+                                                        pk.column)
+
+
+    def _update(self, cursor, workunits):
+        qn = connection.ops.quote_name
+        pk = qn(WorkUnit._meta.pk.column)
+        columns = [(WorkUnit._meta.get_field(name).column, name) \
+                        for name in self.UPDATE_FIELDS]
+        for i in xrange(0, len(workunits), self.CHUNK_SIZE):
+            chunk = workunits[i:i+self.CHUNK_SIZE]
+            cases = []
+            params = []
+            for column, name in columns:
+                cases.append('%s = CASE %s %s END' % (qn(column), pk, \
+                                ' '.join(['WHEN %s THEN %s'] * len(chunk))))
+                for id, workunit in chunk:
+                    params.extend((id, getattr(workunit, name)))
+            params.extend([id for id, workunit in chunk])
+            sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+                    qn(WorkUnit._meta.db_table), ', '.join(cases), pk,
+                    ', '.join(['%s'] * len(chunk)))
+            cursor.execute(sql, params)
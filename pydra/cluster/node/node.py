@@ -19,6 +19,7 @@
 from pydra.logs.log_aggregator import NodeLogAggregator
 from pydra.cluster.module import ModuleManager
 from pydra.cluster.node import *
+from pydra.cluster.tasks.shuffle import NodeShuffleService
 from pydra.cluster.tasks.task_manager import TaskManager
 
 # init logging
@@ -48,6 +49,7 @@ class NodeServer(ModuleManager):
             TaskSyncClient,
             NodeZeroConfService,
             NodeLogAggregator,
+            NodeShuffleService,
         ]
 
         ModuleManager.__init__(self)
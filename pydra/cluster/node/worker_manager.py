@@ -34,10 +34,13 @@ from pydra.cluster.tasks.task_manager import TaskManager
 import logging
 logger = logging.getLogger('root')
 
+WORKER_POOL = getattr(pydra_settings, 'WORKER_POOL', False)
+WORKER_POOL_PRELOAD = getattr(pydra_settings, 'WORKER_POOL_PRELOAD', 3)
+
 
 class WorkerManager(Module):
 
-    _shared = ['master', 'workers', 'worker_connection_manager']
+    _shared = ['master', 'workers', 'worker_connection_manager', 'info']
 
     def __init__(self):
         self._remotes = [
@@ -57,9 +60,11 @@ class WorkerManager(Module):
             # master proxy - functions exposed to the workers that are passed
             # through to the Master
             ('WORKER', self.send_results),
+            ('WORKER', self.send_partial_results),
             ('WORKER', self.request_worker),
             ('WORKER', self.worker_stopped),
-            ('WORKER', self.request_worker_release)
+            ('WORKER', self.request_worker_release),
+            ('WORKER', self.worker_count)
 
         ]
 
@@ -69,12 +74,14 @@ class WorkerManager(Module):
 
         self._listeners = {
             'WORKER_CONNECTED':self.run_task_delayed,
-            'WORKER_DISCONNECTED':self.clean_up_finished_worker
+            'WORKER_DISCONNECTED':self.clean_up_finished_worker,
+            'NODE_INITIALIZED':self.start_pool
         }
 
         self.__lock = RLock()
         self.workers_finishing = []
         self.initialized = False
+        self._recent_tasks = []  # (key, version), most recently run first
 
 
     def _register(self, manager):
@@ -102,6 +109,13 @@ class WorkerManager(Module):
                     except OSError:
                         logger.warn('Error cleaning up worker process, retrying')
 
+        # replace the worker so the pool stays full
+        if WORKER_POOL and self.initialized:
+            with self.__lock:
+                if worker.name not in self.workers:
+                    logger.debug('Pool - Replacing worker: %s' % worker.name)
+                    self._spawn_worker(worker.name)
+
 
     def init_node(self, avatar_name, master_host, master_port, node_key):
         """
@@ -113,6 +127,7 @@ class WorkerManager(Module):
             self.master_host = master_host
             self.master_port = master_port
             self.node_key = node_key
+            self.initialized = True
 
         self.emit('NODE_INITIALIZED', node_key)
 
@@ -213,22 +228,27 @@ class WorkerManager(Module):
         return self.proxy_to_master('request_worker_release', *args, **kwargs)
 
 
+    def worker_count(self, *args, **kwargs):
+        return self.proxy_to_master('worker_count', *args, **kwargs)
+
+
     def retrieve_task_failed(self, *args, **kwargs):
         pass
 
 
     def run_task(self, avatar, worker_key, key, version, args={}, \
-            workunits=None, main_worker=None, task_id=None):
+            workunits=None, main_worker=None, task_id=None, prefetch=False):
         """
         Runs a task on this node.  This function should
         """
         self.task_manager.retrieve_task(key, version, self._run_task, \
                 self.retrieve_task_failed, worker_key, args, workunits, \
-                main_worker, task_id)
+                main_worker, task_id, prefetch)
 
 
     def _run_task(self, key, version, task_class, module_search_path, \
-            worker_key, args={}, workunits=None, main_worker=None, task_id=None):
+            worker_key, args={}, workunits=None, main_worker=None, task_id=None,
+            prefetch=False):
         """
         Runs a task on this node.  The worker scheduler on master makes all
         decisions about which worker to run on.  This method only checks
@@ -247,47 +267,39 @@ class WorkerManager(Module):
         @param workunit_key - key of workunit to run
         @param main_worker - main worker for this task
         @param task_id - id of task being run
+        @param prefetch - work is queued on the worker to be run after the work
+                          it is currently running.
         """
         logger.info('RunTask:%s  key=%s  sub=%s  main=%s' \
             % (task_id, key, workunits, main_worker))
         worker = None
 
         with self.__lock:
-            if worker_key in self.workers:
+            self._task_used(key, version)
+
+            if worker_key in self.workers and \
+                                not self.workers[worker_key].authenticated:
+                # pooled worker that has not connected yet.  The task is
+                # started by run_task_delayed once it connects.
+                logger.debug('RunTask - Waiting for worker %s' % worker_key)
+                worker = self.workers[worker_key]
+                worker.run_task_deferred = Deferred()
+
+            elif worker_key in self.workers:
                 # worker exists.  reuse it.
                 logger.debug('RunTask - Using existing worker %s' % worker_key)
                 worker = self.workers[worker_key]
                 worker.run_task_deferred = worker.remote.callRemote('run_task',\
-                        key, version, args, workunits, main_worker, task_id)
+                        key, version, args, workunits, main_worker, task_id, \
+                        prefetch)
             else:
                 # worker not running. start it saving the information required
                 # to start the subtask.  This function will return a deferred
                 # to the master.  The deferred will be
                 logger.debug('RunTask - Spawning worker: %s', worker_key)
-                worker = WorkerAvatar(self.worker_connection_manager, \
-                                                            worker_key)
-                worker.worker_key = worker_key
-                worker.run_task_deferred = Deferred()
-                pydra_root = pydra.__file__[:pydra.__file__.rfind('/')]
-                try:
-                    worker.popen = Popen(['python',
-                                '%s/cluster/worker/worker.py' % pydra_root,
-                                worker_key,
-                                pydra_settings.WORKER_PORT.__str__()])
-                except OSError:
-                    # XXX ocassionally processes will have a communcation error
-                    # while loading.  The process will be running but the POpen
-                    # object is not constructed.  This means that we have no
-                    # access to the subprocess functions.  Instead we must get
-                    # the pid from the newly run process after it starts.  The
-                    # pid can then be used instead of the Popen object.
-                    #
-                    # relevant bugs:
-                    #    http://pydra-project.osuosl.org/ticket/158
-                    #    http://bugs.python.org/issue1068268
-                    debug.warn('OSError while spawning process, failing back to pid. see ticket #158')
+                worker = self._spawn_worker(worker_key)
+                if not worker.popen:
                     worker.run_task_deferred.addCallback(worker.get_pid)
-                self.workers[worker_key] = worker
 
             worker.key = key
             worker.version = version
@@ -302,13 +314,88 @@ class WorkerManager(Module):
             return worker.run_task_deferred
 
 
+    def _spawn_worker(self, worker_key):
+        """
+        Starts a worker process.  The worker is added to the pool of workers
+        but will not be available until it connects.
+
+        @param worker_key - key of worker to start
+        @returns avatar of the worker
+        """
+        worker = WorkerAvatar(self.worker_connection_manager, worker_key)
+        worker.worker_key = worker_key
+        worker.run_task_deferred = Deferred()
+        pydra_root = pydra.__file__[:pydra.__file__.rfind('/')]
+        try:
+            worker.popen = Popen(['python',
+                        '%s/cluster/worker/worker.py' % pydra_root,
+                        worker_key,
+                        pydra_settings.WORKER_PORT.__str__()])
+        except OSError:
+            # XXX ocassionally processes will have a communcation error
+            # while loading.  The process will be running but the POpen
+            # object is not constructed.  This means that we have no
+            # access to the subprocess functions.  Instead we must get
+            # the pid from the newly run process after it starts.  The
+            # pid can then be used instead of the Popen object.
+            #
+            # relevant bugs:
+            #    http://pydra-project.osuosl.org/ticket/158
+            #    http://bugs.python.org/issue1068268
+            logger.warn('OSError while spawning process, failing back to pid. see ticket #158')
+        self.workers[worker_key] = worker
+        return worker
+
+
+    def start_pool(self, node_key):
+        """
+        Starts a worker for each core of the node ahead of any work, so that
+        tasks do not wait for worker processes to start, import pydra and
+        authenticate.
+
+        @param node_key - key of this node
+        """
+        if not WORKER_POOL:
+            return
+        with self.__lock:
+            for i in range(self.info['cores']):
+                worker_key = '%s:%i' % (node_key, i)
+                if worker_key not in self.workers:
+                    logger.debug('Pool - Spawning worker: %s' % worker_key)
+                    self._spawn_worker(worker_key)
+
+
+    def _task_used(self, key, version):
+        """
+        Records a task run on this node.  Idle workers preload the most
+        recently used tasks.
+        """
+        task = (key, version)
+        if task in self._recent_tasks:
+            self._recent_tasks.remove(task)
+        self._recent_tasks.insert(0, task)
+        del self._recent_tasks[WORKER_POOL_PRELOAD:]
+
+
     def run_task_delayed(self, worker):
         """
         Callback when a worker has started.  start the intended task.  Attach
         the deferred originally returned in run_task to the deferred returned
         from worker.run_task.  This will cause the result to propagate through
         the deferreds back to master.
+
+        Pooled workers started before any task was assigned to them are left
+        idle, preloading the tasks recently run on this node.
         """
+        if not worker.key:
+            if not worker.popen:
+                worker.get_pid(None)
+            with self.__lock:
+                tasks = list(self._recent_tasks)
+            if tasks:
+                worker.remote.callRemote('preload_tasks', tasks)
+            return
+
         sent_deferred = worker.run_task_deferred
         deferred = self._run_task(worker.key, worker.version, None, None, \
                 worker.worker_key, worker.args, worker.workunits, \
@@ -345,6 +432,10 @@ class WorkerManager(Module):
         return worker.finished
 
 
+    def send_partial_results(self, *args, **kwargs):
+        return self.proxy_to_master('send_partial_results', *args, **kwargs)
+
+
     def send_results_failed(self, worker):
         """
         Errback called when sending results to the master fails.  resend when
@@ -0,0 +1,172 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import with_statement
+
+from multiprocessing import Pool
+from threading import Event, Lock
+import logging
+import traceback
+
+logger = logging.getLogger('root')
+
+
+class LocalExecutionError(Exception):
+    """
+    Raised when a map or reduce task fails while running locally.
+    """
+    def __init__(self, workunit, error):
+        self.workunit = workunit
+        self.error = error
+
+    def __str__(self):
+        return 'workunit %s failed:\n%s' % (self.workunit, self.error)
+
+
+class LocalWorker(object):
+    """
+    Stands in for the worker running a MapReduceTask.  Work requested by the
+    task is passed to the executor.
+    """
+    worker_key = 'local'
+
+    def __init__(self, executor=None):
+        self.executor = executor
+
+    def get_worker(self):
+        return self
+
+    def get_key(self):
+        return None
+
+    def request_worker(self, subtask_key, args, workunit):
+        self.executor.submit(subtask_key, args, workunit)
+
+    def request_worker_release(self):
+        pass
+
+
+def create_task(task_class, msg, parent):
+    """
+    Creates an instance of a MapReduceTask with a local parent.
+    """
+    task = task_class(msg) if msg else task_class()
+    task.parent = parent
+    for t in (task, task.maptask.task, task.reducetask.task, \
+              task.maptask.combiner):
+        if t:
+            t.logger = logger
+    return task
+
+
+# the task instance of a pool process
+_task = None
+
+def _init_process(task_class, msg):
+    global _task
+    _task = create_task(task_class, msg, LocalWorker())
+
+
+def _run_workunit(subtask_key, args, workunit):
+    """
+    Runs a map or reduce in a pool process.
+
+    @returns (workunit, failed, results or traceback)
+    """
+    try:
+        wrapper = _task.get_subtask(subtask_key.split('.'))
+        return workunit, False, wrapper._start(args)
+    except:
+        return workunit, True, traceback.format_exc()
+
+
+class LocalExecutor(object):
+    """
+    Runs a MapReduceTask without a master or nodes.  Maps and reduces run in a
+    pool of processes on this machine, using the intermediate results backend
+    of the task.  The task itself runs in the calling process, sending work to
+    the pool as it would request workers.
+
+    Pool processes are forked, so MapReduceTask classes need not be
+    importable by name.
+    """
+
+    def __init__(self, processes=None):
+        """
+        @param processes - number of processes, defaults to the number of
+                           cpus
+        """
+        self.processes = processes
+        self._lock = Lock()
+
+
+    def run(self, task_class, args={}, msg=None):
+        """
+        Runs a MapReduceTask and returns its output.  Blocks until the task
+        completes.
+
+        @param task_class - MapReduceTask subclass to run
+        @param args - arguments of the task
+        @param msg - msg passed to the task's constructor, names its
+                     intermediate results
+        @raises LocalExecutionError if a map or reduce fails
+        """
+        self._done = Event()
+        self._error = None
+        self._output = None
+        self._pool = Pool(self.processes, _init_process, (task_class, msg))
+        self._task = create_task(task_class, msg, LocalWorker(self))
+
+        try:
+            self._task._start(args, self._task_complete)
+            while not self._done.isSet():
+                self._done.wait(1)
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+
+        if self._error:
+            raise self._error
+        return self._output
+
+
+    def submit(self, subtask_key, args, workunit):
+        """
+        Queues a map or reduce on the pool.
+        """
+        with self._lock:
+            if self._done.isSet():
+                return
+            self._pool.apply_async(_run_workunit, \
+                                   (subtask_key, args, workunit), \
+                                   callback=self._workunit_complete)
+
+
+    def _workunit_complete(self, results):
+        workunit, failed, results = results
+        if failed:
+            logger.error('local executor: %s failed' % workunit)
+            self._error = LocalExecutionError(workunit, results)
+            self._done.set()
+        elif not self._done.isSet():
+            self._task._work_unit_complete(results, workunit)
+
+
+    def _task_complete(self, output):
+        self._output = output
+        self._done.set()
@@ -1,15 +1,25 @@
 from __future__ import with_statement
 
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
 from threading import Lock
 import cPickle as pickle
 import logging
 import os
+import tempfile
+import time
 
-from twisted.internet import reactor, threads
+from twisted.internet import threads
 
 from tasks import Task, TaskNotFoundException, \
     STATUS_RUNNING, STATUS_COMPLETE
+from partitioner import HashPartitioner
+from shuffle import ShuffleDir
 from pydra.cluster.tasks.datasource import *
+from pydra.cluster.tasks.slicer import FilePickleOutput, FileUnpicleSubslicer, \
+    FileMergeSubslicer, FileBlockOutput, FileBlockSubslicer, \
+    FileBlockMergeSubslicer, SQLTableOutput, SQLTableKeyInput
 
 logger = logging.getLogger('root')
 
@@ -35,6 +45,126 @@ class AppendableDict(dict):
         super(AppendableDict, self).__getitem__(key).append(value)
 
 
+class MapOutputBuffer(object):
+    """Bounded buffer for the output of a map task.
+
+    Values are collected like an AppendableDict.  When the buffer holds `size`
+    values it is sorted by partition and key and spilled to a temporary file
+    (a run), keeping the memory used by a map bounded.  If a combiner is given
+    it is run over the buffer before each spill.
+
+    partitions() merges the runs with the values still in memory, producing
+    the output of each partition sorted by key with one (key, values) record
+    per key.
+
+    >>> b = MapOutputBuffer(lambda key: 0, size=2)
+    >>> b['b'] = 1
+    >>> b['a'] = 1
+    >>> b['b'] = 2
+    >>> [(p, list(records)) for p, records in b.partitions()]
+    [(0, [('a', [1]), ('b', [1, 2])])]
+    """
+
+    size = 100000
+
+
+    def __init__(self, partition, size=None, combiner=None, dir=None):
+        """
+        @param partition - function returning the partition of a key
+        @param size - number of values buffered before spilling to disk
+        @param combiner - optional task run over the buffer before spilling
+        @param dir - directory for spill files, defaults to the system
+                     temporary directory
+        """
+        self.partition = partition
+        if size:
+            self.size = size
+        self.combiner = combiner
+        self.dir = dir
+
+        self._buffer = AppendableDict()
+        self._count = 0
+        self._runs = []
+
+
+    def __setitem__(self, key, value):
+        self._buffer[key] = value
+        self._count += 1
+        if self._count >= self.size:
+            self.spill()
+
+
+    def _sorted_run(self):
+        """returns the buffered values as (partition, key, values) tuples
+        sorted by partition and key, and empties the buffer."""
+        buffer = self._buffer
+        if self.combiner:
+            buffer = AppendableDict()
+            self.combiner._work(input=self._buffer.iteritems(), output=buffer)
+
+        partition = self.partition
+        run = [(partition(k), k, vs) for k, vs in buffer.iteritems()]
+        run.sort(key=itemgetter(0, 1))
+
+        self._buffer = AppendableDict()
+        self._count = 0
+        return run
+
+
+    def spill(self):
+        """writes the buffer to disk as a sorted run"""
+        run = self._sorted_run()
+        if not run:
+            return
+
+        logger.debug("map output: spilling %d keys" % len(run))
+        f = tempfile.TemporaryFile(prefix='pydra-spill-', dir=self.dir)
+        for record in run:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        self._runs.append(f)
+
+
+    def _read_run(self, f, index):
+        try:
+            while True:
+                p, k, vs = pickle.load(f)
+                yield p, k, index, vs
+        except EOFError:
+            pass
+
+
+    def _group(self, records):
+        """groups merged records of a partition by key"""
+        for k, group in groupby(records, itemgetter(1)):
+            values = []
+            for record in group:
+                values.extend(record[3])
+            yield k, values
+
+
+    def partitions(self):
+        """returns an iterator of (partition, records) pairs in partition
+        order, where records is an iterator of (key, values) sorted by key.
+        Each records iterator must be consumed before moving to the next
+        partition."""
+        # records are tagged with the index of their run so that records with
+        # the same key are ordered by run rather than by their values
+        runs = [self._read_run(f, i) for i, f in enumerate(self._runs)]
+        index = len(runs)
+        runs.append((p, k, index, vs) for p, k, vs in self._sorted_run())
+
+        for p, records in groupby(merge(*runs), itemgetter(0)):
+            yield p, self._group(records)
+
+
+    def close(self):
+        """removes the spill files"""
+        for f in self._runs:
+            f.close()
+        self._runs = []
+
+
 class IntermediateResults(object):
     """Datahandler for not direct input/output handling.
 
@@ -45,14 +175,17 @@ class IntermediateResults(object):
     * map task output is a dictionary;
     * when map._work() is completed output dict is partitioned and dumped;
     * partition_output() partitions items depending on a partition() function;
-    * dump() dumps them into a unique file, returns partition-dictionary;
+    * dump() dumps them into a unique file, returns partition-dictionary of
+      (key, records, values) for each partition;
     * every map task's dump partition-dictionary is collected and provided
       to update_partitions() function for future iterator generation.
 
     partition:
     * number of partitions equals number of reducers;
     * partition must assure that a specific key will be processed by
-      one and only one reduce task.
+      one and only one reduce task;
+    * partition() is delegated to a partitioner, HashPartitioner by default;
+    * skew_report() reports the volume of map output in each partition.
 
     reduce stage:
     * __iter__() returns an iterator, which generates input keys for each
@@ -60,34 +193,45 @@ class IntermediateResults(object):
     * load() returns iterator which is used as a input iterator
       for a reduce task (subslicers);
     * iterator loads (key, values) tuples from a backend.
+
+    pipelined merging (optional):
+    * merge() merges the outputs of several maps for a partition into one,
+      returns the key of the merged output;
+    * replace_partition() replaces the merged keys of a partition with the
+      key of the merged output.
     """
 
     # mapreduce-i9e-(taks_id)-(partition)-(map_id)
     pattern = "mapreduce-i9e-%s-%d-%s"
 
 
-    def __init__(self):
+    def __init__(self, partitioner=None):
         self.task_id = "mapreduce_task"
         self.reducers = 1
+        self.task = None
+        self.partitioner = partitioner or HashPartitioner()
 
         self._partitions = {}
+        self._counts = {}
 
         self.map_output = None
         self.reduce_input = None
 
     def clear(self):
         self._partitions.clear()
+        self._counts.clear()
 
 
     def partition(self, key):
         """partition key depending on a number of a reducers"""
-        return hash(str(key)) % self.reducers
+        return self.partitioner.partition(key, self.reducers)
 
 
     def partition_output(self, output):
         """iterates through an output dictionary and partitions it,
         returns a dictionary where key is a partition number and value - items
-        of output dict belonging to this partition"""
+        of output dict belonging to this partition. Items of each partition
+        are sorted by key so they can be merged on the reduce side."""
 
         pdict = {}
 
@@ -100,21 +244,65 @@ class IntermediateResults(object):
             else:
                 pdict[p] = [(k, vs)]
 
+        for tuples in pdict.itervalues():
+            tuples.sort(key=itemgetter(0))
+
         return pdict.iteritems()
 
 
     def update_partitions(self, partitions):
         """updates partition-dictionary for future iterator generation."""
 
-        for p, filename in partitions.items():
+        for p, (filename, records, values) in partitions.items():
             if p in self._partitions:
                 self._partitions[p].append(filename)
+                counts = self._counts[p]
+                counts[0] += records
+                counts[1] += values
             else:
                 self._partitions[p] = [filename]
+                self._counts[p] = [records, values]
+
+
+    def skew_report(self):
+        """returns the map output records and values dumped to each
+        partition, and the skew: the ratio of the largest partition's values
+        to the mean.  Records of a key are counted once per map."""
+
+        partitions = {}
+        for p, (records, values) in self._counts.iteritems():
+            partitions[p] = {'records': records, 'values': values}
+
+        total = sum([values for records, values in self._counts.values()])
+        if total:
+            mean = float(total) / self.reducers
+            skew = max([values for records, values \
+                            in self._counts.values()]) / mean
+        else:
+            skew = 0
+
+        return {'partitions': partitions, 'skew': skew}
+
+
+    def replace_partition(self, p, keys, merged):
+        """replaces keys of partition p with the key of their merged output"""
+
+        partition = self._partitions[p]
+        for key in keys:
+            partition.remove(key)
+        partition.append(merged)
+
+
+    def merge(self, p, keys, mergeid):
+        """merges the outputs stored under keys for partition p into a single
+        output, returns its key.  Required for pipelined MapReduceTasks."""
+        raise NotImplementedError
 
 
     def __iter__(self):
-        return self._partitions.itervalues()
+        # in partition order, so range partitioned output is reduced in order
+        for p in sorted(self._partitions):
+            yield self._partitions[p]
 
 
     def load(self, key):
@@ -133,37 +321,114 @@ class IntermediateResults(object):
         for p, tuples in pdict:
 
             key = self.pattern % (self.task_id, p, mapid)
-            partitions[p] = key
 
             logger.debug("im: dumping %s to %s" % (str(tuples), key))
 
-            self.map_output.dump(key, tuples)
+            counts = [0, 0]
+            self.map_output.dump(key, self._count(tuples, counts))
+            partitions[p] = (key, counts[0], counts[1])
 
         return partitions
 
 
+    def _count(self, tuples, counts):
+        """counts the records and values of tuples as they are dumped"""
+        for k, vs in tuples:
+            counts[0] += 1
+            counts[1] += len(vs) if hasattr(vs, '__len__') else 1
+            yield k, vs
+
+
 class IntermediateResultsFiles(IntermediateResults):
-    """Storing intermediate results in flat files."""
+    """Storing intermediate results in flat files.
+
+    By default reduce tasks receive the (key, values) records of each map
+    output file in turn, so a key may appear once per map.  With grouped set
+    the key-sorted map outputs are merged and reduce tasks receive each key
+    once, with an iterator over all of its values.
 
-    def __init__(self, dir):
-        super(IntermediateResultsFiles, self).__init__()
+    With compressed set outputs are written in the compressed block file
+    format instead of as a stream of pickles."""
+
+    def __init__(self, dir, grouped=False, partitioner=None, compressed=False):
+        super(IntermediateResultsFiles, self).__init__(partitioner)
         self.dir = dir
 
-        self.map_output = FilePickleOutput(dir=dir)
-        self.reduce_input = FileUnpicleSubslicer(dir=dir)
+        if compressed:
+            self.map_output = FileBlockOutput(dir=dir)
+            self._merger = FileBlockMergeSubslicer
+            reader = FileBlockSubslicer
+        else:
+            self.map_output = FilePickleOutput(dir=dir)
+            self._merger = FileMergeSubslicer
+            reader = FileUnpicleSubslicer
+
+        if grouped:
+            self.reduce_input = self._merger(dir=dir)
+        else:
+            self.reduce_input = reader(dir=dir)
+
+
+    def merge(self, p, keys, mergeid):
+        """merges key-sorted map outputs into one key-sorted output"""
+
+        key = self.pattern % (self.task_id, p, mergeid)
+
+        merger = self._merger(dir=self.dir)
+        merger.input = keys
+        self.map_output.dump(key, ((k, list(vs)) for k, vs in merger))
+
+        return key
+
+
+class IntermediateResultsShuffle(IntermediateResultsFiles):
+    """Storing intermediate results in files on the nodes that wrote them.
+
+    Map outputs are written to a directory local to the map's worker, by
+    default SHUFFLE_DIR, and their keys name the worker.  Reduce tasks read
+    outputs written on their own node directly and stream outputs written on
+    other nodes, in bounded chunks, from the node's shuffle service.  Unlike
+    IntermediateResultsFiles no shared filesystem is needed."""
+
+    def __init__(self, dir=None, grouped=False, partitioner=None, \
+                 compressed=False):
+        super(IntermediateResultsShuffle, self).__init__( \
+                    ShuffleDir(dir, self._get_worker), grouped, partitioner, \
+                    compressed)
+
+
+    def _get_worker(self):
+        return self.task.get_worker()
+
+
+    def dump(self, pdict, mapid):
+        partitions = super(IntermediateResultsShuffle, self).dump(pdict, mapid)
+        for p, (key, records, values) in partitions.items():
+            partitions[p] = (self.dir.key(key), records, values)
+        return partitions
+
+
+    def merge(self, p, keys, mergeid):
+        key = super(IntermediateResultsShuffle, self).merge(p, keys, mergeid)
+        return self.dir.key(key)
 
 
 class IntermediateResultsSQL(IntermediateResults):
     """Storing intermediate results in SQL table."""
 
-    def __init__(self, table, db):
-        super(IntermediateResultsSQL, self).__init__()
+    def __init__(self, table, db, partitioner=None):
+        super(IntermediateResultsSQL, self).__init__(partitioner)
         self.table = table
 
         self.map_output = SQLTableOutput(db=db, table=table)
         self.reduce_input = SQLTableKeyInput(db=db, table=table)
 
 
+    def create_table(self):
+        """creates the intermediate results table, if it does not exist"""
+        self.map_output.create_table()
+
+
 class MapReduceTask(Task):
 
     datasources = {}
@@ -174,8 +439,28 @@ class MapReduceTask(Task):
     map = None
     reduce = None
 
+    # optional combiner.  It is run on each map's output before the output is
+    # partitioned and dumped, reducing the volume of intermediate results.
+    # Like a reduce task it receives (key, values) pairs as input, and
+    # its output must be valid input for the reduce task.
+    combine = None
+
+    # number of values a map buffers in memory before spilling them to
+    # spill_dir, None for the default of MapOutputBuffer.  Spill files are
+    # created in the system temporary directory if spill_dir is None.
+    map_buffer_size = None
+    spill_dir = None
+
     reducers = 1
 
+    # in pipelined mode the map outputs of each partition are merged as maps
+    # complete, merge_factor outputs at a time.  This overlaps the reduce
+    # side's copy and merge work with the remaining maps so the reduce stage
+    # reads fewer, larger outputs once the last map completes.  Requires
+    # intermediate results that implement merge().
+    pipelined = False
+    merge_factor = 4
+
     description = "Abstract Map-Reduce Task"
 
     sequential = False
@@ -185,13 +470,18 @@ class MapReduceTask(Task):
         Task.__init__(self, msg)
         self.__lock = Lock()
         self.map_tasks = {}
+        self.merge_tasks = {}
         self.reduce_tasks = {}
 
         self.im = self.intermediate
         self.im.task_id = msg
         self.im.reducers = self.reducers
+        self.im.task = self
 
-        self.maptask = MapWrapper(self.map('MapTask'), self.im, self)
+        combiner = self.combine('CombineTask') if self.combine else None
+        self.maptask = MapWrapper(self.map('MapTask'), self.im, self, \
+                                  combiner, self.map_buffer_size, \
+                                  self.spill_dir)
 
         self.reducetask = ReduceWrapper(self.reduce('ReduceTask'), self.im,self)
 
@@ -219,8 +509,13 @@ class MapReduceTask(Task):
         * reduce_next(): checking if any data to process and starting a reduce
           task, if no more data available, call _complete();
 
+        merge (pipelined only):
+        * merge_next(): starting merge tasks for partitions with enough
+          unmerged map outputs while maps are still running.
+
         _complete:
-        * cleanup and callbacks.
+        * cleanup and callbacks, called as soon as the last map, merge or
+          reduce task returns its results.
         """
 
         self.__callback = callback
@@ -229,11 +524,23 @@ class MapReduceTask(Task):
         self._status = STATUS_RUNNING
         self._reduce_called = False
         self._input_iter = enumerate(self.input)
+        self._unmerged = {}
+        self._merge_count = 0
+        self._phases = {}
+
+        if self.im.partitioner.needs_sample():
+            self._sample_map_output()
 
         # let's start the processing
         logger.debug('mapreduce: map stage')
+        self._start_phase('map')
 
-        self.request_work()
+        with self.__lock:
+            self.request_work()
+
+            # there may be no input at all
+            if not self._work_remaining():
+                self._complete()
 
     def request_work(self):
         """
@@ -244,15 +551,64 @@ class MapReduceTask(Task):
             while self.map_next():
                 pass
 
-        if not self.map_tasks:
+            if self.pipelined and self.map_tasks:
+                self.merge_next()
+
+        if not self.map_tasks and not self.merge_tasks:
             if not self._reduce_called:
+                logger.debug('mapreduce: reduce stage')
                 self._partition_iter = enumerate(self.im)
                 self._reduce_called = True
+                self._start_phase('reduce')
 
             while self.reduce_next():
                 pass
 
 
+    def _sample_map_output(self):
+        """runs the map task locally on the first inputs to give the
+        partitioner a sample of the map output keys"""
+
+        partitioner = self.im.partitioner
+        keys = []
+        for id, i in enumerate(self.input):
+            if id == partitioner.sample_inputs:
+                break
+            output = AppendableDict()
+            self.maptask.task._work(input=self.input.load(i), output=output, \
+                                    id='sample%d' % id, input_key=i)
+            keys.extend(output.iterkeys())
+
+        logger.debug('mapreduce: sampled %d keys for partitioning' % len(keys))
+        partitioner.sample(keys, self.reducers)
+
+
+    def _work_remaining(self):
+        """returns whether any map, merge or reduce task is outstanding"""
+        return bool(self.map_tasks or self.merge_tasks or self.reduce_tasks)
+
+
+    def _start_phase(self, phase):
+        """records the start of a phase, if it has not already started"""
+        if phase not in self._phases:
+            self._phases[phase] = [time.time(), None]
+
+
+    def _end_phase(self, phase):
+        """records the end of a phase.  The last call is the one kept."""
+        self._phases[phase][1] = time.time()
+
+
+    def phase_timings(self):
+        """
+        Returns a dictionary of the seconds spent in each completed phase:
+        map, merge (pipelined only) and reduce.  The merge phase overlaps the
+        map phase.
+        """
+        return dict([(phase, end - start) for phase, (start, end) \
+                        in self._phases.iteritems() if end is not None])
+
+
     def map_next(self):
         """more work for a map task"""
         try:
@@ -266,6 +622,9 @@ class MapReduceTask(Task):
                     'id': mapid,
                     'input_key': i,
                    }
+        partitioner = self.im.partitioner.state()
+        if partitioner is not None:
+            map_args['partitioner'] = partitioner
 
         logger.debug("mapreduce: requesting worker for %s: %s"
                 % (mapid, self.maptask.get_key()) )
@@ -274,6 +633,30 @@ class MapReduceTask(Task):
         return True
 
 
+    def merge_next(self):
+        """more work for merge tasks"""
+
+        for p, keys in self._unmerged.iteritems():
+            while len(keys) >= self.merge_factor:
+                merge_keys = keys[:self.merge_factor]
+                del keys[:self.merge_factor]
+
+                mergeid = 'merge%d' % self._merge_count
+                self._merge_count += 1
+                self.merge_tasks[mergeid] = (p, merge_keys)
+                merge_args = {
+                                'id': mergeid,
+                                'merge': p,
+                                'partition': merge_keys,
+                             }
+
+                logger.debug("mapreduce: requesting worker for %s: %s"
+                        % (mergeid, self.reducetask.get_key()) )
+                self._start_phase('merge')
+                self.parent.request_worker(self.reducetask.get_key(), \
+                                           merge_args, mergeid)
+
+
     def reduce_next(self):
         """more work for reduce task"""
 
@@ -306,6 +689,19 @@ class MapReduceTask(Task):
                 logger.debug('   map result %s: %s' % (id, result))
                 self.im.update_partitions(result)
                 del self.map_tasks[id]
+                if self.pipelined:
+                    for p, (key, records, values) in result.items():
+                        self._unmerged.setdefault(p, []).append(key)
+                if not self.map_tasks:
+                    self._end_phase('map')
+
+            elif id in self.merge_tasks:
+                logger.debug('   merge result %s: %s' % (id, result))
+                p, keys = self.merge_tasks.pop(id)
+                self.im.replace_partition(p, keys, result)
+                # merged outputs may be merged again
+                self._unmerged[p].append(result)
+                self._end_phase('merge')
 
             elif id in self.reduce_tasks:
                 logger.debug('   reduce result %s: %s' % (id, result))
@@ -322,7 +718,7 @@ class MapReduceTask(Task):
                         self.get_worker().worker_key)
                 self.get_worker().request_worker_release()
 
-            if not self.map_tasks and not self.reduce_tasks:
+            if not self._work_remaining():
                 # all work is done, call the task specific function to combine
                 # the results
                 self._complete()
@@ -331,17 +727,22 @@ class MapReduceTask(Task):
 
     def _complete(self):
         """
-        Should be called when all map and reduce task have completed
+        Should be called when all map and reduce task have completed.  It is
+        called by _work_unit_complete() when the results of the last task
+        arrive, there is no need to poll for completion.
         """
 
-        if self.reduce_tasks:
-            logger.debug('mapreduce: waiting for reduce stage to finish')
-            reactor.callLater(1, self._complete)
+        if self._work_remaining() or self._status == STATUS_COMPLETE:
+            logger.debug('mapreduce: work remaining or already complete')
             return
 
+        self.partition_skew = self.im.skew_report()
         self.im.clear()
+        self._end_phase('reduce')
 
         logger.debug('mapreduce: finished')
+        logger.info('mapreduce: phase timings %s' % self.phase_timings())
+        logger.info('mapreduce: partition skew %s' % self.partition_skew)
         logger.info(self.output)
 
         self._status = STATUS_COMPLETE
@@ -438,29 +839,49 @@ class MapReduceWrapper():
 
 class MapWrapper(MapReduceWrapper):
 
+    def __init__(self, task, im, parent, combiner=None, buffer_size=None, \
+                 spill_dir=None):
+        MapReduceWrapper.__init__(self, task, im, parent)
+        self.combiner = combiner
+        if combiner:
+            combiner.parent = parent
+        self.buffer_size = buffer_size
+        self.spill_dir = spill_dir
+
+
     def _start(self, args={}, callback=None, callback_args={}):
         """
         Overwrites Task._start() because MapTask needs to provide special input
         and output dictionaries. And it is necessary to self.im.dump()
         intermediate results after self.work().
+
+        Output is collected in a MapOutputBuffer, which spills to disk as it
+        fills.  The intermediate results of each partition are dumped sorted
+        by key.
         """
         logger.debug('%s - MapWrapper.work()'  % self.get_worker().worker_key)
 
         if args.has_key('input_key') and hasattr(self.parent, 'input'):
             args['input'] = self.parent.input.load(args['input_key'])
 
-        output = AppendableDict()
+        if args.has_key('partitioner'):
+            self.im.partitioner.load_state(args.pop('partitioner'))
+
+        output = MapOutputBuffer(self.im.partition, self.buffer_size, \
+                                 self.combiner, self.spill_dir)
         args['output'] = output
 
         id = args['id']
         logger.debug("%s._work()" % id)
 
-        self.task._work(**args) # ignoring results
-
-        pdict = self.im.partition_output(output)
+        try:
+            self.task._work(**args) # ignoring results
 
-        logger.debug("%s._work() dumping i9e" % id)
-        results = self.im.dump(pdict, id) # partitions are our results
+            logger.debug("%s._work() dumping i9e" % id)
+            # partitions are our results
+            results = self.im.dump(output.partitions(), id)
+        finally:
+            output.close()
 
         logger.debug('%s - MapWrapper - work complete' % \
                      self.get_worker().worker_key)
@@ -482,14 +903,23 @@ class ReduceWrapper(MapReduceWrapper):
         """
         Overwrites Task._start() beacuse ReduceTask needs to provide special
         input dictionaries (from self.im).
+
+        Merges requested by a pipelined MapReduceTask are also run here,
+        as the reduce side work they are.  The key of the merged output is
+        the result of a merge.
         """
         logger.debug('%s - ReduceWrapper.work()' % self.get_worker().worker_key)
 
-        args['input'] = self.im.load(args['partition'])
-        output = args['output'] = {}
+        if args.has_key('merge'):
+            results = self.im.merge(args['merge'], args['partition'], \
+                                    args['id'])
+
+        else:
+            args['input'] = self.im.load(args['partition'])
+            output = args['output'] = {}
 
-        self.task._work(**args) # ignoring results
-        results = output
+            self.task._work(**args) # ignoring results
+            results = output
 
         logger.debug('%s - ReduceWrapper - work complete' % \
                      self.get_worker().worker_key)
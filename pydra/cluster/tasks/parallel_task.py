@@ -37,10 +37,22 @@ class ParallelTask(Task):
     _workunit_total = 0
     _workunit_completed = 0     # count of workunits handed out.  This is used to identify transactions
     subtask_key = None          # cached key from subtask
+    _all_requested = False      # every workunit from the datasource was requested
+    _work_units = None          # generator of workunits not yet requested
+    _window_size = None         # max workunits in progress, None for no limit
 
     datasource = None
     """The datasource description."""
 
+    window = None
+    """Maximum number of workunits requested but not yet complete.  None
+    requests all workunits up front.  'auto' sizes the window from the number
+    of workers in the cluster, `window_per_worker` workunits per worker.
+    Further workunits are read from the datasource as results return, keeping
+    memory on the master and main worker bounded."""
+
+    window_per_worker = 2
+
     def __init__(self, msg=None):
         Task.__init__(self, msg)
         self._lock = RLock()             # general lock
@@ -48,6 +60,8 @@ class ParallelTask(Task):
         self.__subtask_class = None      # class of subtask
         self.__subtask_args = None       # args for initializing subtask
         self.__subtask_kwargs = None     # kwargs for initializing subtask
+        self.__clean_subtasks = []       # clean instances of subtask running
+        self._data_in_progress = {}      # workunits of data
 
         self.datasource = DataSource(self.datasource)
 
@@ -92,7 +106,16 @@ class ParallelTask(Task):
             else:
                 raise TaskNotFoundException("Task not found: %s" % task_path)
         #recurse down into the child
-        consumed, subtask = self.subtask._get_subtask(task_path[1:])
+        consumed, subtask = self.subtask._get_subtask(task_path[1:], clean)
+        if clean and subtask is self.subtask and self.__subtask_class:
+            # workunits run at the same time each need their own instance
+            subtask = self.__subtask_class(*self.__subtask_args, \
+                                                **self.__subtask_kwargs)
+            subtask.parent = self
+            with self._lock:
+                self.__clean_subtasks = [t for t in self.__clean_subtasks \
+                                         if t._status != STATUS_COMPLETE]
+                self.__clean_subtasks.append(subtask)
         return task_path[:2], subtask
 
 
@@ -100,18 +123,83 @@ class ParallelTask(Task):
         """
         Create work requests for all planned subtasks.
 
-        This function eagerly creates all planned work requests in one shot,
-        using `get_work_units()` to create all work units.
+        Without a window this function eagerly creates all planned work
+        requests in one shot, using `get_work_units()` to create all work
+        units.  With a window only enough work units to fill it are requested,
+        the rest are requested as work units complete.
 
         More complex `Task` subclasses, like `MapReduceTask`, may employ a
         more sophisticated algorithm that permits cross worker dependencies.
         """
+        self._window_size = self.get_window_size()
+
+        if self._window_size is None:
+            for data, index in self.get_work_units():
+                self._request_work_unit(data, index)
+            with self._lock:
+                self._all_requested = True
+                if not self._data_in_progress:
+                    self._all_work_complete()
+
+        else:
+            self.logger.debug('Paralleltask - requesting work units, window=%s'
+                % self._window_size)
+            with self._lock:
+                self._work_units = self.get_work_units()
+                self._request_window()
+                if self._all_requested and not self._data_in_progress:
+                    self._all_work_complete()
+
+
+    def get_window_size(self):
+        """
+        Returns the maximum number of work units that may be in progress, or
+        None if there is no limit.
+        """
+        if self.window != 'auto':
+            return self.window
+        try:
+            workers = self.get_worker().worker_count()
+        except Exception, e:
+            self.logger.warning('Paralleltask - could not get worker count: %s'
+                % e)
+            workers = 1
+        return max(1, workers) * self.window_per_worker
+
+
+    def _request_window(self):
+        """
+        Requests work units until the window is full or the datasource is
+        exhausted.  Must be called while holding the lock.
+        """
+        while self._work_units and not self.STOP_FLAG \
+                and len(self._data_in_progress) < self._window_size:
+            try:
+                data, index = self._work_units.next()
+            except StopIteration:
+                self._work_units = None
+                self._all_requested = True
+                break
+            self._request_work_unit(data, index)
+
+
+    def _request_work_unit(self, data, index):
+        self.logger.debug('Paralleltask - assigning remote work: key=%s, args=%s'
+            % ('--', index))
+        self.parent.request_worker(self.subtask.get_key(), {'data': data},
+            index, self.workunit_locality(data))
+
+
+    def workunit_locality(self, data):
+        """
+        Returns the locations (node keys or hosts) that hold the data for a
+        work unit, or None if the work unit may run anywhere.  The scheduler
+        prefers to run work units on workers in these locations.
 
-        for data, index in self.get_work_units():
-            self.logger.debug('Paralleltask - assigning remote work: key=%s, args=%s'
-                % ('--', index))
-            self.parent.request_worker(self.subtask.get_key(), {'data': data},
-                index)
+        By default the locality is read from a `locality` attribute on the
+        data, if present.  Subclasses may override this.
+        """
+        return getattr(data, 'locality', None)
 
 
     def get_work_units(self):
@@ -130,14 +218,17 @@ class ParallelTask(Task):
         slicer = self.datasource.unpack()
 
         while True:
-            data, index = next(slicer), self._workunit_count
-
-            yield data, index
+            data = next(slicer)
 
+            # the work unit must be in progress before it is requested, its
+            # results may return before the next work unit is read.
             with self._lock:
+                index = self._workunit_count
                 self._workunit_count += 1
                 self._data_in_progress[index] = data
 
+            yield data, index
+
 
     def _stop(self):
         """
@@ -145,6 +236,10 @@ class ParallelTask(Task):
         """
         Task._stop(self)
         self.subtask._stop()
+        with self._lock:
+            subtasks = list(self.__clean_subtasks)
+        for subtask in subtasks:
+            subtask._stop()
 
 
     def _work(self, **kwargs):
@@ -181,6 +276,10 @@ class ParallelTask(Task):
             if self.STOP_FLAG:
                 self.task_complete(None)
 
+            # replace the work unit if requesting within a window
+            if self._work_units:
+                self._request_window()
+
             # no data left in progress, release 1 worker.  when there is work in
             # the queue the waiting worker will be selected automatically by
             # the scheduler.  Releasing it must be explicit though.
@@ -191,14 +290,21 @@ class ParallelTask(Task):
             self._workunit_completed += 1
 
             #check for more work
-            if not self._data_in_progress:
-                #all work is done, call the task specific function to combine the results 
-                self.logger.debug('Paralleltask - all workunits complete, calling task post process')
-                results = self.work_complete()
-                self._complete(results)
+            if self._all_requested and not self._data_in_progress:
+                self._all_work_complete()
                 return
 
 
+    def _all_work_complete(self):
+        """
+        All work units are complete, call the task specific function to
+        combine the results.  Must be called while holding the lock.
+        """
+        self.logger.debug('Paralleltask - all workunits complete, calling task post process')
+        results = self.work_complete()
+        self._complete(results)
+
+
     def _worker_failed(self, index):
         """
         A worker failed while working.  re-add the data to the list
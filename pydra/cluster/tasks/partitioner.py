@@ -0,0 +1,165 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from bisect import bisect_right
+from random import randint
+from zlib import crc32
+import cPickle as pickle
+
+
+class HashPartitioner(object):
+    """
+    Partitions keys by a stable hash of the key.
+
+    Python's hash() differs between interpreters and architectures, so nodes
+    of a mixed cluster could send the same key to different reducers.  Keys
+    are hashed with crc32 of a canonical string instead, so that equal keys
+    share a partition: strings are hashed directly, unicode strings as utf-8,
+    integral numbers (including bools and integral floats) by their decimal
+    digits, other floats as '%.17g' and tuples by their elements.  None is
+    also supported.  The repr() of other types may differ between equal
+    values or between interpreters, eg. dicts and sets, so they raise
+    TypeError.
+    """
+
+    def partition(self, key, partitions):
+        """
+        Returns the partition of a key.
+
+        @param key - key to partition
+        @param partitions - number of partitions
+        @raises TypeError if the key's type is not supported
+        """
+        return (crc32(self._key_data(key)) & 0xffffffff) % partitions
+
+
+    def _key_data(self, key):
+        """
+        Returns the canonical string a key is hashed by
+        """
+        if isinstance(key, str):
+            return key
+        elif isinstance(key, unicode):
+            return key.encode('utf-8')
+        elif isinstance(key, (int, long)):
+            # 1, 1L and True are equal keys
+            return '%d' % key
+        elif isinstance(key, float):
+            if key % 1 == 0:
+                return '%d' % key
+            return '%.17g' % key
+        elif isinstance(key, tuple):
+            return repr(tuple([self._key_data(item) for item in key]))
+        elif key is None:
+            return 'None'
+        raise TypeError('Unsupported key type for HashPartitioner: %s' % \
+                        type(key).__name__)
+
+
+    def needs_sample(self):
+        """
+        Returns whether the partitioner must be given a sample of the map
+        output keys before it can partition.
+        """
+        return False
+
+
+    def sample(self, keys, partitions):
+        """
+        Configures the partitioner from a sample of the map output keys.
+        """
+        pass
+
+
+    def state(self):
+        """
+        Returns the state map tasks need to partition like this partitioner,
+        as a string, or None if there is no state.
+        """
+        return None
+
+
+    def load_state(self, state):
+        """
+        Loads the state returned by state().
+        """
+        pass
+
+
+class RangePartitioner(HashPartitioner):
+    """
+    Partitions keys into ranges so that every key of a partition sorts before
+    the keys of the next partition.  Reducing the partitions in order gives
+    globally sorted output.
+
+    Boundaries may be given, or computed from a sample of the map output keys
+    so that partitions receive roughly the same number of keys.
+    """
+
+    def __init__(self, boundaries=None, sample_size=1000, sample_inputs=2):
+        """
+        @param boundaries - sorted list of the first key of every partition
+                            after the first
+        @param sample_size - number of keys the boundaries are computed from
+        @param sample_inputs - number of inputs mapped to sample keys
+        """
+        self.boundaries = boundaries
+        self.sample_size = sample_size
+        self.sample_inputs = sample_inputs
+
+
+    def partition(self, key, partitions):
+        return min(bisect_right(self.boundaries, key), partitions - 1)
+
+
+    def needs_sample(self):
+        return self.boundaries is None
+
+
+    def sample(self, keys, partitions):
+        """
+        Computes boundaries from keys, using a random sample of sample_size
+        keys.
+        """
+        sample = []
+        for i, key in enumerate(keys):
+            if i < self.sample_size:
+                sample.append(key)
+            else:
+                j = randint(0, i)
+                if j < self.sample_size:
+                    sample[j] = key
+        sample.sort()
+
+        boundaries = []
+        for p in xrange(1, partitions):
+            if not sample:
+                break
+            key = sample[p * len(sample) / partitions]
+            if not boundaries or key > boundaries[-1]:
+                boundaries.append(key)
+        self.boundaries = boundaries
+
+
+    def state(self):
+        # pickled, so keys keep their type when passed to map tasks
+        return pickle.dumps(self.boundaries, 2).encode('base64')
+
+
+    def load_state(self, state):
+        self.boundaries = pickle.loads(str(state).decode('base64'))
@@ -0,0 +1,378 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import with_statement
+
+from uuid import uuid4
+import cPickle as pickle
+import os
+
+from twisted.internet import threads
+
+import pydra_settings
+from pydra.cluster.module import Module
+from pydra.util import makedirs
+
+import logging
+logger = logging.getLogger('root')
+
+SHUFFLE_DIR = getattr(pydra_settings, 'SHUFFLE_DIR', \
+                      '%s/shuffle' % pydra_settings.RUNTIME_FILES_DIR)
+SHUFFLE_CHUNK_SIZE = getattr(pydra_settings, 'SHUFFLE_CHUNK_SIZE', 1048576)
+LARGE_RESULT_SIZE = getattr(pydra_settings, 'LARGE_RESULT_SIZE', 0)
+
+# large results are stored as shuffle files with this prefix.  They are
+# deleted once they have been read.
+RESULT_PREFIX = 'result-'
+RESULT_HANDLE = '__large_result__'
+
+
+def same_node(worker_key, other_key):
+    """
+    Returns True if two workers run on the same node.  Worker keys are
+    composed of the node key and the index of the worker: host:port:index
+    """
+    return worker_key.rsplit(':', 1)[0] == other_key.rsplit(':', 1)[0]
+
+
+def split_key(key):
+    """
+    Splits the key of a shuffle file into the key of the worker that wrote it
+    and its filename.  The worker is None for keys without one.
+    """
+    if '/' in key:
+        return key.split('/', 1)
+    return None, key
+
+
+def read_chunk(filename, offset, dir=None, size=None):
+    """
+    Reads a chunk of a file in the shuffle directory.  Only files directly
+    within the directory are served.
+
+    @param filename - name of the file
+    @param offset - offset of the chunk.  Negative offsets are relative to
+                    the end of the file.
+    @param dir - directory, defaults to SHUFFLE_DIR
+    @param size - maximum size of the chunk, defaults to SHUFFLE_CHUNK_SIZE
+    @returns (offset, data, size of the file)
+    """
+    if os.path.basename(filename) != filename or filename in ('', '.', '..'):
+        raise IOError('not a shuffle file: %s' % filename)
+
+    with open(os.path.join(dir or SHUFFLE_DIR, filename), 'rb') as f:
+        f.seek(0, 2)
+        length = f.tell()
+        if offset < 0:
+            offset = max(length + offset, 0)
+        f.seek(offset)
+        return offset, f.read(size or SHUFFLE_CHUNK_SIZE), length
+
+
+def serve_chunk(filename, offset, dir=None, size=None):
+    """
+    Reads a chunk of a shuffle file for another worker, like read_chunk.
+    Large result files are deleted once their last chunk has been read.
+
+    @returns (offset, data, size of the file)
+    """
+    offset, data, length = read_chunk(filename, offset, dir, size)
+    if filename.startswith(RESULT_PREFIX) and offset + len(data) >= length:
+        os.remove(os.path.join(dir or SHUFFLE_DIR, filename))
+    return offset, data, length
+
+
+def is_result_handle(result):
+    return isinstance(result, dict) and RESULT_HANDLE in result
+
+
+def store_result(worker, result, threshold=None, dir=None):
+    """
+    Stores a large result in a shuffle file local to the worker and returns a
+    handle to it, so that only the handle is sent on to the main worker.
+    Results smaller than the threshold are returned unchanged.
+
+    @param worker - worker that produced the result
+    @param result - result of a workunit
+    @param threshold - size in bytes of the smallest result stored, defaults
+                       to LARGE_RESULT_SIZE.  0 disables storing results.
+    @param dir - directory, defaults to SHUFFLE_DIR
+    @returns result or a handle to it
+    """
+    threshold = LARGE_RESULT_SIZE if threshold is None else threshold
+    if not threshold:
+        return result
+
+    data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    if len(data) < threshold:
+        return result
+
+    dir = ShuffleDir(dir, lambda: worker)
+    filename = '%s%s' % (RESULT_PREFIX, uuid4().hex)
+    with dir._load((filename, ), 'w') as f:
+        f.write(data)
+    logger.debug('Stored large result %s: %d bytes' % (filename, len(data)))
+    return {RESULT_HANDLE:dir.key(filename), 'size':len(data)}
+
+
+def load_result(worker, result, dir=None):
+    """
+    Loads a result stored by store_result.  Results stored on the worker's
+    own node are read from the file, others are streamed from the node that
+    stored them.  Results that are not handles are returned unchanged.  This
+    may block so it must not be called from the reactor thread.
+
+    @param worker - worker receiving the result
+    @param result - result or handle to a result
+    @param dir - directory, defaults to SHUFFLE_DIR
+    """
+    if not is_result_handle(result):
+        return result
+
+    dir = ShuffleDir(dir, lambda: worker)
+    key = result[RESULT_HANDLE]
+    with dir.load((key, )) as f:
+        result = pickle.load(f)
+
+    source, filename = split_key(key)
+    if same_node(source, worker.worker_key):
+        os.remove(os.path.join(dir.root, filename))
+    return result
+
+
+class ShuffleStream(object):
+    """
+    Read only file-like object over a shuffle file on another node.  The file
+    is fetched in chunks through the worker as it is read, so at most one
+    chunk is held in memory.
+    """
+
+    def __init__(self, worker, source, filename):
+        """
+        @param worker - worker running the reduce
+        @param source - key of the worker that wrote the file
+        @param filename - name of the file
+        """
+        self.worker = worker
+        self.source = source
+        self.filename = filename
+        self.name = '%s/%s' % (source, filename)
+
+        self._chunk = ''
+        self._chunk_offset = 0
+        self._position = 0
+        self._size = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def _fetch(self, offset):
+        self._chunk_offset, self._chunk, self._size = \
+            self.worker.fetch_shuffle_chunk(self.source, self.filename, offset)
+
+
+    def _buffered(self):
+        """
+        Returns the index of the current position within the chunk, fetching
+        the chunk holding it if needed, or None at the end of the file.
+        """
+        start = self._position - self._chunk_offset
+        if 0 <= start < len(self._chunk):
+            return start
+        if self._size is not None and self._position >= self._size:
+            return None
+        self._fetch(self._position)
+        return 0 if self._chunk else None
+
+
+    def read(self, size=-1):
+        parts = []
+        while size:
+            start = self._buffered()
+            if start is None:
+                break
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, start + size)
+                size -= end - start
+            parts.append(self._chunk[start:end])
+            self._position += end - start
+        return ''.join(parts)
+
+
+    def readline(self):
+        parts = []
+        while True:
+            start = self._buffered()
+            if start is None:
+                break
+            end = self._chunk.find('\n', start) + 1 or len(self._chunk)
+            parts.append(self._chunk[start:end])
+            self._position += end - start
+            if self._chunk[end-1] == '\n':
+                break
+        return ''.join(parts)
+
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            if self._size is None:
+                self._fetch(offset)
+            offset += self._size
+        self._position = offset
+
+
+    def tell(self):
+        return self._position
+
+
+    def close(self):
+        self._chunk = ''
+
+
+class ShuffleDir(object):
+    """
+    Directory of shuffle files.  Files are written to a directory local to
+    the worker and their keys name the worker that wrote them:
+    worker_key/filename.  Files written on the reading worker's node are read
+    directly.  Files written on other nodes are streamed from them by the
+    shuffle service.
+    """
+
+    def __init__(self, root=None, get_worker=None):
+        """
+        @param root - local directory, defaults to SHUFFLE_DIR.  Only files
+                      in SHUFFLE_DIR are served to other nodes.
+        @param get_worker - function returning the worker reading or writing
+                            files
+        """
+        self.root = root or SHUFFLE_DIR
+        self.get_worker = get_worker
+
+
+    def key(self, filename):
+        """
+        Returns the key of a file written by this worker
+        """
+        return '%s/%s' % (self.get_worker().worker_key, filename)
+
+
+    def load(self, key):
+        return self._load(key)
+
+
+    def _load(self, key, mode='r'):
+        source, filename = split_key(key[0])
+
+        if 'r' in mode and source:
+            worker = self.get_worker()
+            if not same_node(source, worker.worker_key):
+                return ShuffleStream(worker, source, filename)
+
+        if 'w' in mode:
+            makedirs(self.root)
+        return open(os.path.join(self.root, filename), mode + 'b')
+
+
+class MasterShuffleRelay(Module):
+    """
+    Master side of the shuffle service.  Relays requests for chunks of
+    shuffle files to the node holding the file.  Nodes are only connected to
+    the master so all requests between nodes pass through it.
+    """
+
+    _shared = ['workers']
+
+    def __init__(self):
+        self._remotes = [
+            ('NODE', self.fetch_shuffle_chunk)
+        ]
+
+
+    def fetch_shuffle_chunk(self, worker, source, filename, offset):
+        """
+        Requests a chunk of a shuffle file from the node of the worker that
+        wrote it.
+
+        @param worker - key of worker requesting the chunk
+        @param source - key of the worker that wrote the file
+        @param filename - name of the file
+        @param offset - offset of the chunk
+        """
+        if source not in self.workers:
+            raise IOError('shuffle: unknown worker %s' % source)
+        logger.debug('Relaying shuffle chunk %s/%s:%s to %s' % \
+                     (source, filename, offset, worker))
+        return self.workers[source].remote.callRemote('send_shuffle_chunk', \
+                                                      filename, offset)
+
+
+class NodeShuffleService(Module):
+    """
+    Node side of the shuffle service.  Serves chunks of the shuffle files
+    written on this node and fetches chunks for its workers.  Chunks of files
+    written on this node are served locally, other requests are relayed
+    through the master.
+
+    Shuffle files include the large results stored by store_result.  These
+    are passed through the master in chunks, the master never holds a whole
+    result.
+    """
+
+    _shared = ['master']
+
+    def __init__(self):
+        self._remotes = [
+            ('MASTER', self.send_shuffle_chunk),
+            ('WORKER', self.fetch_shuffle_chunk)
+        ]
+
+
+    def send_shuffle_chunk(self, master, worker, filename, offset):
+        """
+        Sends a chunk of a shuffle file written on this node.
+
+        @param worker - key of worker that wrote the file
+        @param filename - name of the file
+        @param offset - offset of the chunk
+        """
+        logger.debug('Sending shuffle chunk %s:%s' % (filename, offset))
+        return threads.deferToThread(serve_chunk, filename, offset)
+
+
+    def fetch_shuffle_chunk(self, worker, source, filename, offset):
+        """
+        Fetches a chunk of a shuffle file for a worker.
+
+        @param worker - key of worker requesting the chunk
+        @param source - key of the worker that wrote the file
+        @param filename - name of the file
+        @param offset - offset of the chunk
+        """
+        if same_node(worker, source):
+            return threads.deferToThread(serve_chunk, filename, offset)
+        return self.master.remote.callRemote('fetch_shuffle_chunk', worker, \
+                                             source, filename, offset)
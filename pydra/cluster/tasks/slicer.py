@@ -1,14 +1,95 @@
 from __future__ import with_statement
 
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
 from threading import Lock
+from uuid import uuid4
 
 import cPickle as pickle
-import os, logging
+import os, logging, struct, zlib
 
 import MySQLdb
 
 logger = logging.getLogger('root')
 
+# block file format.  Records are pickled with the highest protocol and
+# length-prefixed, and grouped into zlib compressed blocks:
+#
+#   block*  index  footer
+#   block  := length (!I)  zlib(record*)
+#   record := length (!I)  pickle
+#   index  := pickle of [(block offset, block length, records), ...]
+#   footer := index offset (!Q)  index length (!I)  BLOCK_MAGIC
+BLOCK_MAGIC = 'PYB1'
+BLOCK_FOOTER = struct.Struct('!QI4s')
+BLOCK_LENGTH = struct.Struct('!I')
+
+
+def write_blocks(f, records, block_size=65536, level=1):
+    """writes records to a file in the block file format.
+
+    @param f - file opened for writing
+    @param records - iterable of picklable records
+    @param block_size - uncompressed bytes of records per block
+    @param level - zlib compression level
+    """
+    index = []
+    offset = 0
+    block, size, count = [], 0, 0
+
+    for record in records:
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        block.append(BLOCK_LENGTH.pack(len(data)))
+        block.append(data)
+        size += len(data) + BLOCK_LENGTH.size
+        count += 1
+
+        if size >= block_size:
+            offset += _write_block(f, block, offset, count, level, index)
+            block, size, count = [], 0, 0
+
+    if block:
+        offset += _write_block(f, block, offset, count, level, index)
+
+    data = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+    f.write(data)
+    f.write(BLOCK_FOOTER.pack(offset, len(data), BLOCK_MAGIC))
+
+
+def _write_block(f, block, offset, count, level, index):
+    """compresses and writes a block, returns the bytes written"""
+    data = zlib.compress(''.join(block), level)
+    f.write(BLOCK_LENGTH.pack(len(data)))
+    f.write(data)
+    index.append((offset, len(data) + BLOCK_LENGTH.size, count))
+    return len(data) + BLOCK_LENGTH.size
+
+
+def read_blocks(f):
+    """yields the records of a file in the block file format, decompressing
+    one block at a time."""
+    f.seek(-BLOCK_FOOTER.size, 2)
+    index_offset, index_length, magic = BLOCK_FOOTER.unpack( \
+                                                f.read(BLOCK_FOOTER.size))
+    if magic != BLOCK_MAGIC:
+        raise ValueError('%s is not a block file' % f.name)
+
+    f.seek(index_offset)
+    index = pickle.loads(f.read(index_length))
+
+    for offset, length, count in index:
+        f.seek(offset + BLOCK_LENGTH.size)
+        data = zlib.decompress(f.read(length - BLOCK_LENGTH.size))
+
+        position = 0
+        for i in xrange(count):
+            size, = BLOCK_LENGTH.unpack_from(data, position)
+            position += BLOCK_LENGTH.size
+            yield pickle.loads(data[position:position + size])
+            position += size
+
+
 def chain_subslicer(obj, ss_list):
 
     last_ss = obj
@@ -179,48 +260,179 @@ class FileUnpicleSubslicer(Subslicer):
                 pass
 
 
+class FileBlockSubslicer(Subslicer):
+    """
+    Reads the records of files written by FileBlockOutput.
+    """
+
+    def __iter__(self):
+        dir = self.kwargs['dir']
+
+        for filename in self.input:
+            with dir.load((filename, )) as f:
+                for record in read_blocks(f):
+                    yield record
+
+
+class FileMergeSubslicer(Subslicer):
+    """
+    Merges pickled (key, values) files that are sorted by key, such as the
+    partition files written by map tasks, and yields (key, values) with
+    values an iterator over the values of the key from every file.
+
+    Only one record per file is held in memory at a time.  The values
+    iterator of a key is only valid until the next key is retrieved.
+    """
+
+    def _records(self, f):
+        try:
+            while True:
+                yield pickle.load(f)
+        except EOFError:
+            logger.debug("subslicer: loading from %s done" % f.name)
+
+
+    def _read(self, f, index):
+        for k, vs in self._records(f):
+            # tagged with the file index so that equal keys are ordered
+            # by file rather than by comparing values
+            yield k, index, vs
+
+
+    def _values(self, group):
+        for k, index, vs in group:
+            for v in vs:
+                yield v
+
+
+    def __iter__(self):
+        dir = self.kwargs['dir']
+
+        files = []
+        try:
+            for filename in self.input:
+                files.append(dir.load((filename, )))
+
+            records = merge(*[self._read(f, i) for i, f in enumerate(files)])
+            for k, group in groupby(records, itemgetter(0)):
+                yield k, self._values(group)
+
+        finally:
+            for f in files:
+                f.close()
+
+
+class FileBlockMergeSubslicer(FileMergeSubslicer):
+    """
+    Merges files written by FileBlockOutput, like FileMergeSubslicer.  One
+    block per file is held in memory at a time.
+    """
+
+    def _records(self, f):
+        return read_blocks(f)
+
+
 class FilePickleOutput(object):
 
     def __init__(self, dir):
         self.dir = dir
 
     def dump(self, key, values):
-        with self.dir._load((key, ), mode="w") as f:
-            for obj in values:
-                pickle.dump(obj, f)
+        # written under a temporary name and renamed so the output is replaced
+        # atomically.  A duplicate of a speculatively executed map may write
+        # the same output while it is being read.
+        temp = '%s.%s' % (key, uuid4().hex)
+        with self.dir._load((temp, ), mode="w") as f:
+            self._write(f, values)
+        os.rename(f.name, os.path.join(os.path.dirname(f.name), key))
+
+    def _write(self, f, values):
+        for obj in values:
+            pickle.dump(obj, f)
+
+
+class FileBlockOutput(FilePickleOutput):
+    """
+    Writes files in the block file format: compressed blocks of records
+    pickled with the highest protocol, followed by an index of the blocks.
+    """
+
+    def __init__(self, dir, block_size=65536, level=1):
+        super(FileBlockOutput, self).__init__(dir)
+        self.block_size = block_size
+        self.level = level
+
+    def _write(self, f, values):
+        write_blocks(f, values, self.block_size, self.level)
 
 
 class SQLTableKeyInput(Subslicer):
+    """
+    Reads the (k, v) rows of intermediate results stored by SQLTableOutput.
+    Rows are fetched fetch_size at a time.  Use a server side cursor (such as
+    MySQLdb.cursors.SSCursor) for the database to stream rows instead of
+    buffering the whole result on the client.
+    """
+
+    fetch_size = 1000
 
     def __iter__(self):
 
         db = self.kwargs['db']
         table = self.kwargs['table']
+        fetch_size = self.kwargs.get('fetch_size', self.fetch_size)
         c = db.load(None)
 
+        sql = "SELECT k, v FROM %s WHERE `partition` = %%s" % table
+
         for partition in self.input:
 
-            sql = "SELECT k, v FROM %s WHERE partition = '%s'" % (table, partition)
-            logger.debug(sql)
+            logger.debug("%s [%s]" % (sql, partition))
 
-            c.execute(sql)
-            row = c.fetchone()
+            c.execute(sql, (partition, ))
+            rows = c.fetchmany(fetch_size)
 
-            while row:
-                yield row
+            while rows:
+                for row in rows:
+                    yield row
 
-                row = c.fetchone()
+                rows = c.fetchmany(fetch_size)
 
 
 class SQLTableOutput(object):
+    """
+    Stores intermediate results in a table with a row per value.  Rows are
+    inserted insert_size at a time with executemany, which MySQLdb sends as a
+    single multi-row INSERT.
+    """
+
+    insert_size = 1000
 
-    def __init__(self, db, table):
+    def __init__(self, db, table, insert_size=None):
         self.table = table
         self.db = db
+        if insert_size:
+            self.insert_size = insert_size
+
+
+    def create_table(self):
+        """creates the table, if it does not exist, with an index on
+        (partition, k) for reading partitions"""
+        c = self.db.load(None)
+        c.execute("""CREATE TABLE IF NOT EXISTS %s (
+                        `partition` VARCHAR(255) NOT NULL,
+                        k VARCHAR(255) NOT NULL,
+                        v TEXT,
+                        INDEX partition_k (`partition`, k)
+                    )""" % self.table)
 
 
     def dump(self, key, tuples):
         c = self.db.load(None)
+        sql = "INSERT INTO %s (`partition`, k, v) VALUES (%%s, %%s, %%s)" % \
+                self.table
+
+        rows = []
         for tuple in tuples:
             k, vals = tuple
 
@@ -230,11 +442,13 @@ class SQLTableOutput(object):
                 vals = [vals]
 
             for v in vals:
-                sql = "INSERT INTO %s (partition, k, v) VALUES ('%s', '%s', '%s')" % \
-                        (self.table, key, k, str(v))
-                logger.debug(sql)
+                rows.append((key, k, str(v)))
 
-                r = c.execute(sql)
+            if len(rows) >= self.insert_size:
+                r = c.executemany(sql, rows)
                 logger.debug("inserted %s" % r)
+                rows = []
 
-
+        if rows:
+            r = c.executemany(sql, rows)
+            logger.debug("inserted %s" % r)
@@ -47,6 +47,16 @@ class Task(object):
     STOP_FLAG = False
     form = None
 
+    # when set on a root task the master keeps its workunits in memory only
+    # and records aggregate counts and times instead of a WorkUnit per
+    # workunit.  Useful for tasks generating very many small workunits.
+    ephemeral_workunits = False
+
+    # number of workunits of a batch a worker runs at once, each in its own
+    # thread.  Set on a root task whose workunits spend most of their time
+    # waiting on I/O.  Results of the batch are still sent back together.
+    batch_concurrency = 1
+
     msg = None
     description = 'Default description about Task baseclass.'
 
@@ -232,6 +242,9 @@ class Task(object):
             self.logger.debug('Task - starting subtask %s' % subtask_key)
             split = subtask_key.split('.')
             subtask = self.get_subtask(split, True)
+            # claim the subtask before its thread starts so that workunits
+            # started at the same time are given clean instances of it
+            subtask._status = STATUS_RUNNING
             subtask.logger = get_task_logger(self.get_worker().worker_key, \
                                              task_id, \
                                              subtask_key, workunit)
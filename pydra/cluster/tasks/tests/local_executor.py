@@ -0,0 +1,74 @@
+import unittest
+
+import tempfile, shutil
+
+from pydra.cluster.tasks.mapreduce import *
+from pydra.cluster.tasks.local_executor import *
+from pydra.cluster.tasks.tasks import Task
+from proxies import DirProxy
+
+
+class PairsInput(list):
+    """input whose keys are lists of (key, value) pairs"""
+
+    def load(self, key):
+        return iter(key)
+
+
+class EmitTask(Task):
+
+    def _work(self, input, output, **kwargs):
+        for k, v in input:
+            output[k] = v
+
+
+class SumTask(Task):
+
+    def _work(self, input, output, **kwargs):
+        for k, vs in input:
+            output[k] = sum(vs)
+
+
+class FailingTask(Task):
+
+    def _work(self, input, output, **kwargs):
+        raise ValueError('failing reduce')
+
+
+class LocalExecutor_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        dir = DirProxy(self.tempdir)
+
+        class LocalSum(MapReduceTask):
+            input = PairsInput([[('a', 1), ('b', 2)], [('a', 3)], [('c', 4)]])
+            output = {}
+            map = EmitTask
+            reduce = SumTask
+            intermediate = IntermediateResultsFiles(dir, grouped=True)
+            reducers = 2
+
+        self.task_class = LocalSum
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+    def test_run(self):
+        """
+        Verifies maps and reduces run in the pool and the task's output is
+        returned
+        """
+        output = LocalExecutor(2).run(self.task_class, msg='LocalSum')
+        self.assertEqual(output, {'a':4, 'b':2, 'c':4})
+
+
+    def test_failed_workunit(self):
+        """
+        Verifies a failing workunit stops the task and raises its error
+        """
+        self.task_class.reduce = FailingTask
+        executor = LocalExecutor(2)
+        self.assertRaises(LocalExecutionError, executor.run, self.task_class, \
+                          msg='LocalSum')
@@ -4,7 +4,6 @@ import tempfile, shutil
 
 from pydra.cluster.tasks.mapreduce import *
 from pydra.cluster.tasks.tasks import Task
-from pydra.task_cache.mapreduce import *
 from proxies import *
 
 
@@ -25,12 +24,36 @@ class AppendableDict_Test(unittest.TestCase):
         self.assert_(3 not in a['key'])
 
 
+class MapOutputBuffer_Test(unittest.TestCase):
+
+    def test_spill(self):
+        """
+        Verifies spilled output is merged into partitions sorted by key with
+        all values of each key
+        """
+        words = ['c', 'a', 'b', 'a', 'd', 'c', 'a', 'e', 'b', 'a']
+        buffer = MapOutputBuffer(lambda key: ord(key) % 2, size=3)
+        for word in words:
+            buffer[word] = 1
+        self.assertEqual(len(buffer._runs), 3)
+
+        partitions = []
+        for p, records in buffer.partitions():
+            partitions.append((p, list(records)))
+        buffer.close()
+
+        self.assertEqual(partitions, [
+            (0, [('b', [1, 1]), ('d', [1])]),
+            (1, [('a', [1, 1, 1, 1]), ('c', [1, 1]), ('e', [1])])
+        ])
+
+
 class IntermediateResultsFiles_Test(unittest.TestCase):
 
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
         self.task_name = "test_task"
-        self.dir = DatasourceDir(self.tempdir)
+        self.dir = DirProxy(self.tempdir)
 
     def tearDown(self):
         shutil.rmtree(self.tempdir)
@@ -74,6 +97,104 @@ class IntermediateResultsFiles_Test(unittest.TestCase):
         self.assertEqual(c['c'], 1)
 
 
+    def test_grouped(self):
+        """
+        Verifies grouped reduce input yields each key once with the values
+        from every map output
+        """
+        outputs = [{'a': [1], 'b': [2]}, {'b': [3], 'c': [4]}, {'b': [5]}]
+
+        im = IntermediateResultsFiles(self.dir, grouped=True)
+        im.task_id = self.task_name
+        for i, output in enumerate(outputs):
+            im.update_partitions(im.dump(im.partition_output(output), i))
+
+        results = []
+        for p in im:
+            for k, values in im.load(p):
+                results.append((k, list(values)))
+
+        self.assertEqual(results, [('a', [1]), ('b', [2, 3, 5]), ('c', [4])])
+
+
+    def test_compressed(self):
+        """
+        Verifies outputs written in the block format across several blocks
+        are read back whole, both grouped and per output
+        """
+        outputs = [dict([(k, [k, i]) for k in range(50)]) for i in range(2)]
+
+        for grouped in (False, True):
+            im = IntermediateResultsFiles(self.dir, grouped, compressed=True)
+            im.task_id = self.task_name
+            im.map_output.block_size = 64
+            for i, output in enumerate(outputs):
+                im.update_partitions(im.dump(im.partition_output(output), i))
+
+            results = AppendableDict()
+            for p in im:
+                for k, values in im.load(p):
+                    for v in values:
+                        results[k] = v
+
+            self.assertEqual(len(results), 50)
+            for k, values in results.iteritems():
+                self.assertEqual(sorted(values), sorted([k, k, 0, 1]))
+
+
+    def test_merge(self):
+        """
+        Verifies merged map outputs replace their inputs and load the same
+        records in a single key-sorted output
+        """
+        outputs = [{'a': [1], 'b': [2]}, {'b': [3], 'c': [4]}, {'b': [5]}]
+
+        im = IntermediateResultsFiles(self.dir, grouped=True)
+        im.task_id = self.task_name
+        for i, output in enumerate(outputs):
+            im.update_partitions(im.dump(im.partition_output(output), i))
+
+        self.assertEqual(im.skew_report(), {
+            'partitions': {0: {'records': 5, 'values': 5}},
+            'skew': 1.0
+        })
+
+        keys = im._partitions[0][:2]
+        merged = im.merge(0, keys, 'merge0')
+        im.replace_partition(0, keys, merged)
+        self.assertEqual(len(im._partitions[0]), 2)
+
+        # values are ordered by output, and the merged output is now last
+        results = []
+        for p in im:
+            for k, values in im.load(p):
+                results.append((k, sorted(values)))
+
+        self.assertEqual(results, [('a', [1]), ('b', [2, 3, 5]), ('c', [4])])
+
+
+class MapWords(Task):
+
+    def work(self, input, output, **kwargs):
+        for word in input:
+            output[word.strip()] = 1
+
+
+class ReduceWords(Task):
+
+    def work(self, input, output, **kwargs):
+        for word, v in input:
+            output[word] = sum(v)
+
+
+class CountWords(MapReduceTask):
+    input = []
+    output = {}
+    map = MapWords
+    reduce = ReduceWords
+    intermediate = IntermediateResultsFiles(DirProxy(tempfile.gettempdir()))
+
+
 class MapReduceTask_Test(unittest.TestCase):
     """
     Tests for verify functionality of MapReduceTask class
@@ -192,14 +313,113 @@ class IdentityReduceTask(Task):
             output[k] = v
 
 
+class SumTask(Task):
+
+    def _work(self, input, output, **kwargs):
+
+        for k, vs in input:
+            output[k] = sum(vs)
+
+
+class RequestProxy(WorkerProxy):
+    """
+    Worker proxy that records worker requests
+    """
+    def __init__(self):
+        self.requests = {}
+
+    def request_worker(self, subtask_key, args, workunit):
+        self.requests[workunit] = args
+
+
+class PipelinedIM(IntermediateResults):
+    """intermediate results that track merges without storing outputs"""
+
+    def merge(self, p, keys, mergeid):
+        return mergeid
+
+
+class PipelinedTask(MapReduceTask):
+
+    map = IdentityMapTask
+    reduce = IdentityReduceTask
+
+    intermediate = PipelinedIM()
+
+    pipelined = True
+    merge_factor = 2
+
+
+class PipelinedMapReduceTask_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.task = PipelinedTask('PipelinedTask')
+        self.task.input = ['in0', 'in1', 'in2']
+        self.task.output = {}
+        self.parent = RequestProxy()
+        self.task.parent = self.parent
+        self.results = []
+
+    def callback(self, results):
+        self.results.append(results)
+
+    def test_merge_before_maps_complete(self):
+        """
+        Verifies map outputs are merged while maps are running, and that the
+        reduce stage starts only after the last map and merge complete
+        """
+        task = self.task
+        requests = self.parent.requests
+        task._start({}, self.callback)
+        self.assertEqual(sorted(requests), ['map0', 'map1', 'map2'])
+
+        task._work_unit_complete({0:('out0', 1, 1)}, 'map0')
+        task._work_unit_complete({0:('out1', 1, 1)}, 'map1')
+        self.assert_('merge0' in requests)
+        self.assertEqual(requests['merge0']['partition'], ['out0', 'out1'])
+
+        task._work_unit_complete({0:('out2', 1, 1)}, 'map2')
+        self.assert_('reduce0' not in requests, 'reduce started during merge')
+
+        task._work_unit_complete('merge0', 'merge0')
+        self.assertEqual(requests['reduce0']['partition'], ['out2', 'merge0'])
+
+        task._work_unit_complete({'a':1}, 'reduce0')
+        self.assertEqual(self.results, [{'a':1}])
+        timings = task.phase_timings()
+        for phase in ('map', 'merge', 'reduce'):
+            self.assert_(phase in timings, phase)
+
+        # completing again does not repeat the callback
+        task._complete()
+        self.assertEqual(len(self.results), 1)
+
+
+    def test_complete_without_input(self):
+        """
+        Verifies a task without input completes as soon as it starts
+        """
+        self.task.input = []
+        self.task._start({}, self.callback)
+        self.assertEqual(self.parent.requests, {})
+        self.assertEqual(self.results, [{}])
+
+
 class NullIM():
     """dummy intermediate results class"""
 
+    def partition(self, key):
+        return 0
+
+
     def partition_output(self, output):
         return output
 
 
-    def dump(self, output, mapid):
+    def dump(self, pdict, mapid):
+        output = {}
+        for p, tuples in pdict:
+            output.update(tuples)
         return output, mapid
 
 
@@ -243,6 +463,33 @@ class MapReduceWrapper_Test(unittest.TestCase):
             self.assert_(v == results[k])
 
 
+    def test_work_mapwrapper_combiner(self):
+        """
+        Verifies the combiner reduces map output and that reducing combined
+        output gives the same results as reducing uncombined output
+        """
+        a = [('a', 1), ('b', 1), ('a', 1), ('c', 1), ('a', 1), ('b', 1)]
+
+        plain = MapWrapper(IdentityMapTask("IdentityMapTask"), self.im, \
+                           self.worker)
+        combined = MapWrapper(IdentityMapTask("IdentityMapTask"), self.im, \
+                              self.worker, SumTask("SumTask"))
+        reducetask = ReduceWrapper(SumTask("SumTask"), self.im, self.worker)
+
+        plain_output, mapid = plain._start(args={'input': iter(a), 'id': 'm'})
+        combined_output, mapid = combined._start( \
+                                    args={'input': iter(a), 'id': 'm'})
+
+        self.assertEqual(combined_output['a'], [3])
+        self.assert_(sum(map(len, combined_output.values())) < \
+                     sum(map(len, plain_output.values())))
+
+        expected = reducetask._start(args={'partition': plain_output})
+        results = reducetask._start(args={'partition': combined_output})
+        self.assertEqual(results, expected)
+        self.assertEqual(results, {'a':3, 'b':2, 'c':1})
+
+
     def test_get_subtask(self):
         # checking if the wrappper returns self instead of a task its wrapping
 
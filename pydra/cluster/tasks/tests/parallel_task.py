@@ -18,13 +18,15 @@
 """
 
 import unittest
-from threading import Event
+from threading import Event, Lock
 
 from twisted.trial import unittest as twisted_unittest
-from twisted.internet import threads
+from twisted.internet import defer, reactor, threads
 
 from pydra.cluster.tasks.parallel_task import ParallelTask
+from pydra.cluster.tasks.tasks import Task
 from pydra.cluster.tasks.datasource.slicer import IterSlicer
+from proxies import WorkerProxy
 
 class ParallelTaskStandaloneTest(unittest.TestCase):
     """
@@ -48,6 +50,127 @@ class ParallelTaskStandaloneTest(unittest.TestCase):
             self.assertEqual(data, i)
         self.assertEqual(s, set(self.pt._data_in_progress.keys()))
 
+    def test_request_workers_window(self):
+        """
+        Only a window of work units is requested, more are requested as
+        work units complete.
+        """
+        class RequestRecorder():
+            def __init__(self):
+                self.requests = []
+                self.releases = 0
+            def get_worker(self):
+                return self
+            def request_worker(self, subtask_key, args, workunit, locality):
+                self.requests.append(workunit)
+            def request_worker_release(self):
+                self.releases += 1
+
+        class subtask():
+            def get_key(self):
+                return 'pt.subtask'
+
+        recorder = RequestRecorder()
+        self.pt.parent = recorder
+        self.pt.subtask = subtask()
+        self.pt.window = 3
+        self.pt.request_workers()
+        self.assertEqual(recorder.requests, [1, 2, 3])
+
+        self.pt._work_unit_complete(None, 2)
+        self.assertEqual(recorder.requests, [1, 2, 3, 4])
+        self.assertEqual(len(self.pt._data_in_progress), 3)
+
+        for index in range(1, 11):
+            if index != 2:
+                self.pt._work_unit_complete(None, index)
+        self.assertEqual(len(recorder.requests), 10)
+        self.assertEqual(self.pt._data_in_progress, {})
+        self.assertEqual(recorder.releases, 1)
+        self.assertEqual(self.pt._workunit_completed, 10)
+
+class AllRunning():
+    """
+    Blocks workunits until the expected number of them are running
+    """
+    def __init__(self, count):
+        self.count = count
+        self.lock = Lock()
+        self.event = Event()
+
+    def wait(self):
+        with self.lock:
+            self.count -= 1
+            if not self.count:
+                self.event.set()
+        self.event.wait(5)
+
+
+class EchoTask(Task):
+    """
+    Returns its workunit.  The workunit is kept on the task while it waits
+    for the other workunits so that a shared instance would return the wrong
+    one.
+    """
+    def __init__(self, running):
+        Task.__init__(self)
+        self.running = running
+
+    def work(self, workunit, **kwargs):
+        self.workunit = workunit
+        self.running.wait()
+        return self.workunit
+
+
+class ConcurrentBatchTest(twisted_unittest.TestCase):
+    """
+    Tests workunits of a batch run at the same time on one worker, as the
+    worker does for tasks with batch_concurrency > 1
+    """
+
+    def setUp(self):
+        class ConcurrentEcho(ParallelTask):
+            batch_concurrency = 3
+            def __init__(self, running):
+                ParallelTask.__init__(self)
+                self.set_subtask(EchoTask, running)
+
+        self.task = ConcurrentEcho(AllRunning(ConcurrentEcho.batch_concurrency))
+        self.task.parent = WorkerProxy()
+
+
+    def test_results_keyed_to_workunit(self):
+        """
+        Verifies every workunit runs on its own subtask instance and its result
+        is returned with its own workunit key
+        """
+        workunits = range(self.task.batch_concurrency)
+        subtask_key = self.task.subtask.get_key()
+        results = []
+        lock = Lock()
+        complete = defer.Deferred()
+
+        def callback(result, workunit=None, failed=False):
+            with lock:
+                results.append((workunit, result, failed))
+                done = len(results) == len(workunits)
+            if done:
+                reactor.callFromThread(complete.callback, results)
+
+        for workunit in workunits:
+            self.task.start({'workunit':workunit}, subtask_key, workunit, 1, \
+                            callback=callback, \
+                            callback_args={'workunit':workunit}, \
+                            errback=callback, \
+                            errback_args={'workunit':workunit, 'failed':True})
+
+        def check(results):
+            self.assertEqual(sorted(results), \
+                [(workunit, workunit, False) for workunit in workunits])
+        complete.addCallback(check)
+        return complete
+
+
 class ParallelTask_Test(unittest.TestCase):
     """
     Tests for verify functionality of ParllelTask class
@@ -0,0 +1,98 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from pydra.cluster.tasks.partitioner import HashPartitioner, RangePartitioner
+
+
+class HashPartitioner_Test(unittest.TestCase):
+
+    def test_stable(self):
+        """
+        Verifies keys are partitioned by crc32, and that equal str and unicode
+        keys share a partition
+        """
+        partitioner = HashPartitioner()
+        self.assertEqual(partitioner.partition('pydra', 7), 1101386114 % 7)
+        self.assertEqual(partitioner.partition(u'pydra', 7), \
+                         partitioner.partition('pydra', 7))
+        self.assertEqual(partitioner.partition(42, 7), \
+                         partitioner.partition('42', 7))
+        for key in range(100):
+            self.assert_(0 <= partitioner.partition(key, 3) < 3)
+
+
+    def test_equal_keys(self):
+        """
+        Verifies equal numeric and tuple keys share a partition
+        """
+        partitioner = HashPartitioner()
+        self.assertEqual(partitioner.partition(1, 7), \
+                         partitioner.partition(1L, 7))
+        self.assertEqual(partitioner.partition(2**70, 7), \
+                         partitioner.partition(long(2**70), 7))
+        self.assertEqual(partitioner.partition(True, 7), \
+                         partitioner.partition(1, 7))
+        self.assertEqual(partitioner.partition(3.0, 7), \
+                         partitioner.partition(3, 7))
+        self.assertEqual(partitioner.partition((1, u'a'), 7), \
+                         partitioner.partition((1L, 'a'), 7))
+
+    def test_unsupported(self):
+        """
+        Verifies keys without a canonical form are rejected
+        """
+        partitioner = HashPartitioner()
+        self.assertRaises(TypeError, partitioner.partition, {'a':1}, 7)
+        self.assertRaises(TypeError, partitioner.partition, set([1, 2]), 7)
+        self.assertRaises(TypeError, partitioner.partition, (1, [2]), 7)
+
+
+class RangePartitioner_Test(unittest.TestCase):
+
+    def test_sample(self):
+        """
+        Verifies sampled boundaries balance partitions and keep them in key
+        order
+        """
+        partitioner = RangePartitioner(sample_size=100)
+        self.assert_(partitioner.needs_sample())
+        keys = range(1000)
+        partitioner.sample(keys, 4)
+        self.assertFalse(partitioner.needs_sample())
+        self.assertEqual(len(partitioner.boundaries), 3)
+
+        partitions = [partitioner.partition(key, 4) for key in keys]
+        self.assertEqual(partitions, sorted(partitions))
+        for p in range(4):
+            self.assert_(100 < partitions.count(p) < 400)
+
+
+    def test_state(self):
+        """
+        Verifies boundaries are passed to map tasks with their key types
+        """
+        partitioner = RangePartitioner([('b', 1), ('d', u'e')])
+        copy = RangePartitioner()
+        copy.load_state(unicode(partitioner.state()))
+        self.assertEqual(copy.boundaries, [('b', 1), ('d', u'e')])
+        self.assertEqual(copy.partition(('a', 2), 3), 0)
+        self.assertEqual(copy.partition(('c', 0), 3), 1)
+        self.assertEqual(copy.partition(('e', 0), 3), 2)
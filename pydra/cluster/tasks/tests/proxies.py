@@ -17,6 +17,7 @@
     along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 from threading import Event
 from twisted.internet import reactor
 from pydra.cluster.tasks.tasks import Task
@@ -35,6 +36,22 @@ class WorkerProxy():
         return None
 
 
+class DirProxy():
+    """
+    Directory of intermediate result files.  Keys are names of files within
+    the directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, key):
+        return self._load(key)
+
+    def _load(self, key, mode='r'):
+        return open(os.path.join(self.path, key[0]), mode + 'b')
+
+
 class StartupAndWaitTask(Task):
     """
     Task that runs indefinitely.  Used for tests that
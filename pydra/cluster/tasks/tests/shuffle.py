@@ -0,0 +1,146 @@
+import unittest
+
+import os, tempfile, shutil
+import cPickle as pickle
+
+from pydra.cluster.tasks.shuffle import *
+from pydra.cluster.tasks.slicer import FileBlockOutput, read_blocks
+
+
+class ChunkWorker():
+    """
+    Worker that serves shuffle chunks from a directory, in small chunks, as
+    its node would.
+    """
+    def __init__(self, worker_key, dir, size=7):
+        self.worker_key = worker_key
+        self.dir = dir
+        self.size = size
+        self.fetches = 0
+
+    def get_worker(self):
+        return self
+
+    def fetch_shuffle_chunk(self, source, filename, offset):
+        self.fetches += 1
+        return serve_chunk(filename, offset, self.dir, self.size)
+
+
+class Shuffle_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.records = [('key%d' % i, [i] * i) for i in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, worker):
+        dir = ShuffleDir(self.tempdir, worker.get_worker)
+        with dir._load(('output', ), 'w') as f:
+            for record in self.records:
+                pickle.dump(record, f)
+        return dir, dir.key('output')
+
+
+    def test_read_chunk(self):
+        """
+        Verifies chunks are bounded and files outside the directory are not
+        served
+        """
+        worker = ChunkWorker('host:1:0', self.tempdir)
+        dir, key = self.write(worker)
+        offset, data, length = read_chunk('output', 0, self.tempdir, 7)
+        self.assertEqual(len(data), 7)
+        offset, data, length = read_chunk('output', -3, self.tempdir, 7)
+        self.assertEqual(offset, length - 3)
+        self.assertEqual(len(data), 3)
+        self.assertRaises(IOError, read_chunk, '../output', 0, self.tempdir)
+
+
+    def test_remote_stream(self):
+        """
+        Verifies files written on another node are streamed in chunks
+        """
+        dir, key = self.write(ChunkWorker('host:1:0', self.tempdir))
+        self.assertEqual(key, 'host:1:0/output')
+
+        reader = ChunkWorker('host:2:0', self.tempdir)
+        dir.get_worker = reader.get_worker
+        records = []
+        with dir.load((key, )) as f:
+            self.assert_(isinstance(f, ShuffleStream))
+            try:
+                while True:
+                    records.append(pickle.load(f))
+            except EOFError:
+                pass
+        self.assertEqual(records, self.records)
+        self.assert_(reader.fetches > 1)
+
+
+    def test_remote_block_file(self):
+        """
+        Verifies block files, which are read by seeking, can be streamed
+        """
+        writer = ChunkWorker('host:1:0', self.tempdir)
+        dir = ShuffleDir(self.tempdir, writer.get_worker)
+        FileBlockOutput(dir, block_size=16).dump('output', self.records)
+        key = dir.key('output')
+
+        dir.get_worker = ChunkWorker('host:2:0', self.tempdir).get_worker
+        with dir.load((key, )) as f:
+            self.assertEqual(list(read_blocks(f)), self.records)
+
+
+    def test_local_short_circuit(self):
+        """
+        Verifies files written on the same node are read directly
+        """
+        dir, key = self.write(ChunkWorker('host:1:0', self.tempdir))
+        reader = ChunkWorker('host:1:1', self.tempdir)
+        dir.get_worker = reader.get_worker
+        f = dir.load((key, ))
+        try:
+            self.assert_(isinstance(f, file))
+        finally:
+            f.close()
+        self.assertEqual(reader.fetches, 0)
+
+
+    def test_small_result(self):
+        """
+        Verifies results smaller than the threshold are sent directly
+        """
+        worker = ChunkWorker('host:1:0', self.tempdir)
+        result = store_result(worker, self.records, 1000000, self.tempdir)
+        self.assertEqual(result, self.records)
+        self.assertEqual(store_result(worker, self.records, 0), self.records)
+
+
+    def test_large_result(self):
+        """
+        Verifies large results are sent as handles, streamed to workers on
+        other nodes and deleted once read
+        """
+        worker = ChunkWorker('host:1:0', self.tempdir)
+        handle = store_result(worker, self.records, 10, self.tempdir)
+        self.assert_(is_result_handle(handle))
+
+        reader = ChunkWorker('host:2:0', self.tempdir)
+        self.assertEqual(load_result(reader, handle, self.tempdir), self.records)
+        self.assert_(reader.fetches > 1)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+
+    def test_large_result_same_node(self):
+        """
+        Verifies large results stored on the same node are read from the file
+        """
+        worker = ChunkWorker('host:1:0', self.tempdir)
+        handle = store_result(worker, self.records, 10, self.tempdir)
+
+        reader = ChunkWorker('host:1:1', self.tempdir)
+        self.assertEqual(load_result(reader, handle, self.tempdir), self.records)
+        self.assertEqual(reader.fetches, 0)
+        self.assertEqual(os.listdir(self.tempdir), [])
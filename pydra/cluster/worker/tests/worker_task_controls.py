@@ -0,0 +1,175 @@
+"""
+    Copyright 2009 Oregon State University
+
+    This file is part of Pydra.
+
+    Pydra is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Pydra is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from threading import Lock, currentThread
+
+from twisted.trial import unittest as twisted_unittest
+from twisted.internet.defer import Deferred
+
+from pydra.cluster.tasks.shuffle import RESULT_HANDLE
+from pydra.cluster.worker import worker_task_controls
+from pydra.cluster.worker.worker_task_controls import WorkerTaskControls
+
+
+class ManagerProxy():
+    """
+    Holds shared properties of a module
+    """
+    def __init__(self):
+        self.shared = {}
+
+    def get_shared(self, key):
+        return self.shared.get(key, None)
+
+    def set_shared(self, key, value):
+        self.shared[key] = value
+
+
+class MasterProxy():
+    """
+    Records remote calls.  Each call returns a deferred the test fires.
+    """
+    def __init__(self):
+        self.calls = []
+        self.deferreds = []
+
+    def callRemote(self, *args):
+        self.calls.append(args)
+        deferred = Deferred()
+        self.deferreds.append(deferred)
+        return deferred
+
+
+class TaskProxy():
+    STOP_FLAG = False
+
+    def __init__(self):
+        self.parent = self
+        self.completed = []
+        self.deferred = Deferred()
+
+    def get_subtask(self, task_path):
+        return self
+
+    def _work_unit_complete(self, result, key):
+        self.completed.append((key, result, currentThread().getName()))
+        self.deferred.callback(None)
+
+
+class PartialResults_Test(unittest.TestCase):
+    """
+    Tests sending the results of a batch while it runs
+    """
+
+    def setUp(self):
+        self.flush_size = worker_task_controls.BATCH_FLUSH_SIZE
+        worker_task_controls.BATCH_FLUSH_SIZE = 1
+
+        self.master = MasterProxy()
+        self.controls = WorkerTaskControls()
+        self.controls.manager = ManagerProxy()
+        self.controls.master = self.master
+        self.controls._lock_connection = Lock()
+
+        # a batch with its last two workunits running
+        self.controls._WorkerTaskControls__task_instance = TaskProxy()
+        self.controls._WorkerTaskControls__batch = iter([])
+        self.controls._WorkerTaskControls__batch_running = 2
+        self.controls._WorkerTaskControls__results = []
+        self.controls._WorkerTaskControls__last_flush = 0
+
+
+    def tearDown(self):
+        worker_task_controls.BATCH_FLUSH_SIZE = self.flush_size
+
+
+    def finish_batch(self):
+        """
+        Finishes both workunits, the first is sent as a partial result that
+        has not yet been received when the second finishes
+        """
+        self.controls.run_next(('a', 1, False))
+        self.assertEqual(self.master.calls, \
+                    [('send_partial_results', [('a', 1, False)])])
+
+        self.controls.run_next(('b', 2, False))
+        self.assertEqual(len(self.master.calls), 1)
+
+
+    def test_complete_after_partial_received(self):
+        """
+        Verifies the batch completes once its partial results are received
+        """
+        self.finish_batch()
+        self.master.deferreds[0].callback(None)
+        self.assertEqual(self.master.calls[1], \
+                    ('send_results', [('b', 2, False)]))
+
+
+    def test_complete_after_partial_failed(self):
+        """
+        Verifies partial results that fail to send while the batch finishes
+        are sent with the results of the batch
+        """
+        self.finish_batch()
+        self.master.deferreds[0].errback(Exception('connection lost'))
+        self.assertEqual(self.master.calls[1], \
+                    ('send_results', [('a', 1, False), ('b', 2, False)]))
+
+
+class ReceiveResults_Test(twisted_unittest.TestCase):
+    """
+    Tests receiving results sent as handles to stored results
+    """
+
+    def setUp(self):
+        self.load_result = worker_task_controls.load_result
+        self.loaded = []
+        def load_result(worker, result):
+            self.loaded.append(currentThread().getName())
+            return result['value']
+        worker_task_controls.load_result = load_result
+
+        self.task = TaskProxy()
+        self.controls = WorkerTaskControls()
+        self.controls._WorkerTaskControls__task_instance = self.task
+
+
+    def tearDown(self):
+        worker_task_controls.load_result = self.load_result
+
+
+    def test_receive_handle(self):
+        """
+        Verifies handles are loaded in a thread, and the results are passed to
+        the task on the reactor thread
+        """
+        reactor_thread = currentThread().getName()
+        handle = {RESULT_HANDLE:'key', 'value':1}
+        self.controls.receive_results('worker', [('a', handle, False)], \
+                                      'task.subtask')
+        self.assertEqual(self.task.completed, [])
+
+        def check(result):
+            self.assertEqual(len(self.loaded), 1)
+            self.assertNotEqual(self.loaded[0], reactor_thread)
+            self.assertEqual(self.task.completed, \
+                             [('a', 1, reactor_thread)])
+        return self.task.deferred.addCallback(check)
@@ -17,15 +17,20 @@
     along with Pydra.  If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import with_statement
+from collections import deque
 from threading import Lock
+import time
 
 import simplejson
 from twisted.internet import reactor, threads
 from twisted.internet.defer import Deferred, DeferredList
 
+import pydra_settings
 from pydra.cluster.constants import *
 from pydra.cluster.module import Module
 from pydra.cluster.tasks import ParallelTask, MapReduceTask
+from pydra.cluster.tasks.shuffle import store_result, load_result, \
+    is_result_handle
 from pydra.cluster.tasks.task_manager import TaskManager
 from pydra.logs import get_task_logger
 
@@ -33,6 +38,9 @@ from pydra.logs import get_task_logger
 import logging
 logger = logging.getLogger('root')
 
+BATCH_FLUSH_SIZE = getattr(pydra_settings, 'BATCH_FLUSH_SIZE', 0)
+BATCH_FLUSH_INTERVAL = getattr(pydra_settings, 'BATCH_FLUSH_INTERVAL', 0)
+
 
 def BatchIterator(batch, key, version, task_class, module_search_path, args,
                   main_worker, task_id, callback):
@@ -69,7 +77,8 @@ class WorkerTaskControls(Module):
             ('MASTER', self.receive_results),
             ('MASTER', self.release_worker),
             ('MASTER', self.return_work),
-            ('MASTER', self.subtask_started)
+            ('MASTER', self.subtask_started),
+            ('MASTER', self.preload_tasks)
         ]
 
         self._friends = {
@@ -85,6 +94,12 @@ class WorkerTaskControls(Module):
         self.__workunit = None
         self.__results = None
         self.__batch = None
+        self.__batch_running = 0    # workunits of the batch running
+        self.__last_flush = None    # time partial batch results were sent
+        self.__partials_sending = 0 # partial batch results not yet received
+        self.__batch_finished = False # batch waiting on partial results
+        self.__working = False      # running a task, subtask, or batch
+        self.__prefetched = deque() # work queued to run after current work
 
         # shutdown tracking
         self.__pending_releases = 0
@@ -118,34 +133,199 @@ class WorkerTaskControls(Module):
                     deferred.addCallback(self.send_successful)
                     deferred.addErrback(self.send_results_failed, self.__results)
 
+            self.run_prefetched()
+
 
     def run_batch(self, key, version, task_class, module_search_path, args,
                   workunits, main_worker=None, task_id=None):
         """
         Creates the batch iterator which will yield arguments for each
-        run_task call, and then starts the batch cycle
+        run_task call, and then starts the batch cycle.  Up to the task's
+        batch_concurrency workunits are run at once.
         """
-        self.__results = []
-        self.__batch = BatchIterator(workunits, key, version, task_class, \
+        concurrency = max(1, getattr(task_class, 'batch_concurrency', 1))
+        if reactor.getThreadPool().max < concurrency:
+            reactor.suggestThreadPoolSize(concurrency)
+
+        with self._lock:
+            self.__results = []
+            self.__batch = BatchIterator(workunits, key, version, task_class, \
                                 module_search_path, args, main_worker, \
                                 task_id, self.batched_work_complete)
-        self.run_next()
+            self.__batch_running = 0
+            self.__last_flush = time.time()
+            self.__partials_sending = 0
+            self.__batch_finished = False
+
+        for i in xrange(concurrency):
+            self.run_next()
 
-    def run_next(self):
+    def run_next(self, result=None):
         """
         Runs the next subtask in self.__batch which is an iterator that
         flattens the subtask/workunit structure into a list of subtask/workunit
-        combinations.  If there are no more workunits in the iterator then
-        batch_complete is called to finish this task
+        combinations.  If there are no more workunits in the iterator and none
+        are still running then batch_complete is called to finish this task.
+
+        Results of finished workunits are sent to the master as partial
+        results once BATCH_FLUSH_SIZE results are waiting or
+        BATCH_FLUSH_INTERVAL seconds have passed since the last were sent.
+        The results of the last workunit are always sent by batch_complete,
+        which waits until all partial results were received by the master.
+
+        @param result - (workunit, results, failed) of a workunit of the batch
+                        that has just finished
         """
-        try:
-            self._run_task(*self.__batch.next())
-        except StopIteration:
+        with self._lock:
+            if result:
+                self.__batch_running -= 1
+                self.__results.append(result)
+            try:
+                work = self.__batch.next()
+                self.__batch_running += 1
+                complete = False
+            except StopIteration:
+                work = None
+                complete = bool(result) and not self.__batch_running
+
+            partial = None
+            if not complete and self._flush_due():
+                partial = self.__results
+                self.__results = []
+                self.__last_flush = time.time()
+                self.__partials_sending += 1
+
+            if complete and self.__partials_sending:
+                # partial results that fail to send are returned to
+                # self.__results, complete once they are all settled
+                self.__batch_finished = True
+                complete = False
+
+        if partial:
+            self.send_partial_results(partial)
+        if work:
+            # workunits may finish in any thread, tasks are started from the
+            # reactor thread
+            reactor.callFromThread(self._run_task, *work)
+        elif complete:
+            self.batch_complete()
+
+
+    def _flush_due(self):
+        """
+        Returns True if waiting batch results should be sent to the master.
+        Must be called while holding the lock.
+        """
+        waiting = len(self.__results)
+        if not waiting:
+            return False
+        if BATCH_FLUSH_SIZE and waiting >= BATCH_FLUSH_SIZE:
+            return True
+        return bool(BATCH_FLUSH_INTERVAL) and \
+                time.time() - self.__last_flush >= BATCH_FLUSH_INTERVAL
+
+
+    def send_partial_results(self, results):
+        """
+        Sends the results of some of the workunits of a batch to the master
+        while the rest of the batch runs.
+
+        @param results - list of (workunit, results, failed)
+        """
+        with self._lock_connection:
+            if self.master:
+                deferred = self.master.callRemote("send_partial_results", \
+                                                  results)
+                deferred.addCallbacks(self.send_partial_results_successful, \
+                                      self.send_partial_results_failed, \
+                                      errbackArgs=(results,))
+                return
+
+        # master disappeared, send the results with the rest of the batch
+        self._partial_results_settled(results)
+
+
+    def send_partial_results_successful(self, result):
+        """
+        Callback called when the master received partial results.
+        """
+        self._partial_results_settled()
+
+
+    def send_partial_results_failed(self, failure, results):
+        """
+        Errback called when sending partial results fails.  The results are
+        sent again with the rest of the batch.
+        """
+        logger.error('partial results failed to send: %s' % failure)
+        self._partial_results_settled(results)
+
+
+    def _partial_results_settled(self, results=None):
+        """
+        Called once partial results were received by the master or failed to
+        send.  Results that were not received are returned to the results of
+        the batch.  If the batch finished while partial results were being
+        sent it is completed once the last of them settles.
+
+        @param results - results that were not received, if any
+        """
+        with self._lock:
+            self.__partials_sending -= 1
+            if results:
+                self.__results[:0] = results
+            complete = self.__batch_finished and not self.__partials_sending
+            if complete:
+                self.__batch_finished = False
+
+        if complete:
             self.batch_complete()
 
     def run_task(self, key, version, args={}, workunits=None, \
+                    main_worker=None, task_id=None, prefetch=False):
+        """
+        Runs a task, subtask, or batch of workunits.
+
+        @param prefetch - the master is queueing this work while the worker is
+                          still busy with other work.  If the worker is busy
+                          the work will be started as soon as the current work
+                          completes.
+        """
+        with self._lock:
+            if prefetch and self.__working:
+                logger.info('Queueing prefetched work: key=%s  w=%s' % \
+                            (key, workunits))
+                self.__prefetched.append((key, version, args, workunits, \
+                                          main_worker, task_id))
+                return
+            self.__working = True
+
+        self._start_work(key, version, args, workunits, main_worker, task_id)
+
+
+    def run_prefetched(self):
+        """
+        Starts the next work queued by the master while this worker was busy.
+        Called after the results of the current work have been sent.
+        """
+        with self._lock:
+            if not self.__prefetched or self.__task_instance.STOP_FLAG:
+                self.__prefetched.clear()
+                self.__working = False
+                return
+            work = self.__prefetched.popleft()
+
+        logger.debug('Starting prefetched work: key=%s  w=%s' % \
+                     (work[0], work[3]))
+        self._start_work(*work)
+
+
+    def _start_work(self, key, version, args={}, workunits=None, \
                     main_worker=None, task_id=None):
-        
+        """
+        Retrieves the task and starts the work, either as a batch or as a
+        single task or workunit.
+        """
         if workunits and (len(workunits.values()[0]) > 1 or len(workunits) > 1):
             # batch exists if there is more than one workunit for the first
             # subtask OR if there is more than one workunit type.  no need to
@@ -225,6 +405,8 @@ class WorkerTaskControls(Module):
         Stops the current task.
         """
         logger.info('Received STOP command')
+        with self._lock:
+            self.__prefetched.clear()
         if self.__task_instance:
             self.__task_instance._stop()
             
@@ -252,7 +434,8 @@ class WorkerTaskControls(Module):
         finished.  This callback handles both successful tasks and failures
         caused by exceptions in the users task.
         
-        Results are recorded in the datastructure and sent back as a group.
+        Results are recorded in the datastructure and sent back in groups as
+        the batch progresses.
         
         @param results - results from task, or a twisted failure object
         @param local - is this workunit being processed locally by the main
@@ -264,15 +447,14 @@ class WorkerTaskControls(Module):
             # then ignore any results and stop the task
             return
         
-        # create traceback if its an error
+        # create traceback if its an error, large results are sent as handles
         if failed:
             results = results.__str__()
+        else:
+            results = store_result(self, results)
 
-        # store results
-        with self._lock:
-            self.__results.append((workunit, results, failed))
-
-        self.run_next()
+        # store results, they are sent as the batch progresses
+        self.run_next((workunit, results, failed))
     
     def work_complete(self, results, workunit=None, failed=False):
         """
@@ -286,9 +468,12 @@ class WorkerTaskControls(Module):
         @param failed - was there an exception thrown in the task
         """
         
-        # create traceback if its an error
+        # create traceback if its an error.  large results of workunits are
+        # sent as handles
         if failed:
             results = results.__str__()
+        elif workunit is not None:
+            results = store_result(self, results)
 
         if self.__task_instance.STOP_FLAG:
             # If stop flag is set for either the main task or local task
@@ -316,6 +501,8 @@ class WorkerTaskControls(Module):
                 else:
                     self.__results = results
 
+            self.run_prefetched()
+
 
     def send_results_failed(self, results):
         """
@@ -381,14 +568,46 @@ class WorkerTaskControls(Module):
         """
         Function called to make the subtask receive the results processed by
         another worker.  This call is ignored if STOP flag is already set.
+
+        Large results arrive as handles.  They are loaded in a thread because
+        loading may block while they are fetched from the worker's node.  The
+        results are then passed to the task on the reactor thread.
         """
         if not self.__task_instance.STOP_FLAG:
             logger.info('received REMOTE results for: %s' % subtask_key)
-            subtask = self.__task_instance.get_subtask(subtask_key.split('.'))
-            for key, result, failed in results:
-                if failed:
-                    continue
-                subtask.parent._work_unit_complete(result, key)
+            if [r for key, r, failed in results if is_result_handle(r)]:
+                deferred = threads.deferToThread(self._load_results, results)
+                deferred.addCallbacks(self._receive_results, \
+                                      self._load_results_failed, \
+                                      callbackArgs=(subtask_key,), \
+                                      errbackArgs=(subtask_key,))
+            else:
+                self._receive_results(results, subtask_key)
+
+
+    def _load_results(self, results):
+        """
+        Loads results that were sent as handles.  This blocks, it must not be
+        called from the reactor thread.
+
+        @param results - list of (workunit_key, result, failed)
+        @returns results with each handle replaced by its result
+        """
+        return [(key, result if failed else load_result(self, result), failed)
+                for key, result, failed in results]
+
+
+    def _load_results_failed(self, failure, subtask_key):
+        logger.error('Failed to load results for %s: %s' % (subtask_key, \
+                     failure.getErrorMessage()))
+
+
+    def _receive_results(self, results, subtask_key):
+        subtask = self.__task_instance.get_subtask(subtask_key.split('.'))
+        for key, result, failed in results:
+            if failed:
+                continue
+            subtask.parent._work_unit_complete(result, key)
 
 
     def release_worker(self):
@@ -410,12 +629,45 @@ class WorkerTaskControls(Module):
         reactor.stop()
 
 
-    def request_worker(self, subtask_key, args, workunit_key):
+    def request_worker(self, subtask_key, args, workunit_key, locality=None):
         """
         Requests a work unit be handled by another worker in the cluster
+
+        @param locality - optional list of nodes or hosts holding the work
+                          unit's data
         """
         logger.info('requesting worker for: %s' % subtask_key)
-        deferred = self.master.callRemote('request_worker', subtask_key, args, workunit_key)
+        if locality:
+            deferred = self.master.callRemote('request_worker', subtask_key, \
+                                        args, workunit_key, list(locality))
+        else:
+            deferred = self.master.callRemote('request_worker', subtask_key, \
+                                        args, workunit_key)
+
+
+    def worker_count(self):
+        """
+        Returns the number of workers in the cluster.  This blocks until the
+        master responds so it must not be called from the reactor thread.
+        """
+        return threads.blockingCallFromThread(reactor, self.master.callRemote,
+                                              'worker_count')
+
+
+    def fetch_shuffle_chunk(self, source, filename, offset):
+        """
+        Fetches a chunk of a shuffle file written by another worker.  This
+        blocks until the node responds so it must not be called from the
+        reactor thread.
+
+        @param source - key of the worker that wrote the file
+        @param filename - name of the file
+        @param offset - offset of the chunk
+        @returns (offset, data, size of the file)
+        """
+        return threads.blockingCallFromThread(reactor, self.master.callRemote,
+                                    'fetch_shuffle_chunk', source, filename,
+                                    offset)
 
 
     def request_worker_release(self):
@@ -462,6 +714,24 @@ class WorkerTaskControls(Module):
     def retrieve_task_failed(self, task_key, version, err):
         pass
 
+
+    def preload_tasks(self, tasks):
+        """
+        Loads task packages before any work for them arrives.  Called by the
+        Node on idle pooled workers so that the work does not wait for the
+        package to be imported.
+
+        @param tasks - list of (task key, version)
+        """
+        for key, version in tasks:
+            logger.debug('Preloading task: %s' % key)
+            self.task_manager.retrieve_task(key, version, self.task_preloaded,
+                                            self.retrieve_task_failed)
+
+
+    def task_preloaded(self, key, version, task_class, module_search_path):
+        logger.debug('Preloaded task: %s' % key)
+
     def subtask_started(self, batch):
         """
         Called to inform the task that a queued subtask was started on a remote
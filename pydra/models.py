@@ -18,6 +18,7 @@
 """
 from __future__ import with_statement
 
+from collections import deque
 from threading import Lock
 import time
 
@@ -167,10 +168,13 @@ class TaskInstance(AbstractJob):
     run and whether it completed.
 
     queued:        Datetime when this task instance was queued
+    workunit_summary_json: counts and times of workunits by subtask.  Only
+                   recorded for tasks with ephemeral workunits.
     """
     queued  = models.DateTimeField(auto_now_add=True)
     results_json = models.TextField(null=True)
     results = None
+    workunit_summary_json = models.TextField(null=True)
     objects = TaskInstanceManager()
     workunit = None #not used, included for compatibility with WorkUnit
     version = models.CharField(max_length=255)
@@ -183,18 +187,28 @@ class TaskInstance(AbstractJob):
         self.running_workers  = [] # running workers keys (excluding the main worker)
         self.waiting_workers  = [] # workers waiting for more workunits
         self.last_succ_time   = None # when this task last time gets a worker
-        self._worker_requests = [] # List of WorkUnit objects
+        self._worker_requests = deque() # WorkRequests and requeued WorkUnits
         self.local_workunit   = None # a workunit executed by main worker
+        self.workunit_times   = {} # moving average of workunit time by subtask
+        self.locality_wait    = None # when this task began waiting for a local worker
+        self.user             = None # user that queued the task, for fair-share
+        self.ephemeral        = None # workunits not saved individually, None if unknown
     
         # others
         self._request_lock = Lock()
         
         if self.results_json:
             self.results = simplejson.loads(self.results_json)
+        if self.workunit_summary_json:
+            self.workunit_summary = simplejson.loads(self.workunit_summary_json)
+        else:
+            self.workunit_summary = {}
 
     def save(self, *args, **kwargs):
         if self.results:
             self.results_json = simplejson.dumps(self.results)
+        if self.workunit_summary:
+            self.workunit_summary_json = simplejson.dumps(self.workunit_summary)
         super(TaskInstance, self).save(*args, **kwargs)
 
     def __getattribute__(self, key):
@@ -219,8 +233,8 @@ class TaskInstance(AbstractJob):
         job = self.poll_worker_request()
         # if this is the TaskInstance, or only a single workunit, just
         # return it.  It will be faster to deal with just that object
-        if job == self or len(self._worker_requests)==1:
-            return self.pop_worker_request()
+        if job is self or len(self._worker_requests)==1:
+            return self._materialize(self.pop_worker_request())
         
         count = 0
         workunits = []
@@ -230,7 +244,7 @@ class TaskInstance(AbstractJob):
             # break and return the current batch.
             if job.size > (size-count)+(size/4) and count:
                 break
-            workunits.append(job)
+            workunits.append(self._materialize(job))
             count += job.size
             self.pop_worker_request()
             job = self.poll_worker_request()
@@ -241,10 +255,43 @@ class TaskInstance(AbstractJob):
 
         batch.subtask_key = workunits[0].subtask_key
         return batch
+
+    def _materialize(self, request):
+        """
+        Converts a WorkRequest into the WorkUnit that will be dispatched.
+        TaskInstances and requeued WorkUnits are returned unchanged.
+        """
+        if isinstance(request, (WorkRequest,)):
+            return request.materialize(self)
+        return request
     
     def transmitable(self):
         return None
 
+    def record_workunit(self, subtask_key, outcome, seconds):
+        """
+        Adds a finished workunit to the workunit summary.  This replaces the
+        WorkUnit history for tasks with ephemeral workunits.
+
+        @param subtask_key - subtask the workunit belongs to
+        @param outcome - 'completed', 'failed', or 'cancelled'
+        @param seconds - time the workunit took.  Only the times of completed
+                         workunits are summarized.
+        """
+        try:
+            summary = self.workunit_summary[subtask_key]
+        except KeyError:
+            summary = self.workunit_summary[subtask_key] = {'completed':0,
+                        'failed':0, 'cancelled':0, 'sum_time':0, 'sum_sq':0,
+                        'min':-1, 'max':-1}
+        summary[outcome] += 1
+        if outcome == 'completed':
+            summary['sum_time'] += seconds
+            summary['sum_sq'] += seconds * seconds
+            summary['max'] = max(seconds, summary['max'])
+            summary['min'] = seconds if summary['min'] == -1 \
+                                     else min(seconds, summary['min'])
+
     def compute_score(self):
         """
         Computes a priority score for this task, which will be used by the
@@ -278,25 +325,26 @@ class TaskInstance(AbstractJob):
                                                     if self.started else None,
             'completed':self.completed.strftime('%Y-%m-%d %H:%m:%S') \
                                                     if self.completed else None,
-            'results':self.results
+            'results':self.results,
+            'workunit_summary':self.workunit_summary
         }
 
     def queue_worker_request(self, request):
         """
-        A worker request is a tuple of:
-        (requesting_worker_key, args, subtask_key, workunit_key).
+        A worker request is a WorkRequest, a WorkUnit that is being requeued,
+        or the TaskInstance itself for the root task.
         """
         with self._request_lock:
             self._worker_requests.append(request)
 
     def pop_worker_request(self):
         """
-        A worker request is a tuple of:
-        (requesting_worker_key, args, subtask_key, workunit_key).
+        Removes and returns the first worker request in the queue.  See
+        queue_worker_request() for the types of requests.
         """
         with self._request_lock:
             try:
-                return self._worker_requests.pop(0)
+                return self._worker_requests.popleft()
             except IndexError:
                 return None
 
@@ -335,6 +383,10 @@ class WorkUnit(AbstractJob):
     workunit      = models.CharField(max_length=255)
     size          = models.IntegerField(default=1)
 
+    # nodes or hosts holding this workunit's data.  Only used for scheduling,
+    # it is not persisted.
+    locality      = None
+
     def __getattribute__(self, key):
         if key == 'task_id':
             return self.task_instance.id
@@ -360,6 +412,75 @@ class WorkUnit(AbstractJob):
         return {self.subtask_key:[self.workunit]}
 
 
+class WorkRequest(object):
+    """
+    Compact record of a workunit waiting for a worker.  Tasks may queue a
+    very large number of workunits, so pending workunits are kept as
+    WorkRequests and only converted to WorkUnits when they are dispatched.
+    """
+    __slots__ = ('subtask_key', 'workunit', 'args', 'size', 'locality')
+
+    def __init__(self, subtask_key, workunit, args, size=1, locality=None):
+        self.subtask_key = subtask_key
+        self.workunit = workunit
+        self.args = args
+        self.size = size
+        self.locality = locality
+
+    def materialize(self, task_instance):
+        """
+        Returns the WorkUnit for this request.  The WorkUnit is not saved.
+        """
+        if task_instance.ephemeral:
+            return EphemeralWorkUnit(task_instance, self.subtask_key, \
+                                     self.args, self.workunit, self.locality)
+        workunit = WorkUnit()
+        workunit.task_instance = task_instance
+        workunit.subtask_key = self.subtask_key
+        workunit.args = self.args
+        workunit.workunit = self.workunit
+        workunit.size = self.size
+        workunit.locality = self.locality
+        return workunit
+
+
+class EphemeralWorkUnit(object):
+    """
+    In-memory stand-in for a WorkUnit, used for tasks with ephemeral
+    workunits.  It provides the attributes of a WorkUnit the scheduler uses
+    but is never saved.  Only aggregate counts and times are recorded, in the
+    TaskInstance's workunit summary.
+    """
+    __slots__ = ('task_instance', 'subtask_key', 'args', 'workunit', 'worker',
+                 'status', 'started', 'completed', 'size', 'locality')
+    id = None
+
+    def __init__(self, task_instance, subtask_key, args, workunit, \
+                 locality=None):
+        self.task_instance = task_instance
+        self.subtask_key = subtask_key
+        self.args = args
+        self.workunit = workunit
+        self.locality = locality
+        self.worker = None
+        self.status = None
+        self.started = None
+        self.completed = None
+        self.size = 1
+
+    task_id = property(lambda self: self.task_instance.id)
+    task_key = property(lambda self: self.task_instance.task_key)
+    on_main_worker = property(lambda self: \
+                                self.task_instance.worker == self.worker)
+
+    def __repr__(self):
+        return 'root=%s task=%s subtask=%s' % (self.task_id, self.task_key, \
+                                               self.subtask_key)
+
+    def transmitable(self):
+        return {self.subtask_key:[self.workunit]}
+
+
 class Batch(AbstractJob):
     """
     Batch contains a set of WorkUnits.  Batches are a proxy to most properties
@@ -405,7 +526,7 @@ class Batch(AbstractJob):
         super(Batch, self).__setattr__(key, value)
         if key in ('worker', 'started', 'completed'):
             for workunit in self.workunits.values():
-                workunit.__dict__[key] = value
+                setattr(workunit, key, value)
     
     def __str__(self):
         return 'Batch: %s @ %s' % (self.workunits.keys(), self.worker)
@@ -420,7 +420,8 @@ def run_task(request):
     }, [pydra_processor])
 
     try:
-        response = simplejson.dumps(pydra_controller.queue_task(key, args))
+        response = simplejson.dumps(pydra_controller.queue_task(key, args, \
+                                            request.user.username))
     except ControllerException, e:
         response = e.code
 